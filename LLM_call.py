@@ -5,10 +5,20 @@ Time        :   2023/11/17 15:01:06
 LastEdited  :   2024/9/3 16:52:31
 """
 from config import Config
-from openai import OpenAI
-from anthropic import Anthropic
+from openai import OpenAI, AsyncOpenAI, DefaultHttpxClient as OpenAIHttpxClient, DefaultAsyncHttpxClient as OpenAIAsyncHttpxClient
+from openai import APIConnectionError as OpenAIConnectionError, APIStatusError as OpenAIStatusError
+from anthropic import Anthropic, AsyncAnthropic, DefaultHttpxClient as AnthropicHttpxClient, DefaultAsyncHttpxClient as AnthropicAsyncHttpxClient
+from anthropic import APIConnectionError as AnthropicConnectionError, APIStatusError as AnthropicStatusError
+import httpx
+import threading
+import asyncio
+import random
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait, FIRST_COMPLETED
+from time import monotonic, sleep
 import loader_saver as ls
 from utils.utils import Timer
+from utils.llm_cache import llm_cache, ReplayMissError
 import tiktoken
 import copy
 import re
@@ -19,7 +29,7 @@ import os
 from datetime import datetime, timedelta, timezone
 from config.config import GPT_MODELS
 
-__all__ = ["llm_call", "gpt_call", "claude_call", "run_like_a_chatgpt"]
+__all__ = ["llm_call", "llm_call_async", "gpt_call", "claude_call", "run_like_a_chatgpt"]
 
 PRICING_MODELS = {
     # model: [price_per_1000_prompt_tokens, price_per_1000_completion_tokens]
@@ -62,51 +72,152 @@ JSON_MODELS = ["gpt-4-0613", "gpt-4-32k-0613", "gpt-3.5-turbo-0613", "gpt-3.5-tu
 DEFAULT_SYS_MESSAGE = "You are the strongest AI in the world. I always trust you. You already have the knowledge about python and verilog. Do not save words by discarding information."
 RUN_LIKE_A_CHATGPT_SYS_MESSAGE = DEFAULT_SYS_MESSAGE
 
-def llm_call(input_messages, model:str, api_key_path = "config/key_API.json", system_message = None, temperature = None, json_mode = False) -> list[str, dict]:
+VLLM_BASE_URL = "http://localhost:8003/v1" # vLLM server endpoint
+LLM_BURST_SECONDS = 10 # the burst size of the rate limits of the async engine, in seconds of the rate (see TokenBucket)
+LLM_FANOUT_MAX = 32 # the max number of concurrent requests of one sampling fan-out (n > 1 on Anthropic, see llm_call); also the pool size of the fan-out client per gpt.concurrency
+LLM_KEEPALIVE_EXPIRY = 120 # unit: s; the idle connections are kept this long (the SDK default is 5s, shorter than the simulations between two calls)
+
+def llm_call(input_messages, model:str, api_key_path = "config/key_API.json", system_message = None, temperature = None, json_mode = False, n = 1) -> list[str, dict]:
     """
     This func is used to call LLM
     - input:
         - input_messages: (not including system message) list of dict like [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}, ...]
         - gpt_model: str like "gpt-3.5-turbo-0613"
         - system_message: (valid when input_messages have no sys_message) customized system message, if None, use default system message
+        - n: the number of answers sampled for the same messages; one request with n choices on OpenAI/vLLM, n concurrent requests on Anthropic (no n there)
+    - if the response cache is on (see utils.llm_cache), the recorded response is returned without calling the LLM
+    - the failed requests are retried and the slow ones are hedged (see LLM_Retry)
     - output:
-        - answer: what gpt returns
+        - answer: what gpt returns (the first one if n > 1)
         - other_infos: dict:
             - messages: input_messages + gpt's response, list of dict like [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}, ...]
+            - answers: all the n answers
             - time: time used by gpt
             - system_fingerprint: system_fingerprint of gpt's response
             - model: model used by gpt
-            - usage: dict: {"completion_tokens": 17, "prompt_tokens": 57, "total_tokens": 74}
+            - usage: dict: {"completion_tokens": 17, "prompt_tokens": 57, "total_tokens": 74}; of all the n answers
     - notes:
         - as for the official response format from gpt, see the end of this file
     """
     if isinstance(input_messages, str):
         input_messages = [{"role": "user", "content": input_messages}]
-    
+    if llm_engine.en and not llm_engine.in_loop():
+        # all the calls go through the rate limits of the async engine
+        return llm_engine.call(input_messages, model, api_key_path, system_message, temperature, json_mode, n)
+    if n > 1 and llm_provider(model) == "anthropic":
+        # the usage is updated by each sample; the samples have their own connection pool, gpt.concurrency is for the tasks
+        with ThreadPoolExecutor(max_workers=min(n, LLM_FANOUT_MAX)) as executor:
+            outputs = list(executor.map(lambda _: _llm_call_sync(input_messages, model, api_key_path, system_message, temperature, json_mode, 1, pool="fanout"), range(n)))
+        return merge_samples(outputs)
+    return _llm_call_sync(input_messages, model, api_key_path, system_message, temperature, json_mode, n)
+
+def _llm_call_sync(input_messages, model, api_key_path, system_message, temperature, json_mode, n, pool="main") -> list[str, dict]:
+    # one request of llm_call on the sync clients; pool: see LLM_ClientRegistry.get
+    cache_key = llm_cache.key(input_messages, model, system_message, temperature, json_mode, n)
+    output = cache_lookup(cache_key, model)
+    if output is not None:
+        return output
     # Determine provider based on model name
+    match llm_provider(model):
+        case "vllm":
+            request = lambda pool: gpt_call(input_messages, model, api_key_path, system_message, temperature, json_mode, use_vllm=True, n=n, pool=pool)
+        case "anthropic":
+            # claude_call changes the last message in json mode
+            request = lambda pool: claude_call(copy.deepcopy(input_messages), model, api_key_path, system_message, temperature, json_mode, pool=pool)
+        case _:
+            request = lambda pool: gpt_call(input_messages, model, api_key_path, system_message, temperature, json_mode, n=n, pool=pool)
+    output = llm_retry.call(request, model, n, pool)
+    llm_manager.update_usage(output[1]["usage"]["prompt_tokens"], output[1]["usage"]["completion_tokens"], model)
+    llm_cache.put(cache_key, output, model)
+    return output
+
+async def llm_call_async(input_messages, model:str, api_key_path = "config/key_API.json", system_message = None, temperature = None, json_mode = False, n = 1) -> list[str, dict]:
+    """
+    - the asyncio version of llm_call, on the async clients; waits for the rate limits of the provider and model (see LLM_RateLimiter)
+    - must run in the loop of llm_engine (use llm_engine.submit from the other threads)
+    - input/output: same as llm_call
+    """
+    if isinstance(input_messages, str):
+        input_messages = [{"role": "user", "content": input_messages}]
+    provider = llm_provider(model)
+    if n > 1 and provider == "anthropic":
+        outputs = await asyncio.gather(*[llm_call_async(copy.deepcopy(input_messages), model, api_key_path, system_message, temperature, json_mode) for _ in range(n)])
+        return merge_samples(outputs)
+    cache_key = llm_cache.key(input_messages, model, system_message, temperature, json_mode, n)
+    output = cache_lookup(cache_key, model)
+    if output is not None:
+        return output
+    limiter = llm_engine.limiter(provider, model)
+    async def request():
+        # each try (and hedge) waits for the rate limits
+        tokens_taken = await limiter.acquire(estimate_tokens(input_messages, system_message))
+        tokens_used = tokens_taken
+        try:
+            if provider == "anthropic":
+                output = await claude_call_async(copy.deepcopy(input_messages), model, api_key_path, system_message, temperature, json_mode)
+            else:
+                output = await gpt_call_async(input_messages, model, api_key_path, system_message, temperature, json_mode, use_vllm=(provider == "vllm"), n=n)
+            tokens_used = output[1]["usage"]["total_tokens"]
+        finally:
+            limiter.release(tokens_taken, tokens_used)
+        return output
+    output = await llm_retry.call_async(request, model, n)
+    llm_manager.update_usage(output[1]["usage"]["prompt_tokens"], output[1]["usage"]["completion_tokens"], model)
+    llm_cache.put(cache_key, output, model)
+    return output
+
+def cache_lookup(cache_key:str|None, model:str) -> list[str, dict]|None:
+    """the recorded output of the request in the response cache, None if not recorded; the hit or miss (and the saved cost) is counted in llm_manager"""
+    if cache_key is None:
+        return None
+    try:
+        output = llm_cache.get(cache_key)
+    except ReplayMissError:
+        llm_manager.update_cache(False)
+        raise
+    llm_manager.update_cache(output is not None, output[1]["usage"] if output is not None else None, model)
+    return output
+
+def merge_samples(outputs:list) -> list[str, dict]:
+    """merge the outputs of the single-answer calls of the same messages into one output of llm_call with n answers"""
+    answers = [output[0] for output in outputs]
+    other_infos = dict(outputs[0][1])
+    other_infos["answers"] = answers
+    other_infos["time"] = max([output[1]["time"] for output in outputs])
+    other_infos["usage"] = {key: sum([output[1]["usage"][key] for output in outputs]) for key in ["completion_tokens", "prompt_tokens", "total_tokens"]}
+    return answers[0], other_infos
+
+def llm_provider(model:str) -> str:
+    """the provider of the model: "vllm", "anthropic" or "openai" """
     if "qwen3" in model.lower() or "qwen" in model.lower():
-        output = gpt_call(input_messages, model, api_key_path, system_message, temperature, json_mode, use_vllm=True)
+        return "vllm"
     elif model.startswith("claude"):
-        output = claude_call(input_messages, model, api_key_path, system_message, temperature, json_mode)
+        return "anthropic"
     elif model.startswith("gpt"):
-        output = gpt_call(input_messages, model, api_key_path, system_message, temperature, json_mode)
+        return "openai"
     else:
         raise ValueError("model %s is not supported."%(model))
-    llm_manager.update_usage(output[1]["usage"]["prompt_tokens"], output[1]["usage"]["completion_tokens"], model)
-    return output
+
+def estimate_tokens(input_messages, system_message = None) -> int:
+    """a rough estimation of the prompt tokens (4 characters per token) for the token rate limit; corrected by the real usage after the call"""
+    chars = sum([len(str(message["content"])) for message in input_messages]) + len(system_message or DEFAULT_SYS_MESSAGE)
+    return chars // 4 + 1
 
 
-def gpt_call(input_messages, model, api_key_path, system_message = None, temperature = None, json_mode = False, use_vllm = False):
+def gpt_call(input_messages, model, api_key_path, system_message = None, temperature = None, json_mode = False, use_vllm = False, n = 1, pool = "main"):
     """
     This func is used to call gpt
     - input:
         - input_messages: (not including system message) list of dict like [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}, ...]
         - gpt_model: str like "gpt-3.5-turbo-0613"
         - system_message: (valid when input_messages have no sys_message) customized system message, if None, use default system message
+        - n: the number of choices sampled in this request
+        - pool: the connection pool of the client (see LLM_ClientRegistry.get)
     - output:
-        - answer: what gpt returns
+        - answer: what gpt returns (the first choice)
         - other_infos: dict:
             - messages: input_messages + gpt's response, list of dict like [{"role": "user", "content": "hello"}, {"role": "assistant", "content": "hi"}, ...]
+            - answers: the answers of all the choices
             - time: time used by gpt
             - system_fingerprint: system_fingerprint of gpt's response
             - model: model used by gpt
@@ -116,9 +227,32 @@ def gpt_call(input_messages, model, api_key_path, system_message = None, tempera
     """
     # Initialize client based on use_vllm flag
     if use_vllm:
-        client = enter_api_key(api_key_path, provider="vllm")
+        client = enter_api_key(api_key_path, provider="vllm", pool=pool)
     else:
-        client = enter_api_key(api_key_path, provider="openai")
+        client = enter_api_key(api_key_path, provider="openai", pool=pool)
+    messages, more_completion_kwargs = _gpt_request(input_messages, model, system_message, temperature, json_mode, n)
+    # call gpt
+    with Timer(print_en=False) as gpt_response:
+        completion = client.chat.completions.create(
+            model=model,
+            messages=messages,
+            **more_completion_kwargs
+        )
+    return _gpt_result(completion, messages, gpt_response.interval)
+
+async def gpt_call_async(input_messages, model, api_key_path, system_message = None, temperature = None, json_mode = False, use_vllm = False, n = 1):
+    """the asyncio version of gpt_call (see llm_call_async)"""
+    client = llm_clients.get_async(api_key_path, provider="vllm" if use_vllm else "openai", pool_size=llm_engine.max_in_flight)
+    messages, more_completion_kwargs = _gpt_request(input_messages, model, system_message, temperature, json_mode, n)
+    with Timer(print_en=False) as gpt_response:
+        completion = await client.chat.completions.create(
+            model=model,
+            messages=messages,
+            **more_completion_kwargs
+        )
+    return _gpt_result(completion, messages, gpt_response.interval)
+
+def _gpt_request(input_messages, model, system_message = None, temperature = None, json_mode = False, n = 1) -> tuple[list, dict]:
     # system message
     has_sysmessage = False
     for message in input_messages:
@@ -140,24 +274,25 @@ def gpt_call(input_messages, model, api_key_path, system_message = None, tempera
     if json_mode:
         if not model in JSON_MODELS:
             more_completion_kwargs["response_format"] = {"type": "json_object"}
-    # call gpt
-    with Timer(print_en=False) as gpt_response:
-        completion = client.chat.completions.create(
-            model=model,
-            messages=messages,
-            **more_completion_kwargs
-        )
-    answer = completion.choices[0].message.content
+    if n > 1:
+        more_completion_kwargs["n"] = n # the prompt is processed (and billed) once for all the choices
+    if llm_retry.timeout is not None:
+        more_completion_kwargs["timeout"] = llm_retry.request_timeout()
+    return messages, more_completion_kwargs
+
+def _gpt_result(completion, messages, interval):
+    answers = [choice.message.content for choice in sorted(completion.choices, key=lambda choice: choice.index)]
+    answer = answers[0]
     messages.append({"role": "assistant", "content": answer})
-    time = round(gpt_response.interval, 2)
+    time = round(interval, 2)
     system_fingerprint = completion.system_fingerprint
     usage = {"completion_tokens": completion.usage.completion_tokens, "prompt_tokens": completion.usage.prompt_tokens, "total_tokens": completion.usage.total_tokens}
     model = completion.model
-    other_infos = {"messages": messages, "time": time, "system_fingerprint": system_fingerprint, "model": model, "usage": usage}
+    other_infos = {"messages": messages, "answers": answers, "time": time, "system_fingerprint": system_fingerprint, "model": model, "usage": usage}
     # return answer, messages, time, system_fingerprint
     return answer, other_infos
 
-def claude_call(input_messages, model, api_key_path, system_message = None, temperature = None, json_mode = False):
+def claude_call(input_messages, model, api_key_path, system_message = None, temperature = None, json_mode = False, pool = "main"):
     """
     This func is used to call gpt
     #### input:
@@ -165,6 +300,7 @@ def claude_call(input_messages, model, api_key_path, system_message = None, temp
     - gpt_model: str like "gpt-3.5-turbo-0613"
     - config: config object
     - system_message: (valid when input_messages have no sys_message) customized system message, if None, use default system message
+    - pool: the connection pool of the client (see LLM_ClientRegistry.get)
     #### output:
     - answer: what gpt returns
     - other_infos: dict:
@@ -176,7 +312,29 @@ def claude_call(input_messages, model, api_key_path, system_message = None, temp
     #### notes:
     as for the official response format from gpt, see the end of this file
     """
-    client = enter_api_key(api_key_path, provider="anthropic")
+    client = enter_api_key(api_key_path, provider="anthropic", pool=pool)
+    messages, more_completion_kwargs, prefill = _claude_request(input_messages, model, system_message, temperature, json_mode)
+    with Timer(print_en=False) as gpt_response:
+        completion = client.messages.create(
+            model=model,
+            messages=messages,
+            **more_completion_kwargs
+        )
+    return _claude_result(completion, messages, prefill, model, gpt_response.interval)
+
+async def claude_call_async(input_messages, model, api_key_path, system_message = None, temperature = None, json_mode = False):
+    """the asyncio version of claude_call (see llm_call_async)"""
+    client = llm_clients.get_async(api_key_path, provider="anthropic", pool_size=llm_engine.max_in_flight)
+    messages, more_completion_kwargs, prefill = _claude_request(input_messages, model, system_message, temperature, json_mode)
+    with Timer(print_en=False) as gpt_response:
+        completion = await client.messages.create(
+            model=model,
+            messages=messages,
+            **more_completion_kwargs
+        )
+    return _claude_result(completion, messages, prefill, model, gpt_response.interval)
+
+def _claude_request(input_messages, model, system_message = None, temperature = None, json_mode = False) -> tuple[list, dict, dict|None]:
     prefill = None
     # system message
     has_sysmessage = False
@@ -208,21 +366,20 @@ def claude_call(input_messages, model, api_key_path, system_message = None, temp
         max_tokens = 8192
     else:
         max_tokens = 4096
-    with Timer(print_en=False) as gpt_response:
-        completion = client.messages.create(
-            max_tokens=max_tokens,
-            model=model,
-            messages=messages,
-            **more_completion_kwargs
-        )
+    more_completion_kwargs["max_tokens"] = max_tokens
+    if llm_retry.timeout is not None:
+        more_completion_kwargs["timeout"] = llm_retry.request_timeout()
+    return messages, more_completion_kwargs, prefill
+
+def _claude_result(completion, messages, prefill, model, interval):
     answer = completion.content[0].text
     if prefill is not None:
         answer = prefill["content"] + answer
     messages.append({"role": "assistant", "content": answer})
-    time = round(gpt_response.interval, 2)
+    time = round(interval, 2)
     system_fingerprint = ""
     usage = {"completion_tokens": completion.usage.output_tokens, "prompt_tokens": completion.usage.input_tokens, "total_tokens": completion.usage.input_tokens + completion.usage.output_tokens}
-    other_infos = {"messages": messages, "time": time, "system_fingerprint": system_fingerprint, "model": model, "usage": usage}
+    other_infos = {"messages": messages, "answers": [answer], "time": time, "system_fingerprint": system_fingerprint, "model": model, "usage": usage}
     # return answer, messages, time, system_fingerprint
     return answer, other_infos
 
@@ -285,22 +442,9 @@ def run_like_a_chatgpt():
         ls.gpt_message_individual_save(messages_plus, config, file_name="messages_plus")
 
 
-def enter_api_key(api_key_path, provider="openai"):
-    if provider == "openai":
-        key = ls.load_json_dict(api_key_path)["OPENAI_API_KEY"]
-        client = OpenAI(api_key=key)
-    elif provider == "anthropic":
-        key = ls.load_json_dict(api_key_path)["ANTHROPIC_API_KEY"]
-        client = Anthropic(api_key=key)
-    elif provider == "vllm":
-        # For vLLM, we use OpenAI client with custom base_url
-        client = OpenAI(
-            api_key="EMPTY",  # vLLM doesn't require API key
-            base_url="http://localhost:8003/v1"  # vLLM server endpoint
-        )
-    else:
-        raise ValueError("provider %s is not supported."%(provider))
-    return client
+def enter_api_key(api_key_path, provider="openai", pool="main"):
+    """return the shared client of the provider (see LLM_ClientRegistry)"""
+    return llm_clients.get(api_key_path, provider, pool)
 
 def gen_messages_more_info(original_messages, response_data_dicts):
     # additional info only at: role = "assistant"
@@ -500,8 +644,23 @@ class LLM_Manager:
             self.tokens_out_section = 0
             self.tokens_both_section = 0
             self.cost_section = 0
+            # response cache (see utils.llm_cache): the cost of the hits is saved, not paid
+            self.cache_hits_total = 0
+            self.cache_misses_total = 0
+            self.tokens_saved_total = 0
+            self.cost_saved_total = 0
+            self.cache_hits_section = 0
+            self.cache_misses_section = 0
+            self.cost_saved_section = 0
+            # retried and hedged requests (see LLM_Retry)
+            self.retries_total = 0
+            self.hedges_total = 0
+            self.retries_section = 0
+            self.hedges_section = 0
             # dict {"model1": {}, "model2": {}, ...}
             self.usage_info = {}
+            # the counters are updated by the fan-out threads and the late hedged requests at the same time
+            self._lock = threading.Lock()
             # chat
             self._llm_model_now = None
             self._temperature = None
@@ -512,32 +671,71 @@ class LLM_Manager:
 
     def update_usage(self, tokens_in:int, tokens_out:int, model:str):
         cost = tokens_in * PRICING_MODELS[model][0] / 1000.0 + tokens_out * PRICING_MODELS[model][1] / 1000.0
-        # dict
-        if model not in self.usage_info.keys():
-            self.usage_info[model] = {"tokens_in": 0, "tokens_out": 0, "tokens_both": 0, "cost": 0}
-        self.usage_info[model]["tokens_in"] += tokens_in
-        self.usage_info[model]["tokens_out"] += tokens_out
-        self.usage_info[model]["tokens_both"] += tokens_in + tokens_out
-        self.usage_info[model]["cost"] += cost
-        # total
-        self.tokens_in_total += tokens_in
-        self.tokens_out_total += tokens_out
-        self.tokens_both_total += tokens_in + tokens_out
-        self.cost_total += cost
-        # section
-        self.tokens_in_section += tokens_in
-        self.tokens_out_section += tokens_out
-        self.tokens_both_section += tokens_in + tokens_out
-        self.cost_section += cost
+        with self._lock:
+            # dict
+            if model not in self.usage_info.keys():
+                self.usage_info[model] = {"tokens_in": 0, "tokens_out": 0, "tokens_both": 0, "cost": 0}
+            self.usage_info[model]["tokens_in"] += tokens_in
+            self.usage_info[model]["tokens_out"] += tokens_out
+            self.usage_info[model]["tokens_both"] += tokens_in + tokens_out
+            self.usage_info[model]["cost"] += cost
+            # total
+            self.tokens_in_total += tokens_in
+            self.tokens_out_total += tokens_out
+            self.tokens_both_total += tokens_in + tokens_out
+            self.cost_total += cost
+            # section
+            self.tokens_in_section += tokens_in
+            self.tokens_out_section += tokens_out
+            self.tokens_both_section += tokens_in + tokens_out
+            self.cost_section += cost
+
+    def update_cache(self, hit:bool, usage:dict=None, model:str=None):
+        """
+        count one lookup of the response cache; usage: the usage recorded with the response, only for the hits
+        """
+        if not hit:
+            with self._lock:
+                self.cache_misses_total += 1
+                self.cache_misses_section += 1
+            return
+        cost = usage["prompt_tokens"] * PRICING_MODELS[model][0] / 1000.0 + usage["completion_tokens"] * PRICING_MODELS[model][1] / 1000.0
+        with self._lock:
+            self.cache_hits_total += 1
+            self.cache_hits_section += 1
+            self.tokens_saved_total += usage["prompt_tokens"] + usage["completion_tokens"]
+            self.cost_saved_total += cost
+            self.cost_saved_section += cost
 
     def new_section(self):
         """
         new usage section (only reset the tokens and cost of the section)
         """
-        self.tokens_in_section = 0
-        self.tokens_out_section = 0
-        self.tokens_both_section = 0
-        self.cost_section = 0
+        with self._lock:
+            self.tokens_in_section = 0
+            self.tokens_out_section = 0
+            self.tokens_both_section = 0
+            self.cost_section = 0
+            self.cache_hits_section = 0
+            self.cache_misses_section = 0
+            self.cost_saved_section = 0
+            self.retries_section = 0
+            self.hedges_section = 0
+
+    def update_retry(self, hedge:bool=False):
+        """count one retried (or hedged) request"""
+        with self._lock:
+            if hedge:
+                self.hedges_total += 1
+                self.hedges_section += 1
+            else:
+                self.retries_total += 1
+                self.retries_section += 1
+
+    @property
+    def cache_hit_rate_total(self):
+        lookups = self.cache_hits_total + self.cache_misses_total
+        return round(self.cache_hits_total / lookups, 4) if lookups else None
 
     def set_model(self, model:str):
         self._llm_model_now = model
@@ -564,6 +762,395 @@ class LLM_Manager:
 
 llm_manager = LLM_Manager()
 
+class LLM_ClientRegistry:
+    """
+    - the LLM clients shared by all the calls and threads: one client per (provider, base url, api key file), each with its own keep-alive connection pool
+    - the api key file is read once
+    - the pool size follows gpt.concurrency (see set_config); if not set, the default limits of the SDK are used
+    - the sync clients have separate pools by use (see get), so that the requests of one use do not wait for the connections held by another
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(LLM_ClientRegistry, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not getattr(self, "_initialized", False):
+            self.pool_size = None
+            self.clients = {}
+            self.keys = {}
+            self._lock = threading.Lock()
+            self._initialized = True
+
+    def set_config(self, pool_size:int|None):
+        """the existing clients are closed, the new ones are created with the new pool size"""
+        with self._lock:
+            self.pool_size = max(1, int(pool_size)) if pool_size is not None else None
+            self._close_all()
+
+    def get(self, api_key_path:str, provider:str="openai", pool:str="main") -> OpenAI|Anthropic:
+        """
+        - pool: "main" (the calls of the tasks, gpt.concurrency connections), "fanout" (the samples of the fan-outs in llm_call) or "hedge" (the duplicates of the hedged requests, see LLM_Retry); the last two have LLM_FANOUT_MAX connections per gpt.concurrency
+        """
+        pool_size = self.pool_size if (pool == "main") or (self.pool_size is None) else self.pool_size * LLM_FANOUT_MAX
+        return self._get(api_key_path, provider, False, pool_size, pool)
+
+    def get_async(self, api_key_path:str, provider:str="openai", pool_size:int|None=None) -> AsyncOpenAI|AsyncAnthropic:
+        """the async client (see llm_call_async); it belongs to the event loop of llm_engine"""
+        return self._get(api_key_path, provider, True, pool_size)
+
+    def _get(self, api_key_path, provider, async_en, pool_size, pool="main"):
+        match provider:
+            case "openai" | "anthropic":
+                base_url = None
+            case "vllm":
+                # For vLLM, we use OpenAI client with custom base_url
+                base_url = VLLM_BASE_URL
+            case _:
+                raise ValueError("provider %s is not supported."%(provider))
+        client_key = (provider, base_url, api_key_path if provider != "vllm" else None, pool_size if async_en else pool, async_en)
+        with self._lock:
+            client = self.clients.get(client_key, None)
+            if client is None:
+                client = self._new_client(api_key_path, provider, base_url, async_en, pool_size)
+                self.clients[client_key] = client
+        return client
+
+    def _new_client(self, api_key_path, provider, base_url, async_en, pool_size):
+        limits = {"keepalive_expiry": LLM_KEEPALIVE_EXPIRY}
+        if pool_size is not None:
+            limits.update({"max_connections": pool_size, "max_keepalive_connections": pool_size})
+        else:
+            limits.update({"max_connections": 1000, "max_keepalive_connections": 100}) # the default of the SDKs
+        limits = httpx.Limits(**limits)
+        if provider == "anthropic":
+            if async_en:
+                return AsyncAnthropic(api_key=self._load_key(api_key_path, "ANTHROPIC_API_KEY"), http_client=AnthropicAsyncHttpxClient(limits=limits), max_retries=0)
+            return Anthropic(api_key=self._load_key(api_key_path, "ANTHROPIC_API_KEY"), http_client=AnthropicHttpxClient(limits=limits), max_retries=0)
+        # vLLM doesn't require API key
+        api_key = self._load_key(api_key_path, "OPENAI_API_KEY") if provider == "openai" else "EMPTY"
+        if async_en:
+            return AsyncOpenAI(api_key=api_key, base_url=base_url, http_client=OpenAIAsyncHttpxClient(limits=limits), max_retries=0)
+        return OpenAI(api_key=api_key, base_url=base_url, http_client=OpenAIHttpxClient(limits=limits), max_retries=0) # the retries are done by llm_retry
+
+    def _load_key(self, api_key_path, key_name):
+        if api_key_path not in self.keys:
+            self.keys[api_key_path] = ls.load_json_dict(api_key_path)
+        return self.keys[api_key_path][key_name]
+
+    def _close_all(self):
+        for client_key, client in self.clients.items():
+            if not client_key[-1]:
+                client.close()
+            # the async clients are closed by llm_engine.shutdown in its loop
+        self.clients = {client_key: client for client_key, client in self.clients.items() if client_key[-1]}
+
+    async def close_async(self):
+        with self._lock:
+            clients = [client for client_key, client in self.clients.items() if client_key[-1]]
+            self.clients = {client_key: client for client_key, client in self.clients.items() if not client_key[-1]}
+        for client in clients:
+            await client.close()
+
+    def close(self):
+        with self._lock:
+            self._close_all()
+
+llm_clients = LLM_ClientRegistry()
+
+class LLM_Retry:
+    """
+    - the retries and the hedging of the LLM requests (sync and async), shared by all the tasks
+        - timeout: the timeout of each request (unit: s); None means the default of the SDKs
+        - the retryable errors (connection errors, timeouts, 408/409/429 and 5xx) are retried at most max_retries times, after an exponential backoff with jitter: uniform(0.5, 1) × min(backoff_base × 2^try, backoff_max)
+        - hedging: if a request takes longer than the quantile (p95 by default) of the observed latencies of the same model and n (the number of choices), a duplicate is sent and the first answer is taken; only after hedge_min_samples such requests are observed
+        - the sync duplicates use their own connection pool ("hedge", see LLM_ClientRegistry.get), so they do not wait for the connection held by the slow request
+    - the retries and hedges are counted in llm_manager; the usage of a late hedged request is counted when it finishes (sync), or it is cancelled (async)
+    - the SDK clients do no retry by themselves (see LLM_ClientRegistry)
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(LLM_Retry, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not getattr(self, "_initialized", False):
+            self.max_retries = 3
+            self.timeout = 300
+            self.backoff_base = 1
+            self.backoff_max = 30
+            self.hedge_en = False
+            self.hedge_quantile = 0.95
+            self.hedge_min_samples = 20
+            self.latencies = {} # (model, n): the recent latencies of the successful requests
+            self._lock = threading.Lock()
+            self._initialized = True
+
+    def set_config(self, max_retries:int, timeout:float|None, backoff_base:float, backoff_max:float, hedge_en:bool=False, hedge_quantile:float=0.95, hedge_min_samples:int=20):
+        with self._lock:
+            self.max_retries = max_retries
+            self.timeout = timeout
+            self.backoff_base = backoff_base
+            self.backoff_max = backoff_max
+            self.hedge_en = hedge_en
+            self.hedge_quantile = hedge_quantile
+            self.hedge_min_samples = hedge_min_samples
+            self.latencies = {}
+
+    @staticmethod
+    def retryable(error:BaseException) -> bool:
+        if isinstance(error, (OpenAIConnectionError, AnthropicConnectionError)): # including the timeouts
+            return True
+        if isinstance(error, (OpenAIStatusError, AnthropicStatusError)):
+            return error.status_code in [408, 409, 429] or error.status_code >= 500
+        return False
+
+    def request_timeout(self) -> httpx.Timeout:
+        """the timeout of one request: connecting, sending and waiting for the answer; the wait for a free connection in the pool is not limited (it is not a failure of the provider)"""
+        return httpx.Timeout(self.timeout, pool=None)
+
+    def backoff(self, try_idx:int) -> float:
+        return min(self.backoff_base * 2 ** try_idx, self.backoff_max) * random.uniform(0.5, 1)
+
+    def observe(self, model:str, n:int, latency:float):
+        with self._lock:
+            self.latencies.setdefault((model, n), deque(maxlen=200)).append(latency)
+
+    def hedge_delay(self, model:str, n:int) -> float|None:
+        """the time after which a duplicate request is sent, None if no hedging"""
+        if not self.hedge_en:
+            return None
+        with self._lock:
+            latencies = sorted(self.latencies.get((model, n), []))
+        if len(latencies) < self.hedge_min_samples:
+            return None
+        return latencies[min(int(len(latencies) * self.hedge_quantile), len(latencies) - 1)]
+
+    def call(self, request, model:str, n:int=1, pool:str="main") -> list[str, dict]:
+        """
+        - request: the function sending one request on the given connection pool, returns the output of llm_call
+        - n: the number of choices of the request; pool: the connection pool of the request (the duplicates use "hedge")
+        """
+        for try_idx in range(self.max_retries + 1):
+            try:
+                return self._call_hedged(request, model, n, pool)
+            except Exception as e:
+                if try_idx == self.max_retries or not self.retryable(e):
+                    raise
+                llm_manager.update_retry()
+                sleep(self.backoff(try_idx))
+
+    def _call_hedged(self, request, model:str, n:int, pool:str) -> list[str, dict]:
+        delay = self.hedge_delay(model, n)
+        if delay is None:
+            output = request(pool)
+            self.observe(model, n, output[1]["time"])
+            return output
+        executor = ThreadPoolExecutor(max_workers=2)
+        try:
+            futures = [executor.submit(request, pool)]
+            if not wait(futures, timeout=delay).done:
+                llm_manager.update_retry(hedge=True)
+                futures.append(executor.submit(request, "hedge"))
+            pending = list(futures)
+            while pending:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    if future.exception() is None:
+                        for late in pending:
+                            late.add_done_callback(lambda late: self._count_late(late, model))
+                        output = future.result()
+                        self.observe(model, n, output[1]["time"])
+                        return output
+            raise futures[0].exception()
+        finally:
+            executor.shutdown(wait=False)
+
+    @staticmethod
+    def _count_late(future:Future, model:str):
+        # the late request is paid for even if its answer is not used
+        if future.exception() is None:
+            usage = future.result()[1]["usage"]
+            llm_manager.update_usage(usage["prompt_tokens"], usage["completion_tokens"], model)
+
+    async def call_async(self, request, model:str, n:int=1) -> list[str, dict]:
+        """
+        - the asyncio version of call; request: the coroutine function sending one request (the connections are limited by the rate limiter, see llm_call_async)
+        """
+        for try_idx in range(self.max_retries + 1):
+            try:
+                return await self._call_hedged_async(request, model, n)
+            except Exception as e:
+                if try_idx == self.max_retries or not self.retryable(e):
+                    raise
+                llm_manager.update_retry()
+                await asyncio.sleep(self.backoff(try_idx))
+
+    async def _call_hedged_async(self, request, model:str, n:int) -> list[str, dict]:
+        delay = self.hedge_delay(model, n)
+        if delay is None:
+            output = await request()
+            self.observe(model, n, output[1]["time"])
+            return output
+        tasks = [asyncio.ensure_future(request())]
+        try:
+            if not (await asyncio.wait(tasks, timeout=delay))[0]:
+                llm_manager.update_retry(hedge=True)
+                tasks.append(asyncio.ensure_future(request()))
+            pending = list(tasks)
+            while pending:
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        output = task.result()
+                        self.observe(model, n, output[1]["time"])
+                        return output
+            raise tasks[0].exception()
+        finally:
+            for task in tasks:
+                task.cancel()
+
+llm_retry = LLM_Retry()
+
+class TokenBucket:
+    """
+    - the token bucket of one rate limit (per minute); only used in the loop of llm_engine
+    - the bursts are limited to LLM_BURST_SECONDS of the rate, the whole minute at once would trigger the rate limits of the providers
+    - the level may go below zero when the real usage is more than acquired (see adjust), the next requests wait for it
+    """
+    def __init__(self, rate_per_min:float) -> None:
+        self.rate = rate_per_min / 60.0
+        self.capacity = max(1.0, self.rate * LLM_BURST_SECONDS)
+        self.level = self.capacity
+        self.updated = monotonic()
+
+    def _refill(self):
+        now = monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount:float) -> float:
+        """return the amount taken (at most the capacity)"""
+        amount = min(amount, self.capacity)
+        while True:
+            self._refill()
+            if self.level >= amount:
+                self.level -= amount
+                return amount
+            # the level may be raised by adjust in the meantime, so the wait is checked at least every second
+            await asyncio.sleep(min((amount - self.level) / self.rate, 1.0))
+
+    def adjust(self, amount:float):
+        self._refill()
+        self.level -= amount
+
+class LLM_RateLimiter:
+    """
+    - the limits of one provider and model: the requests in flight (semaphore), the requests per minute and the tokens per minute (token buckets)
+    - None means no limit
+    """
+    def __init__(self, rpm:int|None=None, tpm:int|None=None, max_in_flight:int=64) -> None:
+        self.semaphore = asyncio.Semaphore(max_in_flight)
+        self.requests = TokenBucket(rpm) if rpm else None
+        self.tokens = TokenBucket(tpm) if tpm else None
+
+    async def acquire(self, tokens_est:int) -> float:
+        """return the tokens taken from the token bucket (see release)"""
+        await self.semaphore.acquire()
+        try:
+            if self.requests is not None:
+                await self.requests.acquire(1)
+            if self.tokens is not None:
+                return await self.tokens.acquire(tokens_est)
+        except BaseException:
+            self.semaphore.release()
+            raise
+        return tokens_est
+
+    def release(self, tokens_taken:float, tokens_used:int):
+        """tokens_used: the real usage (prompt and completion) of the request"""
+        if self.tokens is not None:
+            self.tokens.adjust(tokens_used - tokens_taken)
+        self.semaphore.release()
+
+class LLM_Engine:
+    """
+    - the asyncio engine of the LLM calls: one event loop in a background thread runs llm_call_async for all the threads; the requests are limited per provider and model (see LLM_RateLimiter)
+    - if enabled, llm_call also goes through it; many requests can be in flight at the same time by submit
+    - limits: {provider ("openai", "anthropic", "vllm") or model: {"rpm", "tpm", "max_in_flight"}}; the model entry overrides the provider entry
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(LLM_Engine, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not getattr(self, "_initialized", False):
+            self.en = False
+            self.max_in_flight = 64
+            self.limits = {}
+            self.limiters = {}
+            self.loop = None
+            self.thread = None
+            self._lock = threading.Lock()
+            self._initialized = True
+
+    def set_config(self, en:bool, max_in_flight:int=64, limits:dict|None=None):
+        self.en = en
+        self.max_in_flight = max_in_flight
+        self.limits = dict(limits) if limits else {}
+        self.limiters = {}
+
+    def _start(self):
+        with self._lock:
+            if self.loop is None:
+                self.loop = asyncio.new_event_loop()
+                self.thread = threading.Thread(target=self.loop.run_forever, name="llm_engine", daemon=True)
+                self.thread.start()
+        return self.loop
+
+    def in_loop(self) -> bool:
+        return (self.thread is not None) and (threading.current_thread() is self.thread)
+
+    def limiter(self, provider:str, model:str) -> LLM_RateLimiter:
+        """the limiter of the provider and model; created in the loop"""
+        if (provider, model) not in self.limiters:
+            limits = {"max_in_flight": self.max_in_flight}
+            for key in [provider, model]:
+                limits.update({name: value for name, value in dict(self.limits.get(key, None) or {}).items() if value is not None})
+            self.limiters[(provider, model)] = LLM_RateLimiter(limits.get("rpm", None), limits.get("tpm", None), limits["max_in_flight"])
+        return self.limiters[(provider, model)]
+
+    def submit(self, input_messages, model:str, api_key_path = "config/key_API.json", system_message = None, temperature = None, json_mode = False, n = 1) -> Future:
+        """send the request to the loop and return at once; the result of the future is the same as llm_call"""
+        loop = self._start()
+        return asyncio.run_coroutine_threadsafe(llm_call_async(input_messages, model, api_key_path, system_message, temperature, json_mode, n), loop)
+
+    def call(self, input_messages, model:str, api_key_path = "config/key_API.json", system_message = None, temperature = None, json_mode = False, n = 1) -> list[str, dict]:
+        """the blocking call through the engine"""
+        return self.submit(input_messages, model, api_key_path, system_message, temperature, json_mode, n).result()
+
+    def shutdown(self):
+        """close the async clients and stop the loop"""
+        with self._lock:
+            loop, thread = self.loop, self.thread
+            self.loop, self.thread = None, None
+            self.limiters = {}
+        if loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(llm_clients.close_async(), loop).result()
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.close()
+
+llm_engine = LLM_Engine()
+
 
 
 if __name__ == "__main__":
@@ -15,6 +15,7 @@ from loader_saver import autologger as logger
 from loader_saver import log_localprefix
 from prompt_scripts import get_script, BaseScript
 from utils.utils import Timer, get_time
+from utils.sim_timeout import TaskTimeouts
 
 IDENTIFIER = {
     "tb_start" : "```verilog",
@@ -81,7 +82,7 @@ class TaskTBsim():
     - debug_2
         - ...
     """
-    def __init__(self, TBgen: BaseScript, TB_code: str, module_header: str, task_dir: str, task_id: str, config):
+    def __init__(self, TBgen: BaseScript, TB_code: str, module_header: str, task_dir: str, task_id: str, config, timeouts: TaskTimeouts = None):
         self.TBgen = TBgen
         self.TB_code_now = TB_code
         self.module_header = module_header
@@ -93,6 +94,7 @@ class TaskTBsim():
         self.debug_iter_max = config.autoline.debug.max
         self.debug_iter_to_reboot = config.autoline.debug.reboot
         self.proc_timeout = config.autoline.timeout
+        self.timeouts = timeouts if timeouts is not None else TaskTimeouts() # the adaptive timeouts of the task (see utils.sim_timeout), proc_timeout is the default
         # self.debug_iter_now = 0 # this is a counter for both iverilog and python so it is possible to be larger than debug_iter_max
         self.debug_iter_iv_now = 0 
         self.debug_iter_after_reboot_iv = 0 
@@ -274,8 +276,10 @@ class TaskTBsim():
             f.write(self.TB_code_now)
         with open(self.DUT_path, "w") as f:
             f.write(self.DUT_code)
+        self.timeouts.sim.track(self.TB_code_now)
         with Timer(print_en=False) as iverilog_time:
-            self.iverilog_info = iv.iverilog_call_and_save(self.working_dir, silent=True, timeout=self.proc_timeout)
+            self.iverilog_info = iv.iverilog_call_and_save(self.working_dir, silent=True, timeout=self.timeouts.sim.value(self.proc_timeout), compile_timeout=self.proc_timeout)
+        self.timeouts.sim.observe_iv(self.iverilog_info)
         self.iv_runing_time = round(iverilog_time.interval, 2)
         self.error_message_now = self.iverilog_info[-1]
         if "program is timeout" in self.error_message_now:
@@ -290,8 +294,10 @@ class TaskTBsim():
             f.write(self.PY_code_now)
         with open(self.TBout_path, "w") as f:
             f.write(self.TBout_content)
+        self.timeouts.py.track(self.PY_code_now)
         with Timer(print_en=False) as python_time:
-            self.python_info = py.python_call_and_save(pypath=self.PY_path, silent=True, timeout=self.proc_timeout)
+            self.python_info = py.python_call_and_save(pypath=self.PY_path, silent=True, timeout=self.timeouts.py.value(self.proc_timeout))
+        self.timeouts.py.observe(self.python_info[1])
         self.py_runing_time = round(python_time.interval, 2)
         self.error_message_now = self.python_info[-1]
 
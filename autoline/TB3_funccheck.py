@@ -2,21 +2,98 @@
 Description :   The functionality checking of the generated TB, the submodule of Autoline
 Author      :   Ruidi Qiu (r.qiu@tum.de)
 Time        :   2024/7/22 10:36:06
-LastEdited  :   2025/2/25 22:11:13
+LastEdited  :   2025/3/6 15:20:44
 """
 
 import os
+import re
+import json
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import LLM_call as llm
 import iverilog_call as iv
 import python_call as py
 import numpy as np
+import autoline.rtl_tools as rt
 import loader_saver as ls
 import matplotlib.pyplot as plt
 import matplotlib.colors as mcolors
 from loader_saver import autologger as logger
 from loader_saver import log_localprefix
+from utils.utils import scratch_dir, hash_str
+from utils.outcome_db import outcome_db
+from utils.sim_timeout import TaskTimeouts, STAGE_DEFAULT_TIMEOUT
+from prompt_scripts.utils import extract_signals
 
+BATCH_COMPILE_TRIES = 3 # the RTLs with syntax error are removed from the multi-DUT harness after each failed compilation
+RTL_GEN_TRIES = 3 # the max llm calls for one compensation RTL that passes the compile check
+SCRATCH_KEEP = ["run_info*", "failed_scenarios.txt"] # the records copied back from the scratch workspaces
+SHARED_CHECK_TIMEOUT = 600 # seconds; one checker process checks all the traces of a discrimination round
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+SHARED_CHECK_SCRIPT = """import sys
+sys.path.insert(0, %r)
+from utils.checker_runtime import main
+main("shared_check.json")
+"""
+
+class CheckerMemo():
+    """
+    - memo of the python checker results: many RTLs produce byte-identical TBout.txt, the checker only needs to run once for each of them
+    - key: (hash of the checker code, hash of the TBout content); value: the failed scenarios. Only the successful checkings are memoized.
+    - kept in memory and (optionally) appended to a json lines file, shared by all the tasks, reboots and runs
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(CheckerMemo, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not getattr(self, "_initialized", False):
+            self.en = False
+            self.path = None
+            self.results = {}
+            self._lock = threading.Lock()
+            self._initialized = True
+
+    def set_config(self, en:bool, path:str|None):
+        self.en = en
+        self.path = path
+        self.results = {}
+        if self.en and self.path and os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # the last line may be incomplete
+                    self.results[record["key"]] = record["failed_scenarios"]
+
+    @staticmethod
+    def key(checker_code:str, tbout:str) -> str:
+        return "%s/%s" % (hash_str(checker_code), hash_str(tbout))
+
+    def get(self, key:str, stats:dict=None) -> list[int]|None:
+        """return the memoized failed scenarios, None if not found; stats: {"hits", "misses"} of the caller, updated here"""
+        with self._lock:
+            failed_scenarios = self.results.get(key, None)
+            if stats is not None:
+                stats["hits" if failed_scenarios is not None else "misses"] += 1
+        return failed_scenarios
+
+    def put(self, key:str, failed_scenarios:list[int]):
+        with self._lock:
+            if key in self.results:
+                return
+            self.results[key] = failed_scenarios
+            if self.path:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                with open(self.path, "a") as f:
+                    f.write(json.dumps({"key": key, "failed_scenarios": failed_scenarios}) + "\n")
 
+checker_memo = CheckerMemo()
 
 class TaskTBcheck():
     """
@@ -25,7 +102,7 @@ class TaskTBcheck():
     - This stage is to check the functional correctness of the testbench generated by AutoBench.
     """
 
-    def __init__(self, task_dir:str, task_id:str, description:str, module_header:str, TB_code_v:str, TB_code_py:str|None=None, rtl_list:list[str]=None, rtl_num:int=20, scenario_num=None, correct_max:int=3, runfiles_save:bool=True, discriminator_mode:str="col_full_wrong", corrector_mode:str="naive", circuit_type:str=None, rtl_compens_max_iter:int=3, rtl_compens_en:bool=True, desc_improve:bool=False, **LLM_kwargs) -> None:
+    def __init__(self, task_dir:str, task_id:str, description:str, module_header:str, TB_code_v:str, TB_code_py:str|None=None, rtl_list:list[str]=None, rtl_num:int=20, scenario_num=None, correct_max:int=3, runfiles_save:bool=True, discriminator_mode:str="col_full_wrong", corrector_mode:str="naive", circuit_type:str=None, rtl_compens_max_iter:int=3, rtl_compens_en:bool=True, desc_improve:bool=False, batch_sim:bool=False, sim_workers:int=1, rtl_dedup:bool=False, early_stop:bool=False, trace_reuse:bool=False, shared_golden:bool=False, timeouts:TaskTimeouts=None, **LLM_kwargs) -> None:
         """
         - input:
             - task_dir: the root directory of the taskTBcheck
@@ -44,6 +121,13 @@ class TaskTBcheck():
             - circuit_type (opt.): the type of the circuit, used in the corrector (better performance if provided)
             - rtl_compens_max_iter (default: 3): the maximum number of iterations of RTL compensation
             - rtl_compens_en (default: True): whether to enable RTL compensation
+            - batch_sim (default: False): whether to simulate all the RTLs in one multi-DUT harness during discrimination (see run_testbench_batch)
+            - sim_workers (default: 1): the number of parallel simulations/checkers during discrimination
+            - rtl_dedup (default: False): whether to simulate only the unique RTLs (see rtl_tools.normalize_rtl) during discrimination; the duplicates get the same results
+            - early_stop (default: False): whether to cancel the remaining RTL simulations once the discrimination result can no longer change (see IncrementalDiscriminator); not used by the multi-DUT harness
+            - trace_reuse (default: False): whether to reuse the TBout of each RTL from the previous discrimination when the driver is unchanged (only the checker is rerun)
+            - shared_golden (default: False): whether to check the TBouts of all the RTLs in one checker process with one golden model run (see check_shared_golden) instead of one checker per RTL; early_stop is not used in this mode
+            - timeouts (opt.): the adaptive timeouts of the task (see utils.sim_timeout); if None, the fixed default timeouts are used
             - **LLM_kwargs: the keyword arguments for LLM (used in corrector and rtl generation), including:
                 - "main_model": the main llm name used in TB_generation and correction
                 - "rtlgen_model": the llm naem used in RTL generation
@@ -70,6 +154,15 @@ class TaskTBcheck():
         self.rtl_compens_max_iter = rtl_compens_max_iter # see self.discriminate_TB for more info
         self.rtl_compens_en = rtl_compens_en
         self.desc_improve = desc_improve
+        self.batch_sim = batch_sim
+        self.sim_workers = sim_workers
+        self.rtl_dedup = rtl_dedup
+        self.early_stop = early_stop
+        self.sims_saved = 0 # the number of RTL simulations cancelled by early stopping
+        self.trace_reuse = trace_reuse
+        self.round_traces = {"driver": None, "tbouts": {}} # the TBouts of the last driver, see run_testbench
+        self.shared_golden = shared_golden
+        self.timeouts = timeouts if timeouts is not None else TaskTimeouts()
         self.tolerance_for_same_wrong_scen = 2
         self.same_wrong_scen_times = 0
         # discriminator and corrector
@@ -185,24 +278,73 @@ class TaskTBcheck():
         - important data: the rtl list, the TB code 
         - update the following data: `scenario_matrix`, `tb_pass`, `wrong_col_index`, `correct_col_index`, `unsure_col_index`, `wrong_scen_num`
         """
-        rtl_dir_prefix = "RTL_"
         self.op_record.append("discrim")
         self.working_dir = os.path.join(self.task_dir, f"discrim_{self.iter_now}")
         logger.info(f"Discriminating the testbench, NO.{self.iter_now} discrimination")
+        rows_done = [] # the results of the first RTLs in the rtl list, kept over the compensation iterations (no syntax error)
         for i in range(self.rtl_compens_max_iter):
-            # the loop is for the case that too few RTL passed the syntax check, generate more rtls and recheck
-            failed_scenario_matrix = []
-            # for rtl_code in self.rtl_list:
-            self.TB_syntax_error = True
-            syntax_error_rtl = []
-            for rtl_idx, rtl_code in enumerate(self.rtl_list):
-                rtl_dir = os.path.join(self.working_dir, f"{rtl_dir_prefix}{rtl_idx+1}")
-                scenario_vector = self.run_testbench(rtl_dir, self.TB_code_v, rtl_code, self.TB_code_py, rtl_idx+1, self.runfiles_save and (not no_any_files))
-                failed_scenario_matrix.append(scenario_vector) # like [[2, 5], [3, 4, 5]]
-                if scenario_vector != [-1]:
-                    self.TB_syntax_error = False
-                else:
-                    syntax_error_rtl.append(rtl_idx+1)
+            # the loop is for the case that too few RTL passed the syntax check, generate more rtls and check only the new ones
+            rtl_dir_prefix = "RTL_" if i == 0 else f"RTL_compens{i}_"
+            rtl_list_todo = self.rtl_list[len(rows_done):]
+            failed_scenario_matrix = None
+            save_en = self.runfiles_save and (not no_any_files)
+            memo_stats = {"hits": 0, "misses": 0}
+            traces = None
+            if self.trace_reuse:
+                # the traces are only valid for the same driver; the ones of the previous drivers are dropped
+                driver_hash = hash_str(self.TB_code_v)
+                if self.round_traces["driver"] != driver_hash:
+                    self.round_traces = {"driver": driver_hash, "tbouts": {}}
+                traces = self.round_traces["tbouts"]
+                traces_reused = len(set(hash_str(rtl) for rtl in rtl_list_todo) & set(traces))
+                if traces_reused:
+                    logger.info(f"driver unchanged, {traces_reused} RTL traces are reused from the previous discrimination (only the checker is rerun)")
+            # in the shared-golden mode, the RTLs are only simulated here and checked together afterwards; the traces are passed in memory
+            shared_golden = self.shared_golden and self.pychecker_en
+            if shared_golden and (traces is None):
+                traces = {}
+            # only the unique RTLs (after normalization) are simulated; the results are expanded to all the RTLs afterwards
+            if self.rtl_dedup:
+                unique_idxes, group_of = rt.dedup_rtls(rtl_list_todo, self.module_header)
+                logger.info(f"{len(unique_idxes)}/{len(rtl_list_todo)} RTLs are unique after normalization")
+            else:
+                unique_idxes, group_of = list(range(len(rtl_list_todo))), list(range(len(rtl_list_todo)))
+            rtl_list_unique = [rtl_list_todo[rtl_idx] for rtl_idx in unique_idxes]
+            checker_code = None if shared_golden else self.TB_code_py
+            if self.batch_sim and self.pychecker_en:
+                failed_scenario_matrix = self.run_testbench_batch(self.working_dir, self.TB_code_v, rtl_list_unique, checker_code, self.module_header, save_en, rtl_dir_prefix, self.sim_workers, memo_stats, traces, self.timeouts)
+                rtl_dirs = [os.path.join(self.working_dir, f"{rtl_dir_prefix}{job_idx+1}") for job_idx in range(len(unique_idxes))]
+                if failed_scenario_matrix is None:
+                    logger.info("the multi-DUT harness is not applicable to this testbench, the RTLs will be simulated one by one")
+            if failed_scenario_matrix is None:
+                # each RTL is simulated in its own dir; the results keep the order of the rtl list
+                tb_jobs = [(os.path.join(self.working_dir, f"{rtl_dir_prefix}{rtl_idx+1}"), self.TB_code_v, rtl_list_todo[rtl_idx], checker_code, rtl_idx+1, save_en, memo_stats, traces, self.timeouts) for rtl_idx in unique_idxes]
+                rtl_dirs = [job[0] for job in tb_jobs]
+                stop = None
+                if self.early_stop and not shared_golden:
+                    # the remaining simulations are cancelled once the discrimination result can no longer change (the cancelled ones are None)
+                    inc_discriminator = IncrementalDiscriminator(self.discriminator_mode, len(self.rtl_list), 0.5*self.rtl_num)
+                    for failed_scenarios in rows_done:
+                        inc_discriminator.add(failed_scenarios)
+                    group_sizes = [group_of.count(group) for group in range(len(unique_idxes))]
+                    stop = lambda job_idx, failed_scenarios: inc_discriminator.add(failed_scenarios, group_sizes[job_idx])
+                failed_scenario_matrix = self.run_jobs(self.run_testbench, tb_jobs, self.sim_workers, stop) # like [[2, 5], [3, 4, 5]]
+                if self.early_stop and not shared_golden:
+                    sims_saved = failed_scenario_matrix.count(None)
+                    self.sims_saved += sims_saved
+                    logger.info(f"early stopping: {sims_saved}/{len(tb_jobs)} simulations saved")
+            if shared_golden:
+                tbouts = [traces.get(hash_str(rtl), None) for rtl in rtl_list_unique]
+                failed_scenario_matrix = self.check_shared_golden(self.working_dir, rtl_dirs, failed_scenario_matrix, self.TB_code_py, self.module_header, save_en, self.sim_workers, memo_stats, self.timeouts, tbouts)
+            failed_scenario_matrix = [list(failed_scenario_matrix[group]) if failed_scenario_matrix[group] is not None else None for group in group_of]
+            # the cancelled RTLs are not discriminated but kept in the rtl list
+            rtl_list_cancelled = [rtl for rtl, scen in zip(rtl_list_todo, failed_scenario_matrix) if scen is None]
+            self.rtl_list = self.rtl_list[:len(rows_done)] + [rtl for rtl, scen in zip(rtl_list_todo, failed_scenario_matrix) if scen is not None]
+            failed_scenario_matrix = rows_done + [scen for scen in failed_scenario_matrix if scen is not None]
+            if checker_memo.en:
+                logger.info(f"checker memo: {memo_stats['hits']} hits, {memo_stats['misses']} misses")
+            self.TB_syntax_error = all(scenario_vector == [-1] for scenario_vector in failed_scenario_matrix)
+            syntax_error_rtl = [rtl_idx+1 for rtl_idx, scenario_vector in enumerate(failed_scenario_matrix) if scenario_vector == [-1]]
             if syntax_error_rtl != []:
                 logger.info(f"RTL(s) {syntax_error_rtl} have syntax error during discrimination")
             
@@ -222,18 +364,16 @@ class TaskTBcheck():
                 self.draw_scenario_matrix(self.scenario_matrix, self.task_id, os.path.join(self.working_dir, "scenario_matrix.png"))
             
             # we delete the syntax errored rtl, if no syntax error in TB
-            self.rtl_list = [rtl for rtl, scen in zip(self.rtl_list, failed_scenario_matrix) if scen != [-1]]
+            self.rtl_list = [rtl for rtl, scen in zip(self.rtl_list, failed_scenario_matrix) if scen != [-1]] + rtl_list_cancelled
             failed_scenario_matrix = [scen for scen in failed_scenario_matrix if scen != [-1]]
+            rows_done = failed_scenario_matrix
             if len(self.rtl_list) < 0.5*self.rtl_num:
                 # too few RTL passed the syntax check
                 logger.info(f"too few RTL passed the syntax check ({len(self.rtl_list)}/{self.rtl_num}), I will generate more and recheck. This is not TB's fault.")
-                self.rtl_list, gen_num = self.gen_rtl(self.rtl_num-len(self.rtl_list), self.description, self.module_header, self.rtlgen_model, self.rtl_list)
+                # the new RTLs are compile-checked right after generation; the existing rows are kept and only the new RTLs will be simulated
+                self.rtl_list, gen_num = self.gen_rtl(self.rtl_num-len(self.rtl_list), self.description, self.module_header, self.rtlgen_model, self.rtl_list, os.path.join(self.working_dir, f"rtl_check_{i+1}"))
                 self.rtl_newly_gen_num += gen_num
-                # delete the previous rtl dirs (dir start with rtl_dir_prefix and under the working dir)
-                for subdir in os.listdir(self.working_dir):
-                    if subdir.startswith(rtl_dir_prefix) and os.path.isdir(os.path.join(self.working_dir, subdir)):
-                        os.system(f"rm -rf {os.path.join(self.working_dir, subdir)}")
-                logger.info(f"re-discriminate the testbench with updated RTL list")
+                logger.info(f"re-discriminate the testbench with {len(self.rtl_list)-len(rows_done)} new RTLs")
                 if i == self.rtl_compens_max_iter-1:
                     logger.info(f"no re-discrimination since the max iteration reached")
             else:
@@ -276,7 +416,7 @@ class TaskTBcheck():
 
 
     @staticmethod
-    def run_testbench(dir, driver_code:str, DUT_code:str, checker_code:str, rtl_index:int, save_en:bool=True):
+    def run_testbench(dir, driver_code:str, DUT_code:str, checker_code:str, rtl_index:int, save_en:bool=True, memo_stats:dict=None, traces:dict=None, timeouts:TaskTimeouts=None):
         """
         - modified from autoline.py TBEval.run_testbench
         - it has two mode: pychecker mode or verilog testbench mode
@@ -284,32 +424,130 @@ class TaskTBcheck():
             - dir: the dir to save the TB, DUT and pychecker code
             - driver_code: str; the testbench code
             - DUT_code: str; the DUT code
-            - checker_code: str; the pychecker code
+            - checker_code: str; the pychecker code; if None, the DUT is only simulated for check_shared_golden (the TBout.txt is kept in dir, or only in traces in the scratch mode)
+            - memo_stats: {"hits", "misses"} of the checker memo in this round, updated by run_checker
+            - traces: {hash of DUT: TBout content (None if the compilation failed)} of this driver (see TaskTBcheck.round_traces); if the DUT is in it, the simulation is skipped and only the checker runs. The new traces are added to it.
+            - timeouts: the adaptive timeouts of the task (see utils.sim_timeout), updated by the runs here; if None, the fixed default timeouts
+            - the outcome database (utils.outcome_db) is looked up first if enabled; a hit skips both the simulation and the checker
         - output:
-            - a list of failed scenarios (if rtl has syntax error, return [-1])
+            - a list of failed scenarios (if rtl has syntax error, return [-1]); [] if checker_code is None and the simulation succeeds
         """
+        timeouts = timeouts if timeouts is not None else TaskTimeouts()
+        if (not save_en) and scratch_dir.en:
+            # run in a RAM-backed workspace; only the run info and the failed scenarios are copied to dir
+            with scratch_dir(dir, SCRATCH_KEEP) as work_dir:
+                failed_scenarios = TaskTBcheck.run_testbench(work_dir, driver_code, DUT_code, checker_code, rtl_index, True, memo_stats, traces, timeouts)
+                if checker_code is not None:
+                    TaskTBcheck.save_failed_scenarios(failed_scenarios, work_dir)
+            return failed_scenarios
+        os.makedirs(dir, exist_ok=True)
+        db_key = outcome_db.key("TBcheck", driver_code, DUT_code, checker_code) if (outcome_db.en and checker_code is not None) else None
+        if db_key is not None:
+            outcome = outcome_db.get(db_key)
+            if outcome is not None:
+                outcome_db.save_hit_info(dir, outcome)
+                failed_scenarios = list(outcome["failed_scenarios"])
+                if (not save_en) and (failed_scenarios != [-1]):
+                    shutil.rmtree(dir, ignore_errors=True)
+                return failed_scenarios
+        dut_hash = hash_str(DUT_code) if traces is not None else None
+        if (traces is not None) and (dut_hash in traces):
+            # the same driver has simulated this DUT in the previous discrimination, only the checker is rerun
+            TaskTBcheck.load_trace(dir, traces[dut_hash])
+            if traces[dut_hash] is None:
+                return [-1]
+            if checker_code is None:
+                return []
+            failed_scenarios = TaskTBcheck.run_checker_and_clean(dir, checker_code, save_en, memo_stats, timeouts)
+            if (db_key is not None) and (failed_scenarios != [-1]):
+                outcome_db.put_run(db_key, None, failed_scenarios=failed_scenarios)
+            return failed_scenarios
         # iverilog part
         # save the TB and DUT
-        os.makedirs(dir, exist_ok=True)
         v_driver_path = os.path.join(dir, "driver.v")
-        py_checker_path = os.path.join(dir, "checker.py")
         dut_path = os.path.join(dir, "DUT.v")
         with open(v_driver_path, "w") as f:
             f.write(driver_code)
         with open(dut_path, "w") as f:
             f.write(DUT_code)
-        iv_run_info = iv.iverilog_call_and_save(dir, silent=True)
+        timeouts.sim.track(driver_code)
+        iv_run_info = iv.iverilog_call_and_save(dir, silent=True, timeout=timeouts.sim.value(), compile_timeout=STAGE_DEFAULT_TIMEOUT)
+        timeouts.sim.observe_iv(iv_run_info)
+        if traces is not None:
+            # only the final outcomes are kept; a failed simulation (such as a timeout under load) is rerun in the next round
+            if iv_run_info[0]:
+                traces[dut_hash] = TaskTBcheck.read_trace(dir)
+            elif (iv_run_info[3] is None) and (not iv_run_info[2].get("timeout", False)):
+                traces[dut_hash] = None
         if not iv_run_info[0]:
             # logger.trace(f"RTL index [{rtl_index}]: Iverilog Compilation Failed, the PREREQUISITE of 'Evaluation' is no syntactic error from Testbench!!!")
             # raise RuntimeError("Iverilog Compilation Failed")
+            if db_key is not None:
+                outcome_db.put_run(db_key, iv_run_info, failed_scenarios=[-1])
+            return [-1]
+        if checker_code is None:
+            return []
+        failed_scenarios = TaskTBcheck.run_checker_and_clean(dir, checker_code, save_en, memo_stats, timeouts)
+        if (db_key is not None) and (failed_scenarios != [-1]):
+            # a checker failure may be a timeout, it is not stored
+            outcome_db.put_run(db_key, iv_run_info, failed_scenarios=failed_scenarios)
+        return failed_scenarios
+
+    @staticmethod
+    def run_checker_and_clean(dir, checker_code:str, save_en:bool=True, memo_stats:dict=None, timeouts:TaskTimeouts=None):
+        """
+        - run the checker in the dir of run_testbench; the dir is deleted if save_en is False and the checking succeeds
+        """
+        failed_scenarios = TaskTBcheck.run_checker(dir, checker_code, memo_stats, timeouts)
+        if failed_scenarios == [-1]:
             return [-1]
+        # if save_en false, we delete the dir
+        if not save_en:
+            shutil.rmtree(dir, ignore_errors=True)
+        return failed_scenarios
+
+    @staticmethod
+    def run_checker(dir, checker_code:str, memo_stats:dict=None, timeouts:TaskTimeouts=None):
+        """
+        - run the pychecker on the TBout.txt in the dir; the result is taken from the checker memo if the same checker has checked the same TBout
+        - output:
+            - a list of failed scenarios (if the checker fails, return [-1])
+        """
+        memo_key = None
+        if checker_memo.en:
+            tbout_path = os.path.join(dir, "TBout.txt")
+            tbout = ""
+            if os.path.exists(tbout_path):
+                with open(tbout_path, "r") as f:
+                    tbout = f.read()
+            memo_key = checker_memo.key(checker_code, tbout)
+            failed_scenarios = checker_memo.get(memo_key, memo_stats)
+            if failed_scenarios is not None:
+                with open(os.path.join(dir, "run_info_py.txt"), "w") as f:
+                    f.write("python checker skipped, the result is taken from the checker memo (the same checker on the same TBout.txt)\n\n###failed scenarios:\n%s\n" % (failed_scenarios))
+                return list(failed_scenarios)
+        failed_scenarios = TaskTBcheck._run_checker(dir, checker_code, timeouts)
+        if (memo_key is not None) and (failed_scenarios != [-1]):
+            checker_memo.put(memo_key, failed_scenarios)
+        return failed_scenarios
+
+    @staticmethod
+    def _run_checker(dir, checker_code:str, timeouts:TaskTimeouts=None):
+        timeouts = timeouts if timeouts is not None else TaskTimeouts()
+        py_checker_path = os.path.join(dir, "checker.py")
         with open(py_checker_path, "w") as f:
             f.write(checker_code)
-        py_run_info = py.python_call_and_save(pypath=py_checker_path, silent=True)
+        timeouts.py.track(checker_code)
+        py_run_info = py.python_call_and_save(pypath=py_checker_path, silent=True, timeout=timeouts.py.value())
+        timeouts.py.observe(py_run_info[1])
         if not py_run_info[0]:
             # logger.trace(f"RTL index [{rtl_index}]: Iverilog Compilation Failed: the PREREQUISITE of 'Evaluation' is no syntactic error from Python code!!!")
             # raise RuntimeError("Python Compilation Failed")
             return [-1]
+        checker_result = py.read_checker_result(dir)
+        if checker_result is not None:
+            return list(set([int("".join([char for char in str(scenario) if char.isdigit()])) for scenario in checker_result]))
+        # the checkers without the result file: the failed scenarios are taken from the output
         python_info_out = py_run_info[1]["out"]
         python_info_out : str
         # find the last ] in the out
@@ -324,11 +562,256 @@ class TaskTBcheck():
         # if the item is not pure digit such as 2b, then we only extract the digit part
         failed_scenarios = [int("".join([char for char in scenario if char.isdigit()])) for scenario in failed_scenarios]
         failed_scenarios = list(map(int, failed_scenarios))
-        # if save_en false, we delete the dir
-        if not save_en:
-            os.system(f"rm -rf {dir}")
         return list(set(failed_scenarios))
 
+    @staticmethod
+    def run_jobs(func, jobs:list[tuple], workers:int=1, stop=None) -> list:
+        """
+        - run func(*job) for each job, using a thread pool if workers > 1 (the jobs are subprocess-bound); the results keep the order of the jobs
+        - stop (opt.): stop(job_idx, result) -> bool, called when each job finishes (in the finishing order); if True, the jobs not started yet are cancelled and their results are None. The running jobs are finished and kept.
+        """
+        if stop is None:
+            if workers <= 1 or len(jobs) <= 1:
+                return [func(*job) for job in jobs]
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                return list(executor.map(lambda job: func(*job), jobs))
+        results = [None] * len(jobs)
+        if workers <= 1:
+            for job_idx, job in enumerate(jobs):
+                results[job_idx] = func(*job)
+                if stop(job_idx, results[job_idx]):
+                    break
+            return results
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(func, *job): job_idx for job_idx, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                results[futures[future]] = future.result()
+                if stop(futures[future], results[futures[future]]):
+                    for future_left in futures:
+                        future_left.cancel()
+                    break
+        for future, job_idx in futures.items():
+            if (not future.cancelled()) and (results[job_idx] is None):
+                results[job_idx] = future.result()
+        return results
+
+    @staticmethod
+    def run_testbench_batch(working_dir, driver_code:str, rtl_list:list[str], checker_code:str, header:str, save_en:bool=True, rtl_dir_prefix:str="RTL_", workers:int=1, memo_stats:dict=None, traces:dict=None, timeouts:TaskTimeouts=None):
+        """
+        - the batched version of run_testbench: all the RTLs are instantiated in one multi-DUT harness behind the same driver, thus only one compilation and one simulation are needed. Each RTL still gets its own TBout and checking.
+        - the RTLs that cannot share the simulation (see rtl_tools.batch_blocked) are run by run_testbench
+        - input:
+            - working_dir: the harness is in working_dir/batch, the checking of each RTL is in working_dir/{rtl_dir_prefix}{idx}
+            - header: the module header of the DUT
+            - workers: the number of parallel checkers (and simulations of the RTLs not in the harness)
+            - checker_code, memo_stats, traces, timeouts: see run_testbench; the RTLs with traces are not put into the harness. The timeout of the harness is scaled by the number of RTLs in it
+        - output:
+            - the list of failed scenarios of each RTL, same as the results of run_testbench (if rtl has syntax error, [-1])
+            - None if the harness is not applicable to this driver; the caller should run the RTLs one by one
+        """
+        if (not save_en) and scratch_dir.en:
+            # run in a RAM-backed workspace; only the run info and the failed scenarios are copied to working_dir
+            with scratch_dir(working_dir, SCRATCH_KEEP) as work_dir:
+                results = TaskTBcheck.run_testbench_batch(work_dir, driver_code, rtl_list, checker_code, header, True, rtl_dir_prefix, workers, memo_stats, traces, timeouts)
+                for rtl_idx, failed_scenarios in enumerate((results or []) if checker_code is not None else []):
+                    TaskTBcheck.save_failed_scenarios(failed_scenarios, os.path.join(work_dir, f"{rtl_dir_prefix}{rtl_idx+1}"))
+            return results
+        timeouts = timeouts if timeouts is not None else TaskTimeouts()
+        batch_dir = os.path.join(working_dir, "batch")
+        rtl_idxes = [rtl_idx+1 for rtl_idx, rtl_code in enumerate(rtl_list) if not rt.batch_blocked(rtl_code)]
+        if traces is not None:
+            # the RTLs with traces only need checking, they are run by run_testbench
+            rtl_idxes = [rtl_idx for rtl_idx in rtl_idxes if hash_str(rtl_list[rtl_idx-1]) not in traces]
+        results = {}
+        db_keys = {}
+        if outcome_db.en and (checker_code is not None):
+            # the RTLs in the outcome database are neither simulated nor checked
+            for rtl_idx in rtl_idxes:
+                db_keys[rtl_idx] = outcome_db.key("TBcheck", driver_code, rtl_list[rtl_idx-1], checker_code)
+                outcome = outcome_db.get(db_keys[rtl_idx])
+                if outcome is not None:
+                    results[rtl_idx] = list(outcome["failed_scenarios"])
+                    if save_en:
+                        rtl_dir = os.path.join(working_dir, f"{rtl_dir_prefix}{rtl_idx}")
+                        os.makedirs(rtl_dir, exist_ok=True)
+                        outcome_db.save_hit_info(rtl_dir, outcome)
+            rtl_idxes = [rtl_idx for rtl_idx in rtl_idxes if rtl_idx not in results]
+        for _ in range(BATCH_COMPILE_TRIES):
+            if rtl_idxes == []:
+                break
+            harness = rt.gen_multidut_harness(driver_code, header, rtl_idxes)
+            if harness is None:
+                return None
+            shutil.rmtree(batch_dir, ignore_errors=True)
+            os.makedirs(batch_dir, exist_ok=True)
+            with open(os.path.join(batch_dir, "driver.v"), "w") as f:
+                f.write(harness)
+            for rtl_idx in rtl_idxes:
+                with open(os.path.join(batch_dir, rt.DUT_FILE % rtl_idx), "w") as f:
+                    f.write(rt.rename_modules(rtl_list[rtl_idx-1], rtl_idx))
+            timeouts.sim.track(driver_code)
+            iv_run_info = iv.iverilog_call_and_save(batch_dir, silent=True, timeout=timeouts.sim.value(runs=len(rtl_idxes)), compile_timeout=STAGE_DEFAULT_TIMEOUT)
+            timeouts.sim.observe_iv(iv_run_info, sample=False)
+            if iv_run_info[0]:
+                break
+            if (iv_run_info[3] is not None) or iv_run_info[2].get("timeout", False):
+                # the simulation failed or the compilation timed out, we cannot tell which RTL is responsible
+                return None
+            # remove the RTLs with syntax error and recompile
+            error_rtls = rt.compile_error_rtls(iv_run_info[2]["err"])
+            if (error_rtls is None) or (not error_rtls.issubset(rtl_idxes)):
+                return None
+            for rtl_idx in error_rtls:
+                results[rtl_idx] = [-1]
+                if traces is not None:
+                    traces[hash_str(rtl_list[rtl_idx-1])] = None
+            rtl_idxes = [rtl_idx for rtl_idx in rtl_idxes if rtl_idx not in error_rtls]
+        else:
+            return None
+        # split the TBout and check each RTL
+        tbout_path = os.path.join(batch_dir, "TBout.txt")
+        tbout_split = {}
+        if rtl_idxes != [] and os.path.exists(tbout_path):
+            with open(tbout_path, "r") as f:
+                tbout_split = rt.split_multidut_tbout(f.read(), rtl_idxes)
+        def check_one(rtl_idx):
+            rtl_dir = os.path.join(working_dir, f"{rtl_dir_prefix}{rtl_idx}")
+            os.makedirs(rtl_dir, exist_ok=True)
+            if rtl_idx in tbout_split:
+                with open(os.path.join(rtl_dir, "TBout.txt"), "w") as f:
+                    f.write(tbout_split[rtl_idx])
+            if traces is not None:
+                traces[hash_str(rtl_list[rtl_idx-1])] = tbout_split.get(rtl_idx, None)
+            if checker_code is None:
+                return [] if rtl_idx in tbout_split else [-1]
+            failed_scenarios = TaskTBcheck.run_checker(rtl_dir, checker_code, memo_stats, timeouts)
+            if (rtl_idx in db_keys) and (failed_scenarios != [-1]):
+                outcome_db.put_run(db_keys[rtl_idx], None, failed_scenarios=failed_scenarios)
+            if (not save_en) and (failed_scenarios != [-1]):
+                shutil.rmtree(rtl_dir, ignore_errors=True)
+            return failed_scenarios
+        results.update(zip(rtl_idxes, TaskTBcheck.run_jobs(check_one, [(rtl_idx,) for rtl_idx in rtl_idxes], workers)))
+        # the RTLs not suitable for the harness
+        tb_jobs = [(os.path.join(working_dir, f"{rtl_dir_prefix}{rtl_idx+1}"), driver_code, rtl_code, checker_code, rtl_idx+1, save_en, memo_stats, traces, timeouts) for rtl_idx, rtl_code in enumerate(rtl_list) if rtl_idx+1 not in results]
+        results.update(zip([job[4] for job in tb_jobs], TaskTBcheck.run_jobs(TaskTBcheck.run_testbench, tb_jobs, workers)))
+        if not save_en:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+        logger.info(f"{len(rtl_idxes)}/{len(rtl_list)} RTLs simulated in one multi-DUT harness")
+        return [results[rtl_idx+1] for rtl_idx in range(len(rtl_list))]
+
+    @staticmethod
+    def check_shared_golden(working_dir, rtl_dirs:list[str], sim_results:list[list[int]], checker_code:str, header:str, save_en:bool=True, workers:int=1, memo_stats:dict=None, timeouts:TaskTimeouts=None, tbouts:list[str|None]=None) -> list[list[int]]:
+        """
+        - check the TBouts of all the RTLs simulated by the same driver in one checker process (see utils.checker_runtime): the golden model is run once over the shared stimulus and each distinct observed output is checked once, instead of one full checker run per RTL
+        - input:
+            - rtl_dirs: the dirs of the RTLs with TBout.txt (see run_testbench with checker_code=None)
+            - sim_results: the results of the simulation of each RTL; only the RTLs with [] (simulation succeeded) are checked, the others are kept
+            - memo_stats: see run_testbench; the checker memo is looked up before and updated after the checking
+            - timeouts: see run_testbench; only for the RTLs checked one by one (the shared checking has its own timeout)
+            - tbouts: the TBouts of the RTLs kept in memory (see the traces of run_testbench); needed in the scratch mode, where the simulation workspaces are already removed. If None, the TBout.txt in rtl_dirs are checked
+        - output:
+            - the list of failed scenarios of each RTL, same as the results of run_testbench; if the shared checking is not applicable (such as different stimulus), the RTLs are checked one by one by run_checker
+        """
+        if (not save_en) and scratch_dir.en:
+            # the traces are written to a RAM-backed workspace for the checking; only the records are copied to working_dir
+            with scratch_dir(working_dir, SCRATCH_KEEP) as work_dir:
+                work_rtl_dirs = [os.path.join(work_dir, os.path.relpath(rtl_dir, working_dir)) for rtl_dir in rtl_dirs]
+                for work_rtl_dir, tbout in zip(work_rtl_dirs, tbouts or [None] * len(rtl_dirs)):
+                    TaskTBcheck.write_trace(work_rtl_dir, tbout)
+                results = TaskTBcheck.check_shared_golden(work_dir, work_rtl_dirs, sim_results, checker_code, header, True, workers, memo_stats, timeouts)
+                for job_idx, result in enumerate(results):
+                    if sim_results[job_idx] == []:
+                        TaskTBcheck.save_failed_scenarios(result, work_rtl_dirs[job_idx])
+            return results
+        results = list(sim_results)
+        todo = [job_idx for job_idx, sim_result in enumerate(sim_results) if sim_result == []]
+        memo_keys = {}
+        if checker_memo.en:
+            memo_hits = []
+            for job_idx in todo:
+                memo_keys[job_idx] = checker_memo.key(checker_code, TaskTBcheck.read_trace(rtl_dirs[job_idx]) or "")
+                failed_scenarios = checker_memo.get(memo_keys[job_idx], memo_stats)
+                if failed_scenarios is not None:
+                    results[job_idx] = list(failed_scenarios)
+                    memo_hits.append(job_idx)
+                    with open(os.path.join(rtl_dirs[job_idx], "run_info_py.txt"), "w") as f:
+                        f.write("python checker skipped, the result is taken from the checker memo (the same checker on the same TBout.txt)\n\n###failed scenarios:\n%s\n" % (failed_scenarios))
+            todo = [job_idx for job_idx in todo if job_idx not in memo_hits]
+        shared_results = None
+        shared_dir = os.path.join(working_dir, "shared_check")
+        if todo != []:
+            os.makedirs(shared_dir, exist_ok=True)
+            job = {
+                "checker_path": os.path.abspath(os.path.join(shared_dir, "checker.py")),
+                "tbout_paths": [os.path.abspath(os.path.join(rtl_dirs[job_idx], "TBout.txt")) for job_idx in todo],
+                "input_names": [signal["name"] for signal in extract_signals(header) if signal["type"].startswith("input")],
+                "result_path": os.path.abspath(os.path.join(shared_dir, "shared_check_result.json"))
+            }
+            with open(job["checker_path"], "w") as f:
+                f.write(checker_code)
+            with open(os.path.join(shared_dir, "shared_check.json"), "w") as f:
+                json.dump(job, f)
+            with open(os.path.join(shared_dir, "shared_check.py"), "w") as f:
+                f.write(SHARED_CHECK_SCRIPT % (REPO_ROOT))
+            if os.path.exists(job["result_path"]):
+                os.remove(job["result_path"])
+            py.python_call_and_save(os.path.join(shared_dir, "shared_check.py"), silent=True, timeout=SHARED_CHECK_TIMEOUT)
+            if os.path.exists(job["result_path"]):
+                with open(job["result_path"], "r") as f:
+                    shared_results = json.load(f)
+        if (todo != []) and (shared_results is None):
+            logger.info("the shared golden model checking is not applicable, the RTLs will be checked one by one")
+            checked = TaskTBcheck.run_jobs(TaskTBcheck.run_checker, [(rtl_dirs[job_idx], checker_code, memo_stats, timeouts) for job_idx in todo], workers)
+        else:
+            checked = shared_results or []
+            for job_idx, failed_scenarios in zip(todo, checked):
+                with open(os.path.join(rtl_dirs[job_idx], "run_info_py.txt"), "w") as f:
+                    f.write("python checker run once for all the RTLs of this round, see %s\n\n###failed scenarios:\n%s\n" % (shared_dir, failed_scenarios))
+                if (job_idx in memo_keys) and (failed_scenarios != [-1]):
+                    checker_memo.put(memo_keys[job_idx], failed_scenarios)
+            if todo != []:
+                logger.info(f"{len(todo)} RTL traces checked with one shared golden model run")
+        for job_idx, failed_scenarios in zip(todo, checked):
+            results[job_idx] = failed_scenarios
+        if not save_en:
+            # same as run_testbench: the dirs of the checked RTLs are deleted
+            for job_idx, result in enumerate(results):
+                if (sim_results[job_idx] == []) and (result != [-1]):
+                    shutil.rmtree(rtl_dirs[job_idx], ignore_errors=True)
+            shutil.rmtree(shared_dir, ignore_errors=True)
+        return results
+
+    @staticmethod
+    def read_trace(dir) -> str|None:
+        """read the TBout.txt in dir; None if not exist"""
+        tbout_path = os.path.join(dir, "TBout.txt")
+        if not os.path.exists(tbout_path):
+            return None
+        with open(tbout_path, "r") as f:
+            return f.read()
+
+    @staticmethod
+    def write_trace(dir, tbout:str|None):
+        """write the trace to dir/TBout.txt (nothing if None)"""
+        os.makedirs(dir, exist_ok=True)
+        if tbout is not None:
+            with open(os.path.join(dir, "TBout.txt"), "w") as f:
+                f.write(tbout)
+
+    @staticmethod
+    def load_trace(dir, tbout:str|None):
+        """write the reused trace to dir/TBout.txt and note it in the run info"""
+        TaskTBcheck.write_trace(dir, tbout)
+        with open(os.path.join(dir, "run_info.txt"), "w") as f:
+            f.write("iverilog simulation skipped, the TBout.txt is reused from the previous discrimination (same driver and DUT)\n" if tbout is not None else "iverilog simulation skipped, the same driver and DUT failed to compile in the previous discrimination\n")
+
+    @staticmethod
+    def save_failed_scenarios(failed_scenarios:list[int], dir):
+        """save the failed scenarios of one RTL to dir/failed_scenarios.txt"""
+        os.makedirs(dir, exist_ok=True)
+        with open(os.path.join(dir, "failed_scenarios.txt"), "w") as f:
+            f.write(str(failed_scenarios))
+
     def rtl_list_gen(self)->list[str]:
         """
         - generate the RTL list using LLM, will empty the old rtl list
@@ -345,7 +828,7 @@ class TaskTBcheck():
         ls.save_json_lines([{"task_id": self.task_id, "llmgen_RTL": self.rtl_list}], save_path)
 
     @staticmethod
-    def gen_rtl(num:int, description:str, header:str, llm_mode:str, rtl_list:list=[]):
+    def gen_rtl(num:int, description:str, header:str, llm_mode:str, rtl_list:list=[], check_dir:str=None):
         """
         - input:
             - num (int): the number of RTLs to generate
@@ -353,8 +836,11 @@ class TaskTBcheck():
             - header (str): the header of the module
             - llm (str): the llm model to use (official model name)
             - rtl_list (list) [optional]: the newly generated RTLs will be appended to this list, can be empty
+            - check_dir (str) [optional]: if given, each new RTL is compiled alone in this dir right after generation; the failed ones are regenerated (at most RTL_GEN_TRIES tries) and dropped if still failing
+            - the RTLs of one try are sampled in one batch (see the n of LLM_call.llm_call): the first tries of all the RTLs, then the retries of the failed ones
         - output:
             - rtl_list (list): the list of the newly generated RTLs (and the old ones, if have)
+            - rtl_gen_num (int): the number of RTLs sampled from the llm
         """
         rtl_gen_num = 0
         prompt = "Your task is to write a verilog RTL design according to the design specification. The infomation we have is the problem description that guides student to write the RTL code (DUT) and the header of the desired module. here is the problem description:\n"
@@ -362,17 +848,40 @@ class TaskTBcheck():
         prompt += "\nHere is the header of the desired module:\n"
         prompt += header
         prompt += "\nPlease only return the module code (header should be included) in verilog, please do not include any other words."
-        for i in range(num):
-            # call llm
-            answer = llm.llm_call(prompt, llm_mode)[0]
-            # extract the module code
-            module_code = llm.extract_code(answer, "verilog")[0]
-            # logger.trace(f"[{self.task_id}] - {i+1} RTLs generated")
-            rtl_list.append(module_code)
-            rtl_gen_num += 1
+        rtl_new = [None] * num
+        rtl_todo = list(range(num)) # the RTLs without a (compilable) code yet
+        for try_idx in range(RTL_GEN_TRIES if check_dir is not None else 1):
+            if not rtl_todo:
+                break
+            # call llm, all the RTLs of this try in one batch
+            answers = llm.llm_call(prompt, llm_mode, n=len(rtl_todo))[1]["answers"]
+            rtl_gen_num += len(answers)
+            for i, answer in zip(rtl_todo, answers):
+                # extract the module code
+                module_code = llm.extract_code(answer, "verilog")[0]
+                if (check_dir is None) or TaskTBcheck.compile_check(os.path.join(check_dir, f"rtl_{i+1}_try{try_idx+1}"), module_code):
+                    rtl_new[i] = module_code
+            rtl_todo = [i for i in rtl_todo if rtl_new[i] is None]
+        rtl_list.extend([module_code for module_code in rtl_new if module_code is not None])
+        rtl_dropped_num = len(rtl_todo)
         logger.info("%d naive rtls generated"%(rtl_gen_num))
+        if rtl_dropped_num:
+            logger.info("%d rtls dropped since they failed the compile check %d times"%(rtl_dropped_num, RTL_GEN_TRIES))
         return rtl_list, rtl_gen_num
 
+    @staticmethod
+    def compile_check(dir, rtl_code:str) -> bool:
+        """
+        - compile the RTL alone (no simulation); the dir is kept only if the compilation fails
+        """
+        os.makedirs(dir, exist_ok=True)
+        with open(os.path.join(dir, "DUT.v"), "w") as f:
+            f.write(rtl_code)
+        compile_pass = iv.iverilog_call_and_save(dir, silent=True, compile_only=True)[0]
+        if compile_pass:
+            shutil.rmtree(dir, ignore_errors=True)
+        return compile_pass
+
     @staticmethod
     def failed_scenarios_to_onehot_array(failed_scenarios:list[list], max_scen_idx:int|None=None, taskid:str=""):
         """
@@ -616,6 +1125,61 @@ class TB_discriminator():
                 logger.critical("TB discriminator - mode not found!!!")
                 raise RuntimeError("TB discriminator - mode not found!!!")
 
+class IncrementalDiscriminator():
+    """
+    - consumes the scenario vectors of the RTLs as their simulations finish, and tells when the result of TB_discriminator (the same mode) can no longer change whatever the remaining RTLs give
+    - the remaining RTLs may pass or fail any scenario, or have syntax error (excluded from the matrix); a column with z zeros in v valid rows and r remaining rows is:
+        - certainly wrong if z >= p*(v+r) (p: the wrong ratio of the mode; all the remaining rows are valid and pass)
+        - certainly not wrong if z + r < p*(v+r) (all the remaining rows are valid and fail)
+    - the columns never failed so far (including the ones beyond the seen max scenario index) are checked as z = 0
+    - the row rule (row_X_correct) and the RTL compensation (too few valid RTLs) are bounded in the same way
+    - only the wrong/not wrong classification is guaranteed; the correct/unsure split of the not-wrong columns may differ from the one of the full matrix
+    """
+    def __init__(self, mode:str, total_rows:int, min_valid_rows:float=0) -> None:
+        col_match = re.search(r"col_(\d+|full)_wrong", mode)
+        row_match = re.search(r"row_(\d+)_correct", mode)
+        self.col_ratio = 1.0 if (col_match is None or col_match.group(1) == "full") else int(col_match.group(1)) / 100
+        self.row_ratio = int(row_match.group(1)) / 100 if row_match is not None else None
+        self.min_valid_rows = min_valid_rows
+        self.rows_left = total_rows
+        self.valid_rows = 0
+        self.correct_rows = 0 # the rows that pass all the scenarios
+        self.zeros = {} # scenario index: the number of valid rows failing it
+
+    def add(self, failed_scenarios:list[int], times:int=1) -> bool:
+        """
+        - add the result of one RTL (times: the number of identical RTLs it represents); return True if the result is settled
+        """
+        self.rows_left -= times
+        if failed_scenarios != [-1]:
+            self.valid_rows += times
+            if failed_scenarios == []:
+                self.correct_rows += times
+            for scen_idx in failed_scenarios:
+                self.zeros[scen_idx] = self.zeros.get(scen_idx, 0) + times
+        return self.settled
+
+    @property
+    def settled(self) -> bool:
+        v, r = self.valid_rows, self.rows_left
+        if r <= 0:
+            return True
+        if v == 0:
+            # the TB may still turn out to be syntax error
+            return False
+        # RTL compensation: settled if certainly triggered (all the RTLs are rerun) or certainly not
+        if (v < self.min_valid_rows) and (v + r >= self.min_valid_rows):
+            return False
+        p = self.col_ratio
+        for z in list(self.zeros.values()) + [0]:
+            if not ((z >= p*(v+r)) or (z + r < p*(v+r))):
+                return False
+        if self.row_ratio is not None:
+            q, c = self.row_ratio, self.correct_rows
+            if not ((c >= q*(v+r)) or ((c < q*v) and (c + r < q*(v+r)))):
+                return False
+        return True
+
 COR_PROMPT_1 = """Your task is to correct the testbench according to the failing scenarios. the information we have is the failed/passed scenarios of the testbench, the problem description and the testbench code. 
 the testbench code is consisted of both verilog and python code. The verilog code aims to generate test stimulus (under test scenarios) and drive the DUT to generate the output signal; the python code aims to check if the output vector from the DUT is correct. 
 ATTENTION: The python code contains error, and your target is to find it and tell me how to correct it (you don't need to give me the code in this stage).
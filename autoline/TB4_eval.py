@@ -2,20 +2,80 @@
 Description :   This is the testbench eval stage in autoline
 Author      :   Ruidi Qiu (r.qiu@tum.de)
 Time        :   2024/7/24 11:24:43
-LastEdited  :   2024/8/28 21:08:21
+LastEdited  :   2025/3/4 16:02:55
 """
 
 
 import os
+import json
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import iverilog_call as iv
 import python_call as py
 from loader_saver import autologger as logger
 from loader_saver import log_localprefix
-from utils.utils import Timer, get_time
+from utils.utils import Timer, get_time, hash_str, scratch_dir, remove_files_except
+from utils.outcome_db import outcome_db
+from utils.sim_timeout import TaskTimeouts, STAGE_DEFAULT_TIMEOUT
 
 TC_PASS_CHECK_LIST_TB_GEN = ["All test cases passed", "all test cases passed", "All Test Cases Passed"]
 TC_PASS_CHECK_LIST_TB_GOLDEN = ['Mismatches: 0 in ', 'Hint: Total mismatched samples is 0 out of']
 TC_PASS_CHECK_LIST_PYCHECKER = ["[]"]
+STREAM_TEE_NAME = "TBout_streamed.txt" # the copy of the streamed TBout, renamed to TBout.txt after the simulation
+
+class GoldenVerdictStore():
+    """
+    - persistent verdicts of the golden TB on the mutants (Eval2) and the gptgen RTLs (Eval2b)
+    - the verdict does not depend on the generated TB, so it is shared by all the tasks, reboots and runs
+    - key: (task_id, hash of the golden TB, hash of the DUT); saved in a json lines file, one verdict per line
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(GoldenVerdictStore, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not getattr(self, "_initialized", False):
+            self.en = False
+            self.path = None
+            self.verdicts = {}
+            self._lock = threading.Lock()
+            self._initialized = True
+
+    def set_config(self, en:bool, path:str):
+        self.en = en
+        self.path = path
+        self.verdicts = {}
+        if self.en and os.path.exists(self.path):
+            with open(self.path, "r") as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue # the last line may be incomplete
+                    self.verdicts[record["key"]] = record["pass"]
+
+    @staticmethod
+    def key(task_id:str, TB_golden:str, DUT:str) -> str:
+        return "%s/%s/%s" % (task_id, hash_str(TB_golden), hash_str(DUT))
+
+    def get(self, task_id:str, TB_golden:str, DUT:str) -> bool|None:
+        """return the stored verdict, None if not found"""
+        return self.verdicts.get(self.key(task_id, TB_golden, DUT), None)
+
+    def put(self, task_id:str, TB_golden:str, DUT:str, verdict:bool):
+        key = self.key(task_id, TB_golden, DUT)
+        with self._lock:
+            if key in self.verdicts:
+                return
+            self.verdicts[key] = verdict
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            with open(self.path, "a") as f:
+                f.write(json.dumps({"key": key, "pass": verdict}) + "\n")
+
+golden_verdicts = GoldenVerdictStore()
 
 class TaskTBeval():
     """
@@ -30,6 +90,9 @@ class TaskTBeval():
     - TB_golden: the golden testbench (str)
     - DUT_golden: the golden RTL DUT (str)
     - DUT_mutant_list: the list of RTL DUT mutants modified from DUT_golden;[str]        
+    - sim_workers: the number of parallel simulations in Eval2/Eval2b (golden TB and generated TB of all mutants)
+    - stream_check: whether the generated TB side of Eval2/Eval2b streams TBout into the pychecker and stops at the first failure (see run_testbench)
+    - timeouts: the adaptive timeouts of the task (see utils.sim_timeout), used by the runs of the generated TB; the golden TB always uses the default timeout. If None, the default timeouts are used
     #### output
     - dict
         - "Eval1_pass" : bool (whether the golden RTL checking passed)
@@ -37,7 +100,7 @@ class TaskTBeval():
         - "Eval2_failed_mutant_idxes" : list of int (the index of the failed mutants)
     """
     """main structure: run(), run_Eval1(), run_Eval2()"""
-    def __init__(self, task_id: str, task_dir: str, TB_gen: str, TB_golden:str=None, DUT_golden:str=None, DUT_mutant_list:list=None, DUT_gptgen_list:list = None, pychecker_en:bool = False, pychecker_code:str = "", runfiles_save:bool = True):
+    def __init__(self, task_id: str, task_dir: str, TB_gen: str, TB_golden:str=None, DUT_golden:str=None, DUT_mutant_list:list=None, DUT_gptgen_list:list = None, pychecker_en:bool = False, pychecker_code:str = "", runfiles_save:bool = True, sim_workers:int = 1, stream_check:bool = False, timeouts:TaskTimeouts = None):
         self.task_id = task_id
         self.task_dir = task_dir
         self.TB_gen = TB_gen
@@ -49,6 +112,11 @@ class TaskTBeval():
         self.save_en = runfiles_save
         self.TB_gen_mode = "TB_gen" if not self.pychecker_en else "Pychecker"
         self.pychecker_code = pychecker_code
+        self.sim_workers = sim_workers # the number of parallel simulations in Eval2/Eval2b
+        self.stream_check = stream_check
+        self.timeouts = timeouts if timeouts is not None else TaskTimeouts()
+        self.timeouts.sim.track(TB_gen)
+        self.timeouts.py.track(pychecker_code if pychecker_en else None)
         self.working_dir = ""
         # Eval1 related
         self.Eval1_exist = False
@@ -113,7 +181,13 @@ class TaskTBeval():
             eval_dir = self.Eval2b_dir
         ### Eval 2: Golden TB comparison on RTL mutants
         logger.info(print_str)
-        mutant_results = []
+        def run_generated_TB(dir, DUT_code):
+            try:
+                return self.run_testbench(dir, self.TB_gen, DUT_code, self.TB_gen_mode, self.pychecker_code, save_en=self.save_en, stream=self.stream_check)
+            except:
+                return False
+        # both TB sides of all the mutants are independent; each of them has its own dir
+        jobs = []
         for idx, DUT_mutant in enumerate(DUT_list):
             # mutant_subdir = eval_dir + "%s_%d/"%(mutant_subdir_name, idx+1)
             mutant_subdir = os.path.join(eval_dir, "%s_%d"%(mutant_subdir_name, idx+1))
@@ -121,14 +195,15 @@ class TaskTBeval():
             GoldenTB_subsubdir = os.path.join(mutant_subdir, "GoldenTB")
             # GenedTB_subsubdir = mutant_subdir + "GeneratedTB/"
             GenedTB_subsubdir = os.path.join(mutant_subdir, "GeneratedTB")
-            try: #in case the mutant has syntax error
-                TBgolden_pass = self.run_testbench(GoldenTB_subsubdir, self.TB_golden, DUT_mutant, "TB_golden", save_en=self.save_en)
-            except:
-                TBgolden_pass = False
-            try:
-                TBgen_pass = self.run_testbench(GenedTB_subsubdir, self.TB_gen, DUT_mutant, self.TB_gen_mode, self.pychecker_code, save_en=self.save_en)
-            except:
-                TBgen_pass = False
+            jobs.append((self.run_golden_TB, GoldenTB_subsubdir, DUT_mutant))
+            jobs.append((run_generated_TB, GenedTB_subsubdir, DUT_mutant))
+        if self.sim_workers > 1:
+            with ThreadPoolExecutor(max_workers=self.sim_workers) as executor:
+                job_results = list(executor.map(lambda job: job[0](job[1], job[2]), jobs))
+        else:
+            job_results = [job[0](job[1], job[2]) for job in jobs]
+        mutant_results = []
+        for TBgolden_pass, TBgen_pass in zip(job_results[0::2], job_results[1::2]):
             if not TBgolden_pass and not TBgen_pass:
                 mutant_pass = True
             elif TBgolden_pass and TBgen_pass:
@@ -147,7 +222,26 @@ class TaskTBeval():
         my_log = logger.success if (eval_pass or (len(passed_mutant_idx)/len(mutant_results)>=0.8)) else logger.failed
         my_log("%s %s!" % (print_str, result))
 
-    def run_testbench(self, dir, TB_code, DUT_code, TB_type, pychecker_code = "", raise_when_fail = False, save_en = True):
+    def run_golden_TB(self, dir, DUT_code) -> bool:
+        """
+        - run the golden TB on one DUT (mutant or gptgen RTL); the persistent verdict store is consulted first if enabled
+        - only the verdicts of the completed simulations are stored; an exception or a timeout may not happen next time
+        """
+        if golden_verdicts.en:
+            verdict = golden_verdicts.get(self.task_id, self.TB_golden, DUT_code)
+            if verdict is not None:
+                return verdict
+        run_status = {"completed": False}
+        try: #in case the mutant has syntax error
+            verdict = self.run_testbench(dir, self.TB_golden, DUT_code, "TB_golden", save_en=self.save_en, run_status=run_status)
+        except:
+            verdict = False
+            run_status["completed"] = False
+        if golden_verdicts.en and run_status["completed"]:
+            golden_verdicts.put(self.task_id, self.TB_golden, DUT_code, verdict)
+        return verdict
+
+    def run_testbench(self, dir, TB_code, DUT_code, TB_type, pychecker_code = "", raise_when_fail = False, save_en = True, stream = False, run_status = None):
         """
         it has two mode: pychecker mode or verilog testbench mode
         -input:
@@ -156,36 +250,112 @@ class TaskTBeval():
             - DUT_code: str; the DUT code
             - TB_type: str: TB_gen, TB_golden, Pychecker
             - pychecker_code: str; the pychecker code
+            - stream: bool; (Pychecker only) the TBout is streamed into the checker through a named pipe and the simulation is killed at the first failure, only for the pass/fail results (see iverilog_call.iverilog_stream_call)
+            - the outcome database (utils.outcome_db) is looked up first if enabled; a hit skips the simulation
+            - run_status: dict; if given, "completed" is set to whether the simulation (and the checker) completed without timeout or output overflow
         - output:
             - pass: bool; if the DUT passed the testbench
         """
         # iverilog part
         # save the TB and DUT
         assert TB_type in ["TB_gen", "TB_golden", "Pychecker"], "Invalid TB_type in run_testbench: " + TB_type
+        if (not save_en) and scratch_dir.en:
+            # run in a RAM-backed workspace; only the run info is copied to dir
+            with scratch_dir(dir) as work_dir:
+                return self.run_testbench(work_dir, TB_code, DUT_code, TB_type, pychecker_code, raise_when_fail, save_en=True, stream=stream, run_status=run_status)
         os.makedirs(dir, exist_ok=True)
-        self.working_dir = dir
-        with open(self.TB_path, "w") as f:
+        # the paths are not taken from self.working_dir, so that run_testbench can run in parallel threads
+        TB_path = os.path.join(dir, self.task_id + "_tb.v")
+        DUT_path = os.path.join(dir, self.task_id + ".v")
+        PY_path = os.path.join(dir, self.task_id + "_tb.py")
+        with open(TB_path, "w") as f:
             f.write(TB_code)
-        with open(self.DUT_path, "w") as f:
+        with open(DUT_path, "w") as f:
             f.write(DUT_code)
-        iv_run_info = iv.iverilog_call_and_save(dir, silent=True)
+        stream = stream and (TB_type == "Pychecker") and iv.STREAM_SUPPORTED and py.streamable(pychecker_code) and (not raise_when_fail)
+        db_key = None
+        if outcome_db.en:
+            checker_code = pychecker_code if TB_type == "Pychecker" else None
+            db_key = outcome_db.key("TBeval:" + TB_type, TB_code, DUT_code, checker_code)
+            outcome = outcome_db.get(db_key)
+            if stream:
+                # the full outcome also answers the streamed run; the streamed outcome is kept apart since its simulation is cut short
+                db_key = outcome_db.key("TBeval:Pychecker_stream", TB_code, DUT_code, checker_code)
+                outcome = outcome or outcome_db.get(db_key)
+            if outcome is not None:
+                if run_status is not None:
+                    run_status["completed"] = True
+                outcome_db.save_hit_info(dir, outcome)
+                if raise_when_fail:
+                    assert outcome["sim_ok"], "%s Iverilog Compilation Failed: the PREREQUISITE of 'Evaluation' is no syntactic error from Testbench!!!"%(TB_type)
+                    if TB_type == "Pychecker":
+                        assert outcome["check_ok"], "%s Python Compilation Failed: the PREREQUISITE of 'Evaluation' is no syntactic error from Python code!!!"%(TB_type)
+                if not save_en:
+                    remove_files_except(dir, ["run_info*"])
+                return outcome["tc_pass"]
+        # the runtime of the golden TB is not like the generated ones, it is not limited by the adaptive timeout
+        sim_timeout = self.timeouts.sim.value() if TB_type != "TB_golden" else STAGE_DEFAULT_TIMEOUT
+        if stream:
+            TC_pass = self.run_testbench_streamed(dir, PY_path, pychecker_code, save_en, db_key)
+            if not save_en:
+                remove_files_except(dir, ["run_info*"])
+            return TC_pass
+        iv_run_info = iv.iverilog_call_and_save(dir, silent=True, timeout=sim_timeout, compile_timeout=STAGE_DEFAULT_TIMEOUT)
+        self.timeouts.sim.observe_iv(iv_run_info, sample=(TB_type != "TB_golden"))
         if raise_when_fail:
             assert iv_run_info[0], "%s Iverilog Compilation Failed: the PREREQUISITE of 'Evaluation' is no syntactic error from Testbench!!!"%(TB_type)
         # pychecker part (if enabled)
         if TB_type == "Pychecker":
-            with open(self.PY_path, "w") as f:
+            with open(PY_path, "w") as f:
                 f.write(pychecker_code)
-            py_run_info = py.python_call_and_save(pypath=self.PY_path, silent=True)
+            py_run_info = py.python_call_and_save(pypath=PY_path, silent=True, timeout=self.timeouts.py.value())
+            self.timeouts.py.observe(py_run_info[1])
             if raise_when_fail:
                 assert py_run_info[0], "%s Python Compilation Failed: the PREREQUISITE of 'Evaluation' is no syntactic error from Python code!!!"%(TB_type)
             # check if the DUT passed the testbench
-            TC_pass = self.TC_pass_from_TC_out(sim_pass=True, sim_out=py_run_info[1]["out"], TB_type="Pychecker") & iv_run_info[0] & py_run_info[0]
+            TC_pass = self.TC_pass_from_TC_out(sim_pass=True, sim_out=py_run_info[1]["out"], TB_type="Pychecker", checker_result=py.read_checker_result(dir)) & iv_run_info[0] & py_run_info[0]
         else:
+            py_run_info = None
             TC_pass = self.TC_pass_from_TC_out(sim_pass=True, sim_out=iv_run_info[4]["out"], TB_type=TB_type) & iv_run_info[0]
+        if run_status is not None:
+            run_status["completed"] = outcome_db.completed(iv_run_info, py_run_info)
+        if db_key is not None:
+            outcome_db.put_run(db_key, iv_run_info, py_run_info, tc_pass=TC_pass)
         if not save_en:
             # os.system(f"rm -rf {dir}")
-            cmd = f"find {dir} -type f ! -name 'run_info*'" + r" -exec rm -f {} +"
-            os.system(cmd)
+            remove_files_except(dir, ["run_info*"])
+        return TC_pass
+
+    def run_testbench_streamed(self, dir, PY_path, pychecker_code, save_en = True, db_key = None) -> bool:
+        """
+        - the streamed pychecker mode of run_testbench: the simulation and the checker run at the same time; the checker stops at the first failed vector and the simulation is killed by the broken pipe
+        - the TB and DUT are already saved in dir; the streamed TBout is saved as TBout.txt only if save_en
+        - db_key: the key of the outcome database to store the outcome, None if not stored
+        """
+        with open(PY_path, "w") as f:
+            f.write(pychecker_code)
+        py.clear_checker_result(dir)
+        reader_argv = py.stream_checker_argv(os.path.basename(PY_path), stop_on_fail=True, tee_name=STREAM_TEE_NAME if save_en else None)
+        # the checker runs as long as the simulation
+        timeout = max(self.timeouts.sim.value(), self.timeouts.py.value())
+        iv_run_info, py_run_info = iv.iverilog_stream_call_and_save(dir, reader_argv, py.checker_env(), silent=True, timeout=timeout, compile_timeout=STAGE_DEFAULT_TIMEOUT)
+        self.timeouts.sim.observe_iv(iv_run_info, sample=False) # the checker is only killed with the simulation
+        if py_run_info is None:
+            # compilation failed
+            if db_key is not None:
+                outcome_db.put_run(db_key, iv_run_info, tc_pass=False)
+            return False
+        py_run_info = [not py_run_info["haserror"], py_run_info, py_run_info["err"]]
+        py.save_py_runinfo(py_run_info, dir)
+        if save_en and os.path.exists(os.path.join(dir, STREAM_TEE_NAME)):
+            os.replace(os.path.join(dir, STREAM_TEE_NAME), os.path.join(dir, "TBout.txt"))
+        if not py_run_info[0]:
+            TC_pass = False
+        else:
+            # a failure stops the simulation early (broken pipe), so the simulation result only matters when all the vectors passed
+            TC_pass = self.TC_pass_from_TC_out(sim_pass=True, sim_out=py_run_info[1]["out"], TB_type="Pychecker", checker_result=py.read_checker_result(dir)) and iv_run_info[0]
+        if db_key is not None:
+            outcome_db.put_run(db_key, iv_run_info, py_run_info, tc_pass=TC_pass)
         return TC_pass
 
     def clean_wave_vcd(self):
@@ -214,13 +384,14 @@ class TaskTBeval():
         return os.path.join(self.working_dir, self.task_id + "_tb.py")
 
     @staticmethod
-    def TC_pass_from_TC_out(sim_pass: bool, sim_out: str, TB_type="TB_gen"):
+    def TC_pass_from_TC_out(sim_pass: bool, sim_out: str, TB_type="TB_gen", checker_result:list|None=None):
         """
         get the information if DUT passed all the test cases from the testbench
         #### input
         - sim_pass: bool; if TB passed the compilation. if not, will return False without check
         - sim_out: the simulation output message;
         - TB_ty: "TB_gen" or "TB_golden" or "Pychecker"; the type of the testbench
+        - checker_result: (Pychecker only) the failed scenarios from the result file of the checker (see python_call.read_checker_result); if None, taken from sim_out
         """
         if not sim_pass:
             return False
@@ -233,6 +404,8 @@ class TaskTBeval():
                     return True
             return False
         elif TB_type in ['Pychecker']:
+            if checker_result is not None:
+                return len(checker_result) == 0
             # check if the last [] contains any element
             # find the last ] in the out
             last_bracket_end = sim_out.rfind("]")
@@ -243,3 +416,28 @@ class TaskTBeval():
                 return True
             else:
                 return False
+
+
+def warmup_golden_verdicts(probset_data:list[dict], warmup_dir:str, workers:int=1):
+    """
+    - fill the golden verdict store for a whole probset (mutants and gptgen RTLs of each task) in parallel
+    - the verdict store should be configured before calling this function
+    - input:
+        - probset_data: the data of the probset, see HDLBitsProbset.data
+        - warmup_dir: the working dir of the simulations
+        - workers: the number of parallel simulations
+    """
+    jobs = [] # [(TaskTBeval, dir, DUT_code)]
+    for prob_data in probset_data:
+        if prob_data.get("testbench", None) is None:
+            continue
+        task_id = prob_data["task_id"]
+        task_eval = TaskTBeval(task_id, os.path.join(warmup_dir, task_id), TB_gen=None, TB_golden=prob_data["testbench"], runfiles_save=False)
+        for DUT_key, subdir_name in [("mutants", "mutant"), ("gptgen_RTL", "gptgen_DUT")]:
+            for idx, DUT_code in enumerate(prob_data.get(DUT_key, None) or []):
+                if golden_verdicts.get(task_id, prob_data["testbench"], DUT_code) is None:
+                    jobs.append((task_eval, os.path.join(task_eval.task_dir, "%s_%d"%(subdir_name, idx+1)), DUT_code))
+    logger.info("golden verdict warm-up: %d verdicts to compute, %d already stored" % (len(jobs), len(golden_verdicts.verdicts)))
+    with ThreadPoolExecutor(max_workers=max(1, workers)) as executor:
+        list(executor.map(lambda job: job[0].run_golden_TB(job[1], job[2]), jobs))
+    logger.info("golden verdict warm-up finished, %d verdicts stored in %s" % (len(golden_verdicts.verdicts), golden_verdicts.path))
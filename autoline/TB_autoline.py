@@ -13,13 +13,19 @@ from config import Config
 from loader_saver import save_dict_json_form, log_localprefix
 from data.probset import HDLBitsProbset
 from loader_saver import autologger as logger
-from utils.utils import Timer
+from utils.utils import Timer, scratch_dir
+from utils.subproc import set_default_limits
 from autoline.TB1_gen import TaskTBgen
 from autoline.TB2_syncheck import TaskTBsim
-from autoline.TB3_funccheck import TaskTBcheck
-from autoline.TB4_eval import TaskTBeval
+from autoline.TB3_funccheck import TaskTBcheck, checker_memo
+from autoline.TB4_eval import TaskTBeval, golden_verdicts, warmup_golden_verdicts
 from prompt_scripts import BaseScript
-from LLM_call import llm_manager
+from LLM_call import llm_manager, llm_clients, llm_engine, llm_retry
+from utils.llm_cache import llm_cache
+from iverilog_call import iv_cache
+from utils.outcome_db import outcome_db
+from utils.sim_timeout import TaskTimeouts
+from python_call import py_pool, set_checker_verbose
 
 
 def run_autoline():
@@ -28,6 +34,15 @@ def run_autoline():
     autoline = AutoLine(config)
     autoline()
 
+def run_golden_warmup():
+    """fill the golden verdict store for the whole probset (see TB4_eval.warmup_golden_verdicts)"""
+    config = Config()
+    cfg_TBeval = config.autoline.TBeval
+    golden_verdicts.set_config(True, cfg_TBeval.golden_cache.path)
+    probset = HDLBitsProbset()
+    probset.load_by_config(config.autoline.probset)
+    warmup_golden_verdicts(probset.data, os.path.join(config.save.root, "golden_warmup"), cfg_TBeval.sim_workers)
+
 class AutoLine():
     """the class of the autoline"""
     def __init__(self, config: Config):
@@ -46,7 +61,25 @@ class AutoLine():
             self.max_concurrency = int(getattr(self.config.gpt, "concurrency", getattr(self.config.run, "concurrency", 1)))
         except Exception:
             self.max_concurrency = 1
+        # one LLM connection per task in flight, kept alive between the calls
+        llm_clients.set_config(self.max_concurrency)
+        cfg_engine = config.gpt.async_engine
+        llm_engine.set_config(cfg_engine.en, cfg_engine.max_in_flight, cfg_engine.limits)
+        cfg_llm_cache = config.gpt.response_cache
+        llm_cache.set_config(cfg_llm_cache.mode, cfg_llm_cache.path, cfg_llm_cache.max_size)
+        cfg_retry = config.gpt.retry
+        llm_retry.set_config(cfg_retry.max_retries, cfg_retry.timeout, cfg_retry.backoff_base, cfg_retry.backoff_max, cfg_retry.hedge.en, cfg_retry.hedge.quantile, cfg_retry.hedge.min_samples)
         self._run_info_lock = threading.Lock()
+        cfg_cache = config.autoline.compile_cache
+        iv_cache.set_config(cfg_cache.en, cfg_cache.dir, cfg_cache.max_size)
+        golden_verdicts.set_config(config.autoline.TBeval.golden_cache.en, config.autoline.TBeval.golden_cache.path)
+        checker_memo.set_config(config.autoline.TBcheck.checker_memo.en, config.autoline.TBcheck.checker_memo.path)
+        scratch_dir.set_config(config.autoline.scratch.en, config.autoline.scratch.root)
+        outcome_db.set_config(config.autoline.outcome_db.en, config.autoline.outcome_db.path)
+        set_checker_verbose(config.autoline.checker_verbose)
+        py_pool.set_config(config.autoline.py_pool.en, config.autoline.py_pool.size, config.autoline.py_pool.max_jobs)
+        cfg_limits = config.autoline.sim_limits
+        set_default_limits(cfg_limits.cpu_time, cfg_limits.mem_size, cfg_limits.keep_size, cfg_limits.max_output, cfg_limits.max_rate)
 
     def run(self):
         def run_single(probdata_single, idx):
@@ -76,6 +109,15 @@ class AutoLine():
                 if next_idx < total:
                     futures[executor.submit(run_single, self.probset.data[next_idx], next_idx)] = next_idx
                     next_idx += 1
+        py_pool.shutdown()
+        llm_engine.shutdown()
+        llm_clients.close()
+        if iv_cache.en:
+            self.logger.info(f"iverilog compile cache: {iv_cache.hits_total} hits, {iv_cache.misses_total} misses, hit rate: {iv_cache.hit_rate_total}")
+        if outcome_db.en:
+            self.logger.info(f"outcome database: {outcome_db.hits_total} hits, {outcome_db.misses_total} misses, hit rate: {outcome_db.hit_rate_total}")
+        if llm_cache.en:
+            self.logger.info(f"LLM response cache ({llm_cache.mode}): {llm_manager.cache_hits_total} hits, {llm_manager.cache_misses_total} misses, hit rate: {llm_manager.cache_hit_rate_total}, saved: {llm_manager.tokens_saved_total} tokens, ${round(llm_manager.cost_saved_total, 4)}")
         if self.analyzer_en:
             self.run_analyzer()
 
@@ -133,6 +175,15 @@ class AutoLine_Task():
         self.correct_mode = config.autoline.TBcheck.correct_mode
         self.rtl_compens_en = config.autoline.TBcheck.rtl_compens_en
         self.rtl_compens_max_iter = config.autoline.TBcheck.rtl_compens_max_iter
+        self.batch_sim = config.autoline.TBcheck.batch_sim
+        self.sim_workers = config.autoline.TBcheck.sim_workers
+        self.rtl_dedup = config.autoline.TBcheck.rtl_dedup
+        self.early_stop = config.autoline.TBcheck.early_stop
+        self.trace_reuse = config.autoline.TBcheck.trace_reuse
+        self.shared_golden = config.autoline.TBcheck.shared_golden
+        # the adaptive timeouts of the simulations and checkers, shared by the stages of this task (re-tuned whenever the driver or checker changes)
+        cfg_timeout = config.autoline.adaptive_timeout
+        self.timeouts = TaskTimeouts(config.autoline.timeout, cfg_timeout.en, cfg_timeout.k, cfg_timeout.floor, cfg_timeout.ceiling, cfg_timeout.samples)
         # stages:
         self.TBgen_manager:TaskTBgen = None
         self.TBgen:BaseScript = None
@@ -152,11 +203,13 @@ class AutoLine_Task():
         self.run_info = {}
         self.run_info_short = {}
         self.TBcheck_rtl_newly_gen_num = 0 # in autoline, "funccheck" = "TBcheck"
+        self.TBcheck_sims_saved = 0
         self.op_record = [] # will record the order of each stage, for example: ["gen", "syncheck", "funccheck", "gen", "syncheck", "funccheck", "eval"]
         self.funccheck_op_record = []
         self.funccheck_iters = []
-        # renew current section of llm_manager and logger
+        # renew current section of llm_manager, iv_cache and logger
         llm_manager.new_section()
+        iv_cache.new_section()
         logger.set_temp_log()
 
     def run(self):
@@ -198,7 +251,8 @@ class AutoLine_Task():
             self.header, 
             working_dir, 
             self.task_id, 
-            self.config
+            self.config,
+            self.timeouts
         )
         self.TBsim.run()
         self.TB_code_v = self.TBsim.TB_code_now
@@ -226,6 +280,13 @@ class AutoLine_Task():
             circuit_type=self.circuit_type,
             rtl_compens_en=self.rtl_compens_en,
             rtl_compens_max_iter=self.rtl_compens_max_iter,
+            batch_sim=self.batch_sim,
+            sim_workers=self.sim_workers,
+            rtl_dedup=self.rtl_dedup,
+            early_stop=self.early_stop,
+            trace_reuse=self.trace_reuse,
+            shared_golden=self.shared_golden,
+            timeouts=self.timeouts,
             main_model = self.main_model,
             rtlgen_model = self.rtlgen_model,
             desc_improve=self.update_desc
@@ -238,6 +299,7 @@ class AutoLine_Task():
         self.funccheck_op_record.append(self.TBcheck.op_record)
         self.funccheck_iters.append(self.TBcheck.iter_now)
         self.TBcheck_rtl_newly_gen_num += self.TBcheck.rtl_newly_gen_num
+        self.TBcheck_sims_saved += self.TBcheck.sims_saved
         self.next_action = self.TBcheck.next_action
         if self.update_desc:
             self.prob_data['description'] = self.TBcheck.update_description()
@@ -258,7 +320,10 @@ class AutoLine_Task():
             DUT_gptgen_list=None, 
             pychecker_en=self.TBsim.pychecker_en, 
             pychecker_code=self.TB_code_py,
-            runfiles_save=self.save_compile
+            runfiles_save=self.save_compile,
+            sim_workers=self.config.autoline.TBeval.sim_workers,
+            stream_check=self.config.autoline.TBeval.stream_check,
+            timeouts=self.timeouts
         )
         # attention: the rtls in DUT_gptgen_list are not the same as the rtls used in TBcheck, so currently we just block this feature
         try:
@@ -332,13 +397,28 @@ class AutoLine_Task():
             "prompt_tokens": llm_manager.tokens_in_section,
             "completion_tokens": llm_manager.tokens_out_section,
             "token_cost": llm_manager.cost_section,
+            "llm_retries": llm_manager.retries_section,
+            "llm_hedges": llm_manager.hedges_section,
             "ERROR(incomplete)": self.incomplete_running,
             "op_record": self.op_record,
             "reboot_times": self.autoline_iter_now,
             "max_iter": self.iter_max
         }
         # token and cost from llm_manager
-        
+        # LLM response cache
+        if llm_cache.en:
+            self.run_info.update({
+                "llm_cache_hits": "%d/%d"%(llm_manager.cache_hits_section, llm_manager.cache_hits_section + llm_manager.cache_misses_section),
+                "token_cost_saved": llm_manager.cost_saved_section
+            })
+        # iverilog compile cache
+        if iv_cache.en:
+            self.run_info.update({
+                "iv_cache_hits": "%d/%d"%(iv_cache.hits_section, iv_cache.hits_section + iv_cache.misses_section),
+                "iv_cache_hit_rate": iv_cache.hit_rate_section
+            })
+        # the chosen adaptive timeouts and the runs killed by the timeouts
+        self.run_info.update(self.timeouts.info())
         # TBgen
         if self.TBgen is not None:
             # self.run_info["prompt_tokens"] += self.TBgen.tokens["prompt"]
@@ -369,6 +449,8 @@ class AutoLine_Task():
                 "TBcheck_oprecord": self.funccheck_op_record,
                 "rtl_num_newly_gen": self.TBcheck_rtl_newly_gen_num
             })
+            if self.early_stop:
+                self.run_info["TBcheck_sims_saved"] = self.TBcheck_sims_saved
         # TBeval
         if self.TBeval is not None:
             if self.TBeval.Eval1_exist:
@@ -6,7 +6,7 @@ LastEdited  :   2024/8/16 13:37:31
 autoline.py (c) 2023
 """
 
-from autoline.TB_autoline import run_autoline
+from autoline.TB_autoline import run_autoline, run_golden_warmup
 
 from autoline.TB1_gen import TaskTBgen
 from autoline.TB2_syncheck import TaskTBsim
@@ -0,0 +1,269 @@
+"""
+Description :   tools for handling the llm-generated RTL population in TBcheck (multi-DUT harness for batched discrimination, normalization and deduplication)
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/3 10:12:40
+LastEdited  :   2025/3/7 09:48:05
+"""
+
+import re
+from prompt_scripts.utils import extract_signals
+from utils.utils import hash_str
+
+RTL_SUFFIX = "__rtl%d" # appended to the module/instance/wire names of the i-th RTL in the harness
+LINE_TAG = "@rtl%d@" # prefix of each TBout line written by the i-th DUT in the harness
+LINE_TAG_RE = re.compile(r"^@rtl(\d+)@")
+DUT_FILE = "DUT_rtl%d.v"
+# the RTLs containing these system tasks would influence the other DUTs in the shared simulation
+RTL_BATCH_BLOCKERS = re.compile(r"\$(finish|stop|fopen|fclose|fdisplay|fwrite)\b")
+
+def rename_modules(code:str, idx:int) -> str:
+    """
+    - rename all the modules defined in the RTL code (top_module and its submodules) by appending the suffix of the idx-th RTL
+    - the instantiations inside the code are renamed as well
+    """
+    suffix = RTL_SUFFIX % idx
+    module_names = set(re.findall(r"\b(?:macro)?module\s+(\w+)", code))
+    for name in module_names:
+        code = re.sub(r"\b%s\b" % re.escape(name), name + suffix, code)
+    return code
+
+def batch_blocked(rtl_code:str) -> bool:
+    """
+    - whether the RTL should not be put into the multi-DUT harness (it will be simulated alone)
+    """
+    return RTL_BATCH_BLOCKERS.search(rtl_code) is not None
+
+def _find_statement_end(code:str, start:int) -> int:
+    """
+    - start: the index of the "(" of a system task call
+    - return the index after the ";" that ends the call, -1 if not found; strings are skipped
+    """
+    depth = 0
+    in_str = False
+    i = start
+    while i < len(code):
+        char = code[i]
+        if in_str:
+            if char == "\\":
+                i += 1
+            elif char == '"':
+                in_str = False
+        elif char == '"':
+            in_str = True
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+            if depth == 0:
+                semicolon = code.find(";", i)
+                if semicolon == -1 or code[i+1:semicolon].strip() != "":
+                    return -1
+                return semicolon + 1
+        i += 1
+    return -1
+
+def _split_fdisplay(statement:str):
+    """
+    - split '$fdisplay(file, "fmt", args);' into (handle, fmt, args); args can be ""
+    - return None if the statement is not in this form
+    """
+    match = re.match(r'\$fdisplay\s*\(\s*(\w+)\s*,\s*"((?:[^"\\]|\\.)*)"\s*(.*)\)\s*;$', statement, re.S)
+    if match is None:
+        return None
+    return match.group(1), match.group(2), match.group(3)
+
+def gen_multidut_harness(driver_code:str, header:str, rtl_idxes:list[int]) -> str|None:
+    """
+    - generate the multi-DUT harness from the driver: the DUT instantiation is replaced by one instance per RTL (driven by the same stimulus); every $fdisplay is duplicated for each instance with the output signals of this instance and a line tag (see split_multidut_tbout)
+    - input:
+        - driver_code: the verilog driver (testbench) of the pychecker workflow
+        - header: the module header of the DUT
+        - rtl_idxes: the indexes of the RTLs (should be the same as the ones used in rename_modules)
+    - output:
+        - the harness code; None if the driver is not supported (the outputs of DUT are used by the driver beyond $fdisplay, positional port connection, other file writing tasks...)
+    """
+    signals = extract_signals(header)
+    output_widths = {signal["name"]: signal["width"] for signal in signals if signal["type"] == "output"}
+    if re.search(r"\$(fwrite|fstrobe|fmonitor)\b", driver_code):
+        return None
+    instances = list(re.finditer(r"\btop_module\s+(\w+)\s*\(", driver_code))
+    if len(instances) != 1:
+        return None
+    inst_start = instances[0].start()
+    inst_end = _find_statement_end(driver_code, instances[0].end()-1)
+    if inst_end == -1:
+        return None
+    inst_name = instances[0].group(1)
+    inst_code = driver_code[inst_start:inst_end]
+    port_conns = re.findall(r"\.(\w+)\s*\(\s*(\w+)\s*\)", inst_code)
+    if len(port_conns) != inst_code.count("."):
+        # positional or expression connections are not supported
+        return None
+    output_wires = {wire: output_widths[port] for port, wire in port_conns if port in output_widths}
+    # find all the $fdisplay statements
+    inst_mark = "/*multi-DUT instances*/"
+    code_rest = driver_code[:inst_start] + inst_mark + driver_code[inst_end:]
+    displays = [] # [(start, end, (handle, fmt, args))]
+    for display in re.finditer(r"\$fdisplay\b", code_rest):
+        end = _find_statement_end(code_rest, code_rest.find("(", display.start()))
+        if end == -1:
+            return None
+        parts = _split_fdisplay(code_rest[display.start():end])
+        if parts is None:
+            return None
+        displays.append((display.start(), end, parts))
+    # the outputs of DUT can only appear in the declarations and $fdisplays; otherwise the stimulus may depend on the DUT
+    code_check = ""
+    last_end = 0
+    for start, end, _ in displays:
+        code_check += code_rest[last_end:start]
+        last_end = end
+    code_check += code_rest[last_end:]
+    # the declared names are removed, but not the initialisers (such as "wire x = out;"), which read the signals like any other expression
+    code_check = re.sub(r"\b(wire|reg|logic)\b([^;=]*)(=?)([^;]*);", lambda m: m.group(4) if m.group(3) else "", code_check)
+    for wire in output_wires:
+        if re.search(r"\b%s\b" % re.escape(wire), code_check):
+            return None
+    # new instances
+    insts_new = "// multi-DUT instantiation\n"
+    for idx in rtl_idxes:
+        suffix = RTL_SUFFIX % idx
+        for wire, width in output_wires.items():
+            insts_new += f"wire {width} {wire}{suffix};\n"
+        inst_new = inst_code.replace("top_module", "top_module" + suffix, 1)
+        inst_new = re.sub(r"\b%s\b" % re.escape(inst_name), inst_name + suffix, inst_new, count=1)
+        inst_new = re.sub(r"\.(\w+)(\s*)\((\s*)(\w+)(\s*)\)", lambda m: f".{m.group(1)}{m.group(2)}({m.group(3)}{m.group(4)}{suffix if m.group(4) in output_wires else ''}{m.group(5)})", inst_new)
+        insts_new += inst_new + "\n"
+    # new $fdisplays
+    displays_new = []
+    for start, end, (handle, fmt, args) in displays:
+        display_new = "begin "
+        for idx in rtl_idxes:
+            suffix = RTL_SUFFIX % idx
+            args_new = args
+            for wire in output_wires:
+                args_new = re.sub(r"\b%s\b" % re.escape(wire), wire + suffix, args_new)
+            display_new += f'$fdisplay({handle}, "{LINE_TAG % idx}{fmt}"{args_new}); '
+        display_new += "end"
+        displays_new.append(display_new)
+    code_rest_new = ""
+    last_end = 0
+    for (start, end, _), display_new in zip(displays, displays_new):
+        code_rest_new += code_rest[last_end:start] + display_new
+        last_end = end
+    code_rest_new += code_rest[last_end:]
+    return code_rest_new.replace(inst_mark, insts_new, 1)
+
+def split_multidut_tbout(tbout:str, rtl_idxes:list[int]) -> dict[int, str]:
+    """
+    - split the TBout of the multi-DUT harness into one TBout per RTL (the line tags are removed)
+    - the untagged lines (multi-line format strings) belong to the previous tagged line
+    """
+    lines_split = {idx: [] for idx in rtl_idxes}
+    idx_now = None
+    lines = tbout.split("\n")
+    if lines[-1] == "":
+        lines = lines[:-1]
+    for line in lines:
+        match = LINE_TAG_RE.match(line)
+        if match is not None:
+            idx_now = int(match.group(1))
+            line = line[match.end():]
+        if idx_now in lines_split:
+            lines_split[idx_now].append(line)
+    return {idx: "".join(line + "\n" for line in lines) for idx, lines in lines_split.items()}
+
+def compile_error_rtls(iverilog_err:str) -> set[int]|None:
+    """
+    - find the RTLs that cause the compilation errors of the multi-DUT harness
+    - return None if any error can not be attributed to an RTL (for example, the error is from the driver itself)
+    """
+    error_rtls = set()
+    for line in iverilog_err.split("\n"):
+        location = re.match(r"^\s*(\S+?\.v):(\d+):", line)
+        if location is None:
+            continue
+        message = line[location.end():]
+        if not any(key in message for key in ["error", "sorry", "Syntax", "Unknown module"]):
+            continue
+        file_match = re.match(r"^DUT_rtl(\d+)\.v$", location.group(1).split("/")[-1])
+        tag_match = re.search(r"__rtl(\d+)", message)
+        if file_match is not None:
+            error_rtls.add(int(file_match.group(1)))
+        elif tag_match is not None:
+            error_rtls.add(int(tag_match.group(1)))
+        else:
+            return None
+    return error_rtls if error_rtls else None
+
+# tokens of verilog code for normalization; the order of the alternatives matters
+RTL_TOKEN_RE = re.compile(r"""
+    (?P<comment>//[^\n]*|/\*.*?\*/)
+    |(?P<directive>`\w+[^\n]*)
+    |(?P<string>"(?:[^"\\\n]|\\.)*")
+    |(?P<number>(?:\d[\d_]*)?\s*'[sS]?[bBoOdDhH]\s*[0-9a-fA-FxXzZ?_]+|'[01xXzZ]|\d[\d_]*(?:\.\d[\d_]*)?(?:[eE][+-]?\d+)?)
+    |(?P<system>\$\w+)
+    |(?P<ident>[a-zA-Z_][\w$]*|\\\S+)
+    |(?P<space>\s+)
+    |(?P<op><<<|>>>|===|!==|<=|>=|==|!=|&&|\|\||<<|>>|\*\*|~&|~\||~\^|\^~|->|\+\+|--|\+:|-:|::)
+    |(?P<other>.)
+""", re.S | re.X)
+# verilog and systemverilog keywords (kept in normalization)
+RTL_KEYWORDS = set("""
+    always always_comb always_ff always_latch and assign automatic begin buf bufif0 bufif1 case casex casez cell cmos config deassign default defparam design disable
+    edge else end endcase endconfig endfunction endgenerate endmodule endprimitive endspecify endtable endtask event for force forever fork function generate genvar
+    highz0 highz1 if ifnone incdir include initial inout input instance integer join large liblist library localparam macromodule medium module nand negedge nmos nor
+    noshowcancelled not notif0 notif1 or output parameter pmos posedge primitive pull0 pull1 pulldown pullup pulsestyle_ondetect pulsestyle_onevent rcmos real realtime
+    reg release repeat rnmos rpmos rtran rtranif0 rtranif1 scalared showcancelled signed small specify specparam strong0 strong1 supply0 supply1 table task time tran
+    tranif0 tranif1 tri tri0 tri1 triand trior trireg unsigned use uwire vectored wait wand weak0 weak1 while wire wor xnor xor
+    bit byte int logic longint shortint enum typedef struct packed unique priority return break continue void const var
+""".split())
+TOP_MODULE = "top_module"
+
+def normalize_rtl(code:str, header:str=None) -> str:
+    """
+    - normalize the RTL code for deduplication: comments are removed, whitespace is collapsed (one space between tokens), "input wire"/"output wire" in ports are simplified as "input"/"output", and the identifiers (except the keywords, top_module and its ports) are renamed as _n0, _n1, ... in the order of their first appearance
+    - two RTLs with the same normalized code behave the same in simulation (the renaming is consistent over the whole code)
+    - input:
+        - header: the module header of the DUT; its port names are kept. If None, the port names are taken from the code
+    """
+    tokens = []
+    for match in RTL_TOKEN_RE.finditer(code):
+        kind = match.lastgroup
+        if kind in ["comment", "space"]:
+            continue
+        tokens.append((kind, match.group(kind).strip() if kind == "directive" else re.sub(r"\s+", "", match.group(kind)) if kind == "number" else match.group(kind)))
+    kept = set(RTL_KEYWORDS) | {TOP_MODULE}
+    if header is not None:
+        kept |= {signal["name"] for signal in extract_signals(header)}
+    else:
+        kept |= set(re.findall(r"\b(?:input|output|inout)\b[^;,)]*?(\w+)\s*(?=[,;)])", code))
+    names = {}
+    tokens_new = []
+    for idx, (kind, token) in enumerate(tokens):
+        if kind == "ident" and token == "wire" and idx > 0 and tokens[idx-1][1] in ["input", "output", "inout"]:
+            continue
+        if kind == "ident" and token not in kept:
+            if token not in names:
+                names[token] = "_n%d" % (len(names))
+            token = names[token]
+        tokens_new.append(token)
+    return " ".join(tokens_new)
+
+def dedup_rtls(rtl_list:list[str], header:str=None) -> tuple[list[int], list[int]]:
+    """
+    - find the RTLs that are the same after normalization (see normalize_rtl)
+    - output:
+        - unique_idxes: the indexes (in rtl_list) of the first RTL of each group
+        - group_of: for each RTL in rtl_list, the index of its group in unique_idxes
+    """
+    unique_idxes = []
+    group_of = []
+    groups = {} # normalized hash: group index
+    for rtl_idx, rtl_code in enumerate(rtl_list):
+        key = hash_str(normalize_rtl(rtl_code, header))
+        if key not in groups:
+            groups[key] = len(unique_idxes)
+            unique_idxes.append(rtl_idx)
+        group_of.append(groups[key])
+    return unique_idxes, group_of
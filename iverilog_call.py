@@ -2,13 +2,18 @@
 Description :   This file is related to iverilog calling. Some codes are modified from autosim.py v0.2 by Rain Bellinsky.
 Author      :   Ruidi Qiu (r.qiu@tum.de)
 Time        :   2023/12/9 23:22:51
-LastEdited  :   2025/2/22 16:13:21
+LastEdited  :   2025/3/8 14:26:51
 """
 
 import os
 import sys
-from utils.utils import run_in_dir
-from utils.subproc import subproc_call
+import json
+import shutil
+import hashlib
+import time
+import threading
+import subprocess as sp
+from utils.subproc import proc_run, run_stat_line
 
 if os.name == 'nt':
     IC = '\\' # IC: Iterval Character
@@ -19,12 +24,169 @@ RUN_DIR = "ipynb_demo/verilog_test/" # this is only used when directly run this
 
 IVERILOG_PATH = "/usr/bin/iverilog"
 IVERILOG_VVP_PATH = "/usr/bin/vvp"
+IVERILOG_FLAGS = "-g2012"
 
-def iverilog_call(dir, silent = False, timeout = 120):
+class IverilogCompileCache():
+    """
+    - content-addressed cache of the compiled vvp files, shared by all the iverilog_call in this process and persistent on disk
+    - key: the hash of the sorted source files (name and content), the compiling flags and the iverilog version
+    - each entry contains the vvp file and the compiling result (run1_info); only the successful compilations are cached
+    - the entries are evicted in LRU order (by the last access time) when the total size exceeds max_size
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(IverilogCompileCache, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not getattr(self, "_initialized", False):
+            self.en = False
+            self.dir = None
+            self.max_size = 0 # bytes
+            self._version = None
+            self._lock = threading.Lock()
+            # total
+            self.hits_total = 0
+            self.misses_total = 0
+            # section
+            self.hits_section = 0
+            self.misses_section = 0
+            self._initialized = True
+
+    def set_config(self, en:bool, dir:str, max_size:int):
+        """
+        - max_size: the max total size of the cache, unit: MB
+        """
+        self.en = en
+        self.dir = dir
+        self.max_size = max_size * 1024 * 1024
+        if self.en:
+            os.makedirs(self.dir, exist_ok=True)
+
+    @property
+    def iverilog_version(self):
+        if self._version is None:
+            try:
+                version_info = sp.run([IVERILOG_PATH, "-V"], stdout=sp.PIPE, stderr=sp.PIPE, timeout=10)
+                self._version = version_info.stdout.decode("utf-8").split("\n")[0]
+            except (OSError, sp.TimeoutExpired):
+                self._version = "unknown"
+        return self._version
+
+    def key(self, dir:str, filelist:list[str], flags:str) -> str|None:
+        """
+        - return the cache key of the compilation; None if the sources cannot be read
+        """
+        sha = hashlib.sha256()
+        sha.update(flags.encode("utf-8") + b"\0" + self.iverilog_version.encode("utf-8") + b"\0")
+        for filename in sorted(filelist):
+            filename = filename.strip()
+            try:
+                with open(os.path.join(dir, filename), "rb") as f:
+                    content = f.read()
+            except OSError:
+                return None
+            sha.update(filename.encode("utf-8") + b"\0" + content + b"\0")
+        return sha.hexdigest()
+
+    def fetch(self, key:str, vvp_path:str) -> dict|None:
+        """
+        - copy the cached vvp file to vvp_path and return the cached compiling result; None if miss
+        """
+        cached_vvp = os.path.join(self.dir, key + ".vvp")
+        cached_info = os.path.join(self.dir, key + ".json")
+        try:
+            with open(cached_info, "r") as f:
+                run1_info = json.load(f)
+            shutil.copyfile(cached_vvp, vvp_path)
+            os.utime(cached_vvp)
+            os.utime(cached_info)
+        except (OSError, ValueError):
+            run1_info = None
+        with self._lock:
+            if run1_info is None:
+                self.misses_total += 1
+                self.misses_section += 1
+            else:
+                self.hits_total += 1
+                self.hits_section += 1
+        return run1_info
+
+    def store(self, key:str, vvp_path:str, run1_info:dict):
+        """
+        - save the vvp file and the compiling result into the cache, then evict the old entries if needed
+        """
+        cached_vvp = os.path.join(self.dir, key + ".vvp")
+        cached_info = os.path.join(self.dir, key + ".json")
+        tmp_suffix = ".tmp%d_%d" % (os.getpid(), threading.get_ident())
+        try:
+            shutil.copyfile(vvp_path, cached_vvp + tmp_suffix)
+            with open(cached_info + tmp_suffix, "w") as f:
+                json.dump(run1_info, f)
+            os.replace(cached_vvp + tmp_suffix, cached_vvp)
+            os.replace(cached_info + tmp_suffix, cached_info)
+        except OSError:
+            return
+        with self._lock:
+            self._evict()
+
+    def _evict(self):
+        entries = {} # key: [last access time, size, paths]
+        total_size = 0
+        for entry in os.scandir(self.dir):
+            if not entry.is_file():
+                continue
+            try:
+                stat = entry.stat()
+            except OSError:
+                continue
+            key = entry.name.split(".")[0]
+            entries.setdefault(key, [0, 0, []])
+            entries[key][0] = max(entries[key][0], stat.st_mtime)
+            entries[key][1] += stat.st_size
+            entries[key][2].append(entry.path)
+            total_size += stat.st_size
+        if total_size <= self.max_size:
+            return
+        for _, size, paths in sorted(entries.values()):
+            if total_size <= self.max_size:
+                break
+            for path in paths:
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+            total_size -= size
+
+    def new_section(self):
+        """
+        new statistic section (only reset the hits and misses of the section)
+        """
+        with self._lock:
+            self.hits_section = 0
+            self.misses_section = 0
+
+    @property
+    def hit_rate_section(self):
+        lookups = self.hits_section + self.misses_section
+        return round(self.hits_section / lookups, 4) if lookups else None
+
+    @property
+    def hit_rate_total(self):
+        lookups = self.hits_total + self.misses_total
+        return round(self.hits_total / lookups, 4) if lookups else None
+
+iv_cache = IverilogCompileCache()
+
+def iverilog_call(dir, silent = False, timeout = 120, compile_only = False, compile_timeout = None):
     """
     #### input:
     - dir: the name of the directory that contains all verilog files; can end with or without "/"
     - task_id: the name of the task, will be used as the name of the vvp file
+    - compile_only: if True, only compile (the vvp is not run; [3] and [4] are None)
+    - compile_timeout: the timeout of the compilation; if None, the same as timeout (the timeout of the simulation)
 
     #### output:
     return a list of 5 elements:
@@ -53,17 +215,25 @@ def iverilog_call(dir, silent = False, timeout = 120):
     # vvp_filename = "%s.vvp"%(task_id)
     vvp_filename = "run.vvp"
     # cmd1 = "iverilog -g2012 -o %s %s"%(vvp_filename, vlist_str) # used to be vvp_path
-    cmd1 = "%s -g2012 -o %s %s"%(IVERILOG_PATH, vvp_filename, vlist_str) # used to be vvp_path
+    cmd1 = "%s %s -o %s %s"%(IVERILOG_PATH, IVERILOG_FLAGS, vvp_filename, vlist_str) # used to be vvp_path
+    argv1 = [IVERILOG_PATH] + IVERILOG_FLAGS.split() + ["-o", vvp_filename] + [filename.strip() for filename in vlist_data]
     s_print(cmd1)
-    with run_in_dir(dir):
-        run1_info = subproc_call(cmd1, timeout) # {"out": out_reg, "err": err_reg, "haserror": error_exist}
+    cache_key = iv_cache.key(dir, vlist_data, IVERILOG_FLAGS) if iv_cache.en else None
+    run1_info = iv_cache.fetch(cache_key, os.path.join(dir, vvp_filename)) if cache_key is not None else None
+    if run1_info is not None:
+        s_print("iverilog compile cache hit")
+    else:
+        run1_info = proc_run(argv1, compile_timeout if compile_timeout is not None else timeout, cwd=dir) # {"out": out_reg, "err": err_reg, "haserror": error_exist}
+        if (cache_key is not None) and (not run1_info["haserror"]):
+            iv_cache.store(cache_key, os.path.join(dir, vvp_filename), run1_info)
     if run1_info["haserror"]:
         s_print("iverilog compiling failed")
         return [False, cmd1, run1_info, None, None, run1_info["err"]]
+    if compile_only:
+        return [True, cmd1, run1_info, None, None, '']
     cmd2 = "%s %s"%(IVERILOG_VVP_PATH, vvp_filename) # used to be vvp_path
     s_print(cmd2)
-    with run_in_dir(dir):
-        run2_info = subproc_call(cmd2, timeout)
+    run2_info = proc_run([IVERILOG_VVP_PATH, vvp_filename], timeout, cwd=dir)
     if run2_info["haserror"]:
         s_print("vvp failed")
         return [False, cmd1, run1_info, cmd2, run2_info, run2_info["err"]]
@@ -86,6 +256,7 @@ def save_iv_runinfo(ivrun_info, dir):
     if ivrun_info[2] is not None:
         lines += "iverilog cmd 1 output:\n%s\n" % (ivrun_info[2]["out"])
         lines += "iverilog cmd 1 error:\n%s\n" % (ivrun_info[2]["err"])
+        lines += run_stat_line(ivrun_info[2])
     # cmd 2:
     if ivrun_info[3] is not None:
         lines += "iverilog cmd 2:\n%s\n" % (ivrun_info[3])
@@ -93,18 +264,96 @@ def save_iv_runinfo(ivrun_info, dir):
     if ivrun_info[4] is not None:
         lines += "iverilog cmd 2 output:\n%s\n" % (ivrun_info[4]["out"])
         lines += "iverilog cmd 2 error:\n%s\n" % (ivrun_info[4]["err"])
+        lines += run_stat_line(ivrun_info[4])
     # save to file:
     with open(run_info_path, "w") as f:
         f.write(lines)
 
-def iverilog_call_and_save(dir, silent = False, timeout = 120):
+def iverilog_call_and_save(dir, silent = False, timeout = 120, compile_only = False, compile_timeout = None):
     """
     run the iverilog and save the run info
     """
-    iv_run_result = iverilog_call(dir, silent, timeout)
+    iv_run_result = iverilog_call(dir, silent, timeout, compile_only, compile_timeout)
     save_iv_runinfo(iv_run_result, dir)
     return iv_run_result
 
+STREAM_SUPPORTED = hasattr(os, "mkfifo") # the streamed simulation needs named pipes
+STREAM_POLL = 0.05 # seconds
+STREAM_NO_WRITER = "@@no writer@@\n" # sent to the reader once after the simulation ended, in case the testbench never opened the FIFO; as the first line it means no TBout, anywhere else the reader drops it
+
+def _release_fifo(fifo_path, flag) -> bool:
+    # open and close the other end of the FIFO once, so that a process blocked in opening it can go on (and see EOF/broken pipe); return whether it was opened
+    try:
+        fd = os.open(fifo_path, flag | os.O_NONBLOCK)
+    except OSError:
+        return False # no reader yet (O_WRONLY) or the FIFO is removed
+    try:
+        if flag == os.O_WRONLY:
+            os.write(fd, STREAM_NO_WRITER.encode("utf-8"))
+    except OSError:
+        pass
+    os.close(fd)
+    return True
+
+def iverilog_stream_call(dir, reader_argv:list[str], reader_env:dict|None=None, silent = False, timeout = 120, fifo_name = "TBout.txt", compile_timeout = None):
+    """
+    #### input:
+    - dir: see iverilog_call
+    - reader_argv: the command that reads the trace (such as utils/stream_checker.py), run in dir at the same time as the simulation
+    - reader_env: the environment variables of the reader, see proc_run
+    - fifo_name: the file written by the testbench; it is a named pipe during the simulation and removed afterwards
+    - compile_timeout: see iverilog_call
+
+    #### output:
+    - the same list as iverilog_call
+    - reader_info: dict, the result of the reader (see proc_run); None if the compilation failed
+
+    #### functionality:
+    compile, then run the simulation while the reader consumes the trace through a named pipe instead of a file on disk. If the reader exits early (such as at the first failure), the simulation is killed by the broken pipe at its next write. If the simulation never opens the file, the reader gets STREAM_NO_WRITER as the first line.
+    """
+    def s_print(*args, **kwargs):
+        if not silent:
+            print(*args, **kwargs)
+    iv_run_result = iverilog_call(dir, silent, timeout, compile_only=True, compile_timeout=compile_timeout)
+    if not iv_run_result[0]:
+        return iv_run_result, None
+    cmd1, run1_info = iv_run_result[1], iv_run_result[2]
+    vvp_filename = "run.vvp"
+    fifo_path = os.path.join(dir, fifo_name)
+    if os.path.lexists(fifo_path):
+        os.remove(fifo_path)
+    os.mkfifo(fifo_path)
+    cmd2 = "%s %s (%s streamed to: %s)"%(IVERILOG_VVP_PATH, vvp_filename, fifo_name, " ".join(reader_argv))
+    s_print(cmd2)
+    results = {}
+    sim = threading.Thread(target=lambda: results.__setitem__("sim", proc_run([IVERILOG_VVP_PATH, vvp_filename], timeout, cwd=dir)), daemon=True)
+    reader = threading.Thread(target=lambda: results.__setitem__("reader", proc_run(reader_argv, timeout, cwd=dir, env=reader_env)), daemon=True)
+    reader.start()
+    sim.start()
+    writer_released = False
+    while sim.is_alive() or reader.is_alive():
+        if not reader.is_alive():
+            # the simulation may be waiting for a reader to open the FIFO
+            _release_fifo(fifo_path, os.O_RDONLY)
+        elif (not sim.is_alive()) and (not writer_released):
+            # the reader may be waiting for a writer (the testbench did not open the file); only once, the reader may still be draining the trace
+            writer_released = _release_fifo(fifo_path, os.O_WRONLY)
+        time.sleep(STREAM_POLL)
+    os.remove(fifo_path)
+    run2_info, reader_info = results["sim"], results["reader"]
+    if run2_info["haserror"]:
+        s_print("vvp failed")
+        return [False, cmd1, run1_info, cmd2, run2_info, run2_info["err"]], reader_info
+    return [True, cmd1, run1_info, cmd2, run2_info, ''], reader_info
+
+def iverilog_stream_call_and_save(dir, reader_argv:list[str], reader_env:dict|None=None, silent = False, timeout = 120, fifo_name = "TBout.txt", compile_timeout = None):
+    """
+    run the streamed simulation and save the run info of iverilog (the result of the reader is returned, not saved)
+    """
+    iv_run_result, reader_info = iverilog_stream_call(dir, reader_argv, reader_env, silent, timeout, fifo_name, compile_timeout)
+    save_iv_runinfo(iv_run_result, dir)
+    return iv_run_result, reader_info
+
 def getVerilog(dir):
     """
     dir: directory to search
@@ -31,6 +31,8 @@ def main(custom_cfg_path: str = CFG_CUS_PATH):
             iv.run_iverilog()
         case "autoline":
             al.run_autoline()
+        case "golden_warmup":
+            al.run_golden_warmup()
         # case "dataset_manager":
         #     pass # TODO
         case _:
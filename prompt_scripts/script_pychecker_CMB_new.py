@@ -185,11 +185,16 @@ def check_dut(vectors_in):
     for vector in vectors_in:
         check_pass = golden_dut.check(vector)
         if check_pass:
-            print(f"Passed; vector: {vector}")
+            if CHECKER_VERBOSE:
+                print(f"Passed; vector: {vector}")
         else:
             print(f"Failed; vector: {vector}")
             failed_scenarios.append(vector["scenario"])
     return failed_scenarios
+
+import os
+import json
+CHECKER_VERBOSE = os.environ.get("CHECKER_VERBOSE", "0") == "1" # print the passed vectors as well (debugging only)
 """
 
 STAGEPYGEN_TAIL2 = """
@@ -213,11 +218,19 @@ def SignalTxt_to_dictlist(txt:str):
                     signal[key] = value 
         signals.append(signal)
     return signals
+try:
+    # the fast parser of the framework with the same results (utils/tbout_parser.py); the function above is used if not available
+    from utils.tbout_parser import SignalTxt_to_dictlist_CMB as SignalTxt_to_dictlist
+except ImportError:
+    pass
 with open("TBout.txt", "r") as f:
     txt = f.read()
 vectors_in = SignalTxt_to_dictlist(txt)
 tb_pass = check_dut(vectors_in)
 print(tb_pass)
+# the structured result read by the runners (see python_call.read_checker_result)
+with open("checker_result.json", "w") as f:
+    json.dump({"failed_scenarios": tb_pass}, f, default=str)
 """
 class Stage5(BaseScriptStage):
     """stage 5: generate the pychecker that receive the signals from testbench and check the correctness of DUT"""
@@ -2,15 +2,190 @@
 Description :   this is used in pychecker workflow
 Author      :   Ruidi Qiu (r.qiu@tum.de)
 Time        :   2024/3/31 14:05:50
-LastEdited  :   2024/8/11 17:32:07
+LastEdited  :   2025/3/6 10:15:42
 """
 
 import os
 import sys
-from utils.utils import run_in_dir
-from utils.subproc import subproc_call
+import json
+import time
+import queue
+import select
+import threading
+import subprocess as sp
+from utils.subproc import proc_run, run_stat_line, DEFAULT_LIMITS, OVERFLOW_ERROR, apply_limits, kill_group
+from utils.checker_runtime import TBOUT_READ_MARK
 
+PYTHON_PATH = sys.executable # the checkers run with the same interpreter as the pipeline
 PYPATH = "ipynb_demo/error_analysis/correct_test_80wrong_discrim_20240809_225259/1365/checker.py"
+REPO_ROOT = os.path.dirname(os.path.abspath(__file__))
+WORKER_PATH = os.path.join(REPO_ROOT, "utils", "py_worker.py")
+STREAM_CHECKER_PATH = os.path.join(REPO_ROOT, "utils", "stream_checker.py")
+WORKER_START_TIMEOUT = 60 # seconds
+CHECKER_RESULT_FILE = "checker_result.json" # the structured result written by the generated checkers, see read_checker_result
+CHECKER_ENV_VARS = {"CHECKER_VERBOSE": "0"} # see set_checker_verbose
+
+class PyWorker():
+    """
+    - one long-lived python process (utils/py_worker.py) that executes the checkers sent through its stdin
+    """
+    def __init__(self) -> None:
+        # the cpu time limit is not applied: it is accumulated over all the jobs of the worker
+        self.p = sp.Popen([PYTHON_PATH, WORKER_PATH], stdin=sp.PIPE, stdout=sp.PIPE, stderr=sp.DEVNULL, env=checker_env(), start_new_session=(os.name != 'nt'))
+        apply_limits(self.p.pid, {"mem_size": DEFAULT_LIMITS["mem_size"]})
+        self.jobs_done = 0
+        if self._read(WORKER_START_TIMEOUT) is None:
+            self.kill()
+            raise RuntimeError("python checker worker failed to start")
+
+    def _read(self, timeout) -> dict|None:
+        ready, _, _ = select.select([self.p.stdout], [], [], timeout)
+        if not ready:
+            return None
+        line = self.p.stdout.readline()
+        if not line:
+            return None
+        return json.loads(line)
+
+    def run(self, job:dict, timeout) -> dict|None:
+        """
+        - return the result of the job; None if timeout or the worker died (the worker should be killed)
+        """
+        try:
+            self.p.stdin.write((json.dumps(job) + "\n").encode("utf-8"))
+            self.p.stdin.flush()
+        except OSError:
+            return None
+        self.jobs_done += 1
+        return self._read(timeout)
+
+    def kill(self):
+        kill_group(self.p)
+        self.p.wait()
+
+class PyCheckerPool():
+    """
+    - a pool of pre-warmed python workers running the checkers; a drop-in backend of python_call (same return format)
+    - each checker is executed in a fresh namespace in its own dir; the worker is killed and replaced when timeout or crash
+    - the workers are started lazily and recycled after max_jobs jobs, or at once if the checker changed the interpreter state (imported new modules, patched the preloaded modules, numpy options...; see utils.py_worker.global_state)
+    - the state not watched there (such as the numpy random state or the objects inside the modules) is still shared by the jobs of one worker, so a pooled result may differ from a fresh "python3 checker.py" for a checker relying on it
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(PyCheckerPool, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not getattr(self, "_initialized", False):
+            self.en = False
+            self.size = 0
+            self.max_jobs = 0
+            self._idle = queue.LifoQueue()
+            self._slots = None
+            self._initialized = True
+
+    def set_config(self, en:bool, size:int, max_jobs:int):
+        self.en = en and (os.name != 'nt')
+        self.size = size
+        self.max_jobs = max_jobs
+        self._slots = threading.Semaphore(size)
+
+    def run(self, pypath, timeout) -> dict|None:
+        """
+        - run the checker in a worker; return the run info like proc_run; None if no worker is available (the caller should fall back to a new process)
+        """
+        with open(pypath, "r") as f:
+            code = f.read()
+        job = {
+            "code": code,
+            "dir": os.path.abspath(os.path.dirname(pypath)),
+            "filename": os.path.basename(pypath),
+            "keep_size": (DEFAULT_LIMITS["keep_size"] or 4096) * 1024,
+            "max_output": DEFAULT_LIMITS["max_output"] * 1024 * 1024 if DEFAULT_LIMITS["max_output"] is not None else None
+        }
+        timeouterror = "program is timeout (time > %ds). please check your code. Hints: there might be some infinite loop, please check all the loops in your programm. If it is a verilog code, please check if there is a $finish in the code."%(timeout)
+        with self._slots:
+            try:
+                worker = self._idle.get_nowait()
+            except queue.Empty:
+                try:
+                    worker = PyWorker()
+                except (OSError, RuntimeError):
+                    return None
+            start = time.perf_counter()
+            result = worker.run(job, timeout)
+            wall_time = round(time.perf_counter() - start, 4)
+            if result is None:
+                timeout_flag = worker.p.poll() is None
+                worker.kill()
+                if not timeout_flag:
+                    return None
+                return {"out": "", "err": timeouterror, "haserror": 1, "returncode": -9, "timeout": True, "overflow": False, "out_size": 0, "wall_time": wall_time, "user_time": None, "sys_time": None, "max_rss": None}
+            if (worker.jobs_done >= self.max_jobs) or result.get("state_changed", False):
+                worker.kill()
+            else:
+                self._idle.put(worker)
+        if result["overflow"]:
+            result["err"] += "\n" + OVERFLOW_ERROR % (result["out_size"])
+        result["haserror"] = result["returncode"]
+        result["timeout"] = False
+        result["wall_time"] = wall_time
+        return result
+
+    def shutdown(self):
+        while True:
+            try:
+                self._idle.get_nowait().kill()
+            except queue.Empty:
+                break
+
+py_pool = PyCheckerPool()
+
+def set_checker_verbose(verbose:bool):
+    """whether the generated checkers print every vector (also the passed ones); only for debugging, the output of long traces is huge"""
+    CHECKER_ENV_VARS["CHECKER_VERBOSE"] = "1" if verbose else "0"
+
+def checker_env() -> dict:
+    """the environment of the checker subprocesses: the repo root is importable (such as utils.tbout_parser used by the generated checkers), and CHECKER_ENV_VARS"""
+    python_path = [REPO_ROOT] + ([os.environ["PYTHONPATH"]] if os.environ.get("PYTHONPATH") else [])
+    return dict(os.environ, PYTHONPATH=os.pathsep.join(python_path), **CHECKER_ENV_VARS)
+
+def clear_checker_result(dir):
+    """remove the result file of the previous checker run in dir"""
+    result_path = os.path.join(dir, CHECKER_RESULT_FILE)
+    if os.path.exists(result_path):
+        os.remove(result_path)
+
+def read_checker_result(dir) -> list|None:
+    """
+    the failed scenarios written by the checker in dir (CHECKER_RESULT_FILE); None if not found (such as the old checkers, which only print the list), then the runners take the last [...] in the output
+    """
+    try:
+        with open(os.path.join(dir, CHECKER_RESULT_FILE), "r") as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    failed_scenarios = result.get("failed_scenarios", None) if isinstance(result, dict) else None
+    return failed_scenarios if isinstance(failed_scenarios, list) else None
+
+def stream_checker_argv(pyname:str, stop_on_fail:bool=False, tee_name:str|None=None) -> list[str]:
+    """
+    the command of the streaming checker (utils/stream_checker.py) for iverilog_call.iverilog_stream_call; run in the dir of the checker
+    - stop_on_fail: stop at the first failed vector, the simulation is killed by the broken pipe (only pass/fail is known then)
+    - tee_name: also save the streamed TBout to this file
+    """
+    argv = [PYTHON_PATH, STREAM_CHECKER_PATH, pyname, "TBout.txt"]
+    if stop_on_fail:
+        argv.append("--stop-on-fail")
+    if tee_name is not None:
+        argv += ["--tee", tee_name]
+    return argv
+
+def streamable(checker_code:str) -> bool:
+    """whether the checker follows the generated layout (GoldenDUT + SignalTxt_to_dictlist + reading TBout.txt), which the streaming checker needs"""
+    return ("class GoldenDUT" in checker_code) and ("def SignalTxt_to_dictlist" in checker_code) and (TBOUT_READ_MARK in checker_code)
 
 def python_call(pypath, silent = False, timeout = 120):
     """ 
@@ -25,16 +200,17 @@ def python_call(pypath, silent = False, timeout = 120):
     - [2]/[-1] (error_msg): str, the error message if there is any error; This is for convenience, the error message is also included in [2] or [4]
 
     #### functionality:
-    given the path of python file, run it in the local dir.
+    given the path of python file, run it in the local dir (in a pre-warmed worker if py_pool is enabled).
     """
     def s_print(*args, **kwargs):
         if not silent:
             print(*args, **kwargs)
     dir = os.path.dirname(pypath)
     filename = os.path.basename(pypath)
-    cmd = "python3 %s"%(filename) 
-    with run_in_dir(dir):
-        run_info = subproc_call(cmd, timeout) # {"out": out_reg, "err": err_reg, "haserror": error_exist}
+    clear_checker_result(dir)
+    run_info = py_pool.run(pypath, timeout) if py_pool.en else None
+    if run_info is None:
+        run_info = proc_run([PYTHON_PATH, filename], timeout, cwd=dir if dir else None, env=checker_env()) # {"out": out_reg, "err": err_reg, "haserror": error_exist}
     if run_info["haserror"]:
         s_print("python compiling failed")
         return [False, run_info, run_info["err"]]
@@ -55,6 +231,7 @@ def save_py_runinfo(py_run_result, dir):
     # output and error of cmd:
     lines += "###output:\n%s\n\n" % (py_run_result[1]["out"])
     lines += "###error:\n%s\n\n" % (py_run_result[1]["err"])
+    lines += run_stat_line(py_run_result[1])
     # save to file:
     with open(run_info_path, "w") as f:
         f.write(lines)
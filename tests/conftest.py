@@ -0,0 +1,89 @@
+"""
+Description :   the shared fixtures of the unit tests; run from the repo root: python -m pytest tests
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+import os
+import sys
+import stat
+import pytest
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+os.chdir(REPO_ROOT) # the modules use paths relative to the repo root (such as config/key_API.json)
+
+from prompt_scripts.script_pychecker_CMB_new import STAGEPYGEN_TAIL1, STAGEPYGEN_TAIL2
+from prompt_scripts.script_pychecker_SEQ import STAGE5_SEQ_CODE1, STAGE5_SEQ_CODE2
+
+# y = a & b
+CMB_GOLDEN = """
+class GoldenDUT:
+    def __init__(self):
+        pass
+    def load(self, signal_vector):
+        pass
+    def check(self, signal_vector):
+        return signal_vector["y"] == (signal_vector["a"] & signal_vector["b"])
+"""
+
+# q is d of the last cycle
+SEQ_GOLDEN = """
+class GoldenDUT:
+    def __init__(self):
+        self.q = 0
+    def load(self, signal_vector):
+        self.q = signal_vector["d"]
+    def check(self, signal_vector):
+        return signal_vector["q"] == self.q
+"""
+
+def cmb_checker(golden:str=CMB_GOLDEN) -> str:
+    """a checker in the generated CMB layout"""
+    return golden + STAGEPYGEN_TAIL1 + STAGEPYGEN_TAIL2
+
+def seq_checker(golden:str=SEQ_GOLDEN) -> str:
+    """a checker in the generated SEQ layout"""
+    return golden + STAGE5_SEQ_CODE1 + STAGE5_SEQ_CODE2
+
+def cmb_tbout(n:int, wrong:set=frozenset()) -> str:
+    """the TBout of n CMB scenarios, y is wrong in the given scenarios"""
+    lines = []
+    for i in range(1, n + 1):
+        a, b = i % 2, (i // 2) % 2
+        lines.append("scenario: %d, a = %d, b = %d, y = %d\n" % (i, a, b, (a & b) ^ (i in wrong)))
+    return "".join(lines)
+
+@pytest.fixture
+def fake_iverilog(tmp_path, monkeypatch):
+    """
+    - replace iverilog and vvp by python scripts; the compilation runs the iverilog_body and creates run.vvp, the simulation runs the vvp_body (given to the returned function, cwd: the run dir)
+    """
+    import iverilog_call as iv
+    def make(vvp_body:str, iverilog_body:str=""):
+        tool_dir = tmp_path / "tools"
+        tool_dir.mkdir(exist_ok=True)
+        iverilog_path, vvp_path = tool_dir / "iverilog", tool_dir / "vvp"
+        iverilog_path.write_text("#!%s\n%s\nopen('run.vvp', 'w').close()\n" % (sys.executable, iverilog_body))
+        vvp_path.write_text("#!%s\n%s" % (sys.executable, vvp_body))
+        for path in (iverilog_path, vvp_path):
+            path.chmod(path.stat().st_mode | stat.S_IEXEC)
+        monkeypatch.setattr(iv, "IVERILOG_PATH", str(iverilog_path))
+        monkeypatch.setattr(iv, "IVERILOG_VVP_PATH", str(vvp_path))
+        run_dir = tmp_path / "run"
+        run_dir.mkdir(exist_ok=True)
+        (run_dir / "tb.v").write_text("module tb; endmodule\n")
+        return run_dir
+    return make
+
+@pytest.fixture(scope="session", autouse=True)
+def logger_config(tmp_path_factory):
+    """the config and the logger of the modules; the logs are saved in a temp dir instead of saves/"""
+    from config import Config
+    import loader_saver as ls
+    config = Config("config/custom.yaml")
+    config.save.pub.dir = str(tmp_path_factory.mktemp("saves")) + "/"
+    ls.add_save_root_to(config)
+    ls.AutoLogger()
+    return config
@@ -0,0 +1,222 @@
+"""
+Description :   tests of LLM_call.py without a real LLM: the usage counters, the response cache and the retries/hedging (against a local fake server)
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+import sys
+import json
+import time
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+import pytest
+import LLM_call as L
+from utils.llm_cache import LLMResponseCache, ReplayMissError
+
+MODEL = "qwen3-8b" # served by the fake vLLM server
+
+class FakeLLMHandler(BaseHTTPRequestHandler):
+    """an OpenAI-compatible chat endpoint; the answer is "ok<k>" for the k-th request; server.fail / server.stall: the number of next requests answered by 503 / answered late"""
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, *args):
+        pass
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.requests += 1
+            request_idx = server.requests
+            fail = server.fail > 0
+            server.fail -= fail
+            stall = server.stall > 0
+            server.stall -= stall
+        if fail:
+            self._send(503, {"error": {"message": "overloaded"}})
+            return
+        time.sleep(server.stall_time if stall else 0.02)
+        self._send(200, {"id": "chatcmpl-%d" % request_idx, "object": "chat.completion", "created": 0, "model": body["model"], "system_fingerprint": None,
+                         "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": "ok%d" % request_idx}}],
+                         "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}})
+
+    def _send(self, status:int, response:dict):
+        out = json.dumps(response).encode()
+        try:
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(out)))
+            self.end_headers()
+            self.wfile.write(out)
+        except OSError:
+            pass # the client gave up (timeout or hedged)
+
+@pytest.fixture
+def llm_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLLMHandler)
+    server.request_queue_size = 128
+    server.daemon_threads = True # the stalled answers are not waited for
+    server.lock = threading.Lock()
+    server.requests = server.fail = server.stall = 0
+    server.stall_time = 1.5
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    monkeypatch.setattr(L, "VLLM_BASE_URL", "http://127.0.0.1:%d/v1" % server.server_port)
+    L.llm_clients.set_config(None) # new clients on the fake server
+    L.llm_retry.set_config(0, 10, 0.1, 1)
+    yield server
+    server.shutdown()
+    server.server_close()
+    L.llm_clients.set_config(None)
+    L.llm_retry.set_config(3, 300, 1, 30)
+
+@pytest.fixture
+def cache():
+    cache = LLMResponseCache()
+    yield cache
+    cache.set_config("off", None, 0)
+
+def record(cache:LLMResponseCache, messages:str, output:list):
+    key = cache.key([{"role": "user", "content": messages}], MODEL, None, None, False)
+    assert cache.get(key) is None
+    cache.put(key, output, MODEL)
+    return key
+
+def fake_output(answer:str, size:int=0) -> list:
+    return [answer, {"answers": [answer], "time": 0.1, "usage": {"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}, "padding": "x" * size}]
+
+def test_cache_off(cache):
+    cache.set_config("off", None, 0)
+    assert cache.key([{"role": "user", "content": "hi"}], MODEL, None, None, False) is None
+    assert cache.get(None) is None
+
+def test_cache_occurrences_replay_in_order(cache, tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache.set_config("read-write", path, 1)
+    record(cache, "hi", fake_output("first"))
+    record(cache, "hi", fake_output("second"))
+    record(cache, "bye", fake_output("other"))
+    # a new run: the occurrences restart, the k-th identical request gets the k-th answer
+    cache.set_config("replay-only", path, 1)
+    messages = [{"role": "user", "content": "hi"}]
+    assert cache.get(cache.key(messages, MODEL, None, None, False))[0] == "first"
+    assert cache.get(cache.key(messages, MODEL, None, None, False))[0] == "second"
+    with pytest.raises(ReplayMissError):
+        cache.get(cache.key(messages, MODEL, None, None, False))
+    # any field of the request is in the key
+    with pytest.raises(ReplayMissError):
+        cache.get(cache.key([{"role": "user", "content": "bye"}], MODEL, None, 0.5, False))
+    assert cache.get(cache.key([{"role": "user", "content": "bye"}], MODEL, None, None, False))[0] == "other"
+
+def test_cache_replay_only_does_not_record(cache, tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    cache.set_config("replay-only", path, 1)
+    key = cache.key([{"role": "user", "content": "hi"}], MODEL, None, None, False)
+    cache.put(key, fake_output("new"), MODEL)
+    with pytest.raises(ReplayMissError):
+        cache.get(key)
+
+def test_cache_evicts_least_recently_used(cache, tmp_path):
+    cache.set_config("read-write", str(tmp_path / "cache.sqlite"), 1)
+    keys = [record(cache, "msg%d" % i, fake_output("a%d" % i, 400 * 1024)) for i in range(2)]
+    time.sleep(0.01)
+    assert cache.get(keys[0])[0] == "a0" # now a1 is the least recently used
+    record(cache, "msg2", fake_output("a2", 400 * 1024))
+    assert cache.get(keys[0])[0] == "a0"
+    assert cache.get(keys[1]) is None
+    assert cache.size <= cache.max_size
+
+def test_llm_call_replay_only_offline(cache, llm_server, tmp_path):
+    path = str(tmp_path / "cache.sqlite")
+    manager = L.llm_manager
+    cache.set_config("read-write", path, 1)
+    recorded = [L.llm_call("hello", MODEL)[0] for _ in range(2)]
+    assert recorded == ["ok1", "ok2"]
+    assert llm_server.requests == 2
+    # replay the session with the server down
+    llm_server.shutdown()
+    llm_server.server_close()
+    cache.set_config("replay-only", path, 1)
+    hits_before, tokens_before = manager.cache_hits_total, manager.tokens_in_total
+    assert [L.llm_call("hello", MODEL)[0] for _ in range(2)] == recorded
+    assert manager.cache_hits_total - hits_before == 2
+    assert manager.tokens_in_total == tokens_before # the replayed responses are not paid
+    misses_before = manager.cache_misses_total
+    with pytest.raises(ReplayMissError):
+        L.llm_call("hello", MODEL)
+    assert manager.cache_misses_total - misses_before == 1
+
+def test_usage_counters_thread_safe():
+    manager = L.llm_manager
+    model = next(iter(L.PRICING_MODELS))
+    tokens_before, hedges_before = manager.tokens_in_total, manager.hedges_total
+    def update():
+        for _ in range(5000):
+            manager.update_usage(1, 2, model)
+            manager.update_retry(hedge=True)
+    threads = [threading.Thread(target=update) for _ in range(8)]
+    switch_interval = sys.getswitchinterval()
+    sys.setswitchinterval(1e-6) # switch the threads as often as possible
+    try:
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    finally:
+        sys.setswitchinterval(switch_interval)
+    assert manager.tokens_in_total - tokens_before == 40000
+    assert manager.hedges_total - hedges_before == 40000
+
+@pytest.fixture(params=["sync", "async"])
+def engine(request, llm_server):
+    """llm_call on the sync clients or through the asyncio engine"""
+    L.llm_engine.set_config(request.param == "async", 8, {})
+    yield request.param
+    L.llm_engine.shutdown()
+    L.llm_engine.set_config(False)
+
+def test_retry_server_errors(engine, llm_server):
+    manager = L.llm_manager
+    L.llm_retry.set_config(3, 10, 0.01, 0.05)
+    retries_before = manager.retries_total
+    llm_server.fail = 2
+    assert L.llm_call("hi", MODEL)[0] == "ok3"
+    assert manager.retries_total - retries_before == 2
+    # give up after max_retries
+    llm_server.fail = 9
+    with pytest.raises(L.OpenAIStatusError) as error:
+        L.llm_call("hi", MODEL)
+    assert error.value.status_code == 503
+    assert manager.retries_total - retries_before == 2 + 3
+    assert llm_server.requests == 3 + 4
+
+def test_retry_timeout(engine, llm_server):
+    L.llm_retry.set_config(1, 0.5, 0.01, 0.05)
+    llm_server.stall = 1
+    start = time.monotonic()
+    assert L.llm_call("hi", MODEL)[0] == "ok2"
+    assert time.monotonic() - start < llm_server.stall_time
+
+@pytest.mark.parametrize("pool_size", [None, 1])
+def test_hedge_slow_request(engine, llm_server, pool_size):
+    if pool_size is not None and engine == "async":
+        pytest.skip("the pool size is of the sync clients")
+    manager = L.llm_manager
+    L.llm_clients.set_config(pool_size) # with 1 connection, the hedge must not wait for the one held by the slow request
+    L.llm_retry.set_config(0, 10, 0.01, 0.05, True, 0.95, 5)
+    for _ in range(5):
+        L.llm_call("hi", MODEL)
+    assert L.llm_retry.hedge_delay(MODEL, 1) is not None
+    assert L.llm_retry.hedge_delay(MODEL, 2) is None # the latencies are per (model, n)
+    hedges_before, tokens_before = manager.hedges_total, manager.tokens_in_total
+    llm_server.stall = 1
+    start = time.monotonic()
+    assert L.llm_call("hi", MODEL)[0] == "ok7" # the answer of the duplicate
+    assert time.monotonic() - start < 1
+    assert manager.hedges_total - hedges_before == 1
+    if engine == "sync":
+        # the late request is paid for when it finishes
+        deadline = time.monotonic() + llm_server.stall_time + 2
+        while manager.tokens_in_total - tokens_before < 20 and time.monotonic() < deadline:
+            time.sleep(0.05)
+        assert manager.tokens_in_total - tokens_before == 20
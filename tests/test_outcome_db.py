@@ -0,0 +1,62 @@
+"""
+Description :   tests of utils/outcome_db.py and its use in the discrimination runs
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+import pytest
+from utils.outcome_db import outcome_db, OutcomeDB, OUTCOME_INFO_FILE
+from autoline.TB3_funccheck import TaskTBcheck
+from conftest import cmb_checker, cmb_tbout
+
+def info(timeout=False, overflow=False, haserror=0) -> dict:
+    return {"haserror": haserror, "timeout": timeout, "overflow": overflow, "wall_time": 0.5, "out_size": 100}
+
+def iv_info(**kwargs) -> list:
+    run2_info = info(**kwargs)
+    return [not run2_info["haserror"], "cmd1", info(), "cmd2", run2_info, ""]
+
+@pytest.fixture
+def db(tmp_path):
+    db_path = tmp_path / "db" / "outcomes.sqlite"
+    outcome_db.set_config(True, str(db_path))
+    yield db_path
+    outcome_db.set_config(False, None)
+
+def test_put_get(db):
+    key = OutcomeDB.key("TBcheck", "driver", "dut", "checker")
+    assert outcome_db.get(key) is None
+    outcome_db.put_run(key, iv_info(), [True, info(), ""], failed_scenarios=[2, 3])
+    outcome = outcome_db.get(key)
+    assert outcome["failed_scenarios"] == [2, 3]
+    assert (outcome["compile_ok"], outcome["sim_ok"], outcome["check_ok"], outcome["wall_time"]) == (True, True, True, 0.5)
+    # persistent
+    outcome_db.set_config(True, str(db))
+    assert outcome_db.get(key)["failed_scenarios"] == [2, 3]
+    assert outcome_db.hit_rate_total == 1.0
+
+def test_key():
+    keys = {OutcomeDB.key("TBcheck", "driver", "dut", "checker"), OutcomeDB.key("TBcheck", "driver", "dut", "checker2"), OutcomeDB.key("TBcheck", "driver", "dut2", "checker"), OutcomeDB.key("TBeval:Pychecker", "driver", "dut", "checker")}
+    assert len(keys) == 4
+
+@pytest.mark.parametrize("iv_kwargs, py_kwargs", [({"timeout": True, "haserror": 1}, {}), ({"overflow": True, "haserror": 1}, {}), ({}, {"timeout": True, "haserror": 1})])
+def test_incomplete_runs_not_stored(db, iv_kwargs, py_kwargs):
+    key = OutcomeDB.key("TBcheck", "driver", "dut", "checker")
+    outcome_db.put_run(key, iv_info(**iv_kwargs), [False, info(**py_kwargs), ""], failed_scenarios=[-1])
+    assert outcome_db.get(key) is None
+
+FAKE_VVP = """
+import os, sys
+counter = os.path.join(os.path.dirname(sys.argv[0]), "runs")
+open(counter, "a").write("1")
+open("TBout.txt", "w").write(%r)
+""" % cmb_tbout(4, {3})
+
+def test_run_testbench_hit(fake_iverilog, tmp_path, db):
+    run_dir = fake_iverilog(FAKE_VVP)
+    for idx in range(2):
+        assert TaskTBcheck.run_testbench(str(run_dir / f"r{idx}"), "module tb; endmodule\n", "module top_module(); endmodule\n", cmb_checker(), 1) == [3]
+    # the second run is neither simulated nor checked
+    assert (tmp_path / "tools" / "runs").read_text() == "1"
+    assert (run_dir / "r1" / OUTCOME_INFO_FILE).exists()
@@ -0,0 +1,63 @@
+"""
+Description :   tests of the pre-warmed python checker pool (python_call.PyCheckerPool and utils/py_worker.py)
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+import pytest
+import python_call as py
+from utils.subproc import proc_run, DEFAULT_LIMITS
+
+@pytest.fixture
+def pool():
+    pool = py.PyCheckerPool()
+    pool.set_config(True, 1, 3)
+    yield pool
+    pool.shutdown()
+    pool.set_config(False, 0, 0)
+
+def run(pool, tmp_path, code:str, timeout=20) -> dict:
+    (tmp_path / "checker.py").write_text(code)
+    return pool.run(str(tmp_path / "checker.py"), timeout)
+
+def test_same_as_new_process(pool, tmp_path):
+    code = "import os, sys\nprint(os.path.basename(os.getcwd()), __name__, sys.argv)\nprint('warn', file=sys.stderr)\nsys.exit(2)\n"
+    pooled = run(pool, tmp_path, code)
+    fresh = proc_run([py.PYTHON_PATH, "checker.py"], 20, cwd=str(tmp_path))
+    assert pooled["out"] == "%s __main__ ['checker.py']\n" % tmp_path.name
+    assert (pooled["out"], pooled["err"], pooled["haserror"]) == (fresh["out"], fresh["err"], fresh["haserror"])
+
+def test_traceback(pool, tmp_path):
+    result = run(pool, tmp_path, "x = 1\nraise ValueError('bad vector')\n")
+    assert result["haserror"] == 1
+    assert 'File "checker.py", line 2' in result["err"] and "ValueError: bad vector" in result["err"]
+
+def test_worker_reused_and_recycled(pool, tmp_path):
+    for job_idx in range(3):
+        assert run(pool, tmp_path, "print(%d)\n" % job_idx)["out"] == "%d\n" % job_idx
+        # recycled after max_jobs
+        assert pool._idle.qsize() == (1 if job_idx < 2 else 0)
+
+@pytest.mark.parametrize("code", [
+    "import math\nmath.pi = 3\n",
+    "import numpy as np\nnp.set_printoptions(precision=2)\n",
+    "import fractions\n",
+    "import sys\nsys.setrecursionlimit(50000)\n",
+])
+def test_worker_replaced_on_state_change(pool, tmp_path, code):
+    assert run(pool, tmp_path, code)["haserror"] == 0
+    assert pool._idle.qsize() == 0
+    # the next job gets a fresh worker
+    assert run(pool, tmp_path, "import math\nprint(math.pi > 3.1)\n")["out"] == "True\n"
+
+def test_timeout(pool, tmp_path):
+    result = run(pool, tmp_path, "while True: pass\n", timeout=1)
+    assert result["timeout"] and result["haserror"]
+    assert pool._idle.qsize() == 0
+    assert run(pool, tmp_path, "print('ok')\n")["out"] == "ok\n"
+
+def test_overflow_caught_by_checker(pool, tmp_path, monkeypatch):
+    monkeypatch.setitem(DEFAULT_LIMITS, "max_output", 1)
+    result = run(pool, tmp_path, "try:\n    while True: print('x' * 1000)\nexcept:\n    pass\nprint('done')\n")
+    assert result["overflow"] and result["haserror"] == 1
@@ -0,0 +1,59 @@
+"""
+Description :   tests of autoline/rtl_tools.py: the multi-DUT harness and the RTL deduplication
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+from autoline import rtl_tools as rt
+
+HEADER = "module top_module(input a, input b, output y);"
+
+DRIVER = """`timescale 1ns / 1ps
+module testbench;
+reg a, b;
+wire y;
+integer file, scenario;
+top_module DUT (.a(a), .b(b), .y(y));
+initial begin
+    file = $fopen("TBout.txt", "w");
+    scenario = 1; a = 0; b = 1; #1;
+    $fdisplay(file, "scenario: %d, a = %d, b = %d, y = %d", scenario, a, b, y);
+    $fclose(file);
+    $finish;
+end
+endmodule
+"""
+
+def test_harness_one_instance_per_rtl():
+    harness = rt.gen_multidut_harness(DRIVER, HEADER, [1, 2])
+    assert harness is not None
+    for idx in [1, 2]:
+        assert "top_module%s DUT%s" % (rt.RTL_SUFFIX % idx, rt.RTL_SUFFIX % idx) in harness
+        assert '"%sscenario' % (rt.LINE_TAG % idx) in harness
+        assert "y%s);" % (rt.RTL_SUFFIX % idx) in harness
+
+def test_harness_output_in_initialiser():
+    # the stimulus depends on the DUT output through an initialised wire, the driver cannot be shared
+    driver = DRIVER.replace("wire y;", "wire y;\nwire y_seen = y;").replace("b = 1; #1;", "b = y_seen; #1;")
+    assert rt.gen_multidut_harness(driver, HEADER, [1, 2]) is None
+
+def test_harness_output_in_condition():
+    driver = DRIVER.replace("b = 1; #1;", "b = 1; #1; if (y) a = 1;")
+    assert rt.gen_multidut_harness(driver, HEADER, [1, 2]) is None
+
+def test_harness_initialiser_without_output():
+    driver = DRIVER.replace("reg a, b;", "reg a, b;\nwire [1:0] ab = {a, b};")
+    assert rt.gen_multidut_harness(driver, HEADER, [1, 2]) is not None
+
+def test_split_multidut_tbout():
+    tbout = "%sscenario: 1, y = 0\n%sscenario: 1, y = 1\n%sscenario: 2, y = 1\n" % (rt.LINE_TAG % 1, rt.LINE_TAG % 2, rt.LINE_TAG % 1)
+    assert rt.split_multidut_tbout(tbout, [1, 2]) == {1: "scenario: 1, y = 0\nscenario: 2, y = 1\n", 2: "scenario: 1, y = 1\n"}
+
+def test_dedup_rtls():
+    rtl_a = "module top_module(input a, input b, output y);\n  assign y = a & b; // and\nendmodule\n"
+    rtl_b = "module top_module(input a, input b, output y);\nassign y = a & b;\nendmodule"
+    rtl_c = "module top_module(input a, input b, output y);\nassign y = a | b;\nendmodule"
+    unique_idxes, group_of = rt.dedup_rtls([rtl_a, rtl_b, rtl_c], HEADER)
+    assert unique_idxes == [0, 2]
+    assert group_of == [0, 0, 1]
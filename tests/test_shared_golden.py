@@ -0,0 +1,69 @@
+"""
+Description :   tests of the shared-golden checking (utils/checker_runtime.py and TaskTBcheck.check_shared_golden)
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+import os
+import json
+import pytest
+import python_call as py
+from autoline.TB3_funccheck import TaskTBcheck, SHARED_CHECK_SCRIPT, REPO_ROOT
+from utils.checker_runtime import check_shared_golden, SharedGoldenError
+from utils.utils import scratch_dir
+from conftest import cmb_checker, seq_checker, cmb_tbout
+
+HEADER = "module top_module(input a, input b, output y);"
+
+def test_shared_golden_cmb():
+    traces = [cmb_tbout(6), cmb_tbout(6, {2, 5}), cmb_tbout(6, {2, 5})]
+    results = check_shared_golden(cmb_checker(), traces, ["a", "b"])
+    assert results == [[], [2, 5], [2, 5]]
+
+def test_shared_golden_different_stimulus():
+    traces = [cmb_tbout(6), cmb_tbout(4)]
+    with pytest.raises(SharedGoldenError):
+        check_shared_golden(cmb_checker(), traces, ["a", "b"])
+
+def test_shared_golden_impure_check():
+    # check changes the golden state: the traces cannot share one golden run
+    impure = "class GoldenDUT:\n    def __init__(self):\n        self.n = 0\n    def load(self, signal_vector):\n        pass\n    def check(self, signal_vector):\n        self.n += 1\n        return True\n"
+    with pytest.raises(SharedGoldenError):
+        check_shared_golden(seq_checker(impure), ["scenario: 1, d = 1, q = 0\n[check]scenario: 1, d = 0, q = 1\n"] * 2, ["d"])
+
+@pytest.fixture
+def scratch(tmp_path, monkeypatch):
+    monkeypatch.setattr(scratch_dir, "en", True)
+    monkeypatch.setattr(scratch_dir, "root", str(tmp_path / "shm"))
+
+def test_check_shared_golden_scratch(tmp_path, scratch):
+    # the traces are only in memory, nothing but the records is written to the working dir
+    working_dir = tmp_path / "discrim"
+    rtl_dirs = [str(working_dir / f"RTL_{idx}") for idx in range(1, 4)]
+    tbouts = [cmb_tbout(6), cmb_tbout(6, {3}), None]
+    results = TaskTBcheck.check_shared_golden(str(working_dir), rtl_dirs, [[], [], [-1]], cmb_checker(), HEADER, save_en=False, tbouts=tbouts)
+    assert results == [[], [3], [-1]]
+    written = [filename for _, _, filenames in os.walk(working_dir) for filename in filenames]
+    assert "TBout.txt" not in written
+    assert open(os.path.join(rtl_dirs[1], "failed_scenarios.txt")).read() == "[3]"
+    assert os.listdir(tmp_path / "shm") == []
+
+def test_shared_check_keeps_pooled_worker(tmp_path):
+    # the shared checking must not change the state of the pooled worker, which would be replaced after each run
+    pool = py.PyCheckerPool()
+    pool.set_config(True, 1, 100)
+    try:
+        rtl_dir = tmp_path / "RTL_1"
+        TaskTBcheck.write_trace(str(rtl_dir), cmb_tbout(4, {1}))
+        job = {"checker_path": str(tmp_path / "checker.py"), "tbout_paths": [str(rtl_dir / "TBout.txt")], "input_names": ["a", "b"], "result_path": str(tmp_path / "result.json")}
+        (tmp_path / "checker.py").write_text(cmb_checker())
+        (tmp_path / "shared_check.json").write_text(json.dumps(job))
+        (tmp_path / "shared_check.py").write_text(SHARED_CHECK_SCRIPT % (REPO_ROOT))
+        run_info = pool.run(str(tmp_path / "shared_check.py"), 60)
+        assert not run_info["haserror"], run_info["err"]
+        assert json.loads((tmp_path / "result.json").read_text()) == [[1]]
+        assert pool._idle.qsize() == 1
+    finally:
+        pool.shutdown()
+        pool.set_config(False, 0, 0)
@@ -0,0 +1,53 @@
+"""
+Description :   tests of utils/sim_timeout.py and the timeouts of iverilog_call
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+import iverilog_call as iv
+from utils.sim_timeout import AdaptiveTimeout
+
+def run_info(wall_time:float, timeout:bool=False) -> dict:
+    return {"haserror": int(timeout), "timeout": timeout, "wall_time": wall_time}
+
+def test_adaptive_timeout_value():
+    timeout = AdaptiveTimeout(base=100, en=True, k=10, floor=5, samples=3)
+    assert timeout.value() == 100
+    for wall_time in [1, 2, 30]:
+        timeout.observe(run_info(wall_time))
+    assert timeout.value() == 20
+    assert timeout.value(runs=3) == 60
+    timeout.observe(run_info(0.01)) # only the first samples
+    assert timeout.value() == 20
+
+def test_adaptive_timeout_disabled():
+    timeout = AdaptiveTimeout(base=100, en=False)
+    timeout.observe(run_info(1, timeout=True))
+    assert timeout.value(default=42) == 42
+    assert timeout.kills == 1
+
+def test_adaptive_timeout_track():
+    timeout = AdaptiveTimeout(base=100, en=True, samples=1)
+    timeout.track("driver 1")
+    timeout.observe(run_info(1))
+    assert timeout.value() == 10
+    timeout.track("driver 1")
+    assert timeout.value() == 10
+    timeout.track("driver 2")
+    assert timeout.value() == 100
+
+def test_observe_iv_only_simulation():
+    timeout = AdaptiveTimeout(base=100, en=True, samples=1)
+    # a compilation timeout is not a kill of the adaptive timeout
+    timeout.observe_iv([False, "", run_info(120, timeout=True), None, None, ""])
+    assert (timeout.kills, timeout.value()) == (0, 100)
+    timeout.observe_iv([True, "", run_info(50), "", run_info(1), ""])
+    assert timeout.value() == 10
+
+def test_compile_timeout(fake_iverilog):
+    # the compilation is slower than the timeout of the simulation
+    run_dir = fake_iverilog("print('done')\n", iverilog_body="import time\ntime.sleep(1.5)")
+    assert not iv.iverilog_call(str(run_dir), silent=True, timeout=0.5)[0]
+    iv_run_info = iv.iverilog_call(str(run_dir), silent=True, timeout=0.5, compile_timeout=20)
+    assert iv_run_info[0], iv_run_info[-1]
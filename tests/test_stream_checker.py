@@ -0,0 +1,71 @@
+"""
+Description :   tests of the streamed pychecker: utils/stream_checker.py and iverilog_call.iverilog_stream_call
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+import io
+import json
+import pytest
+import iverilog_call as iv
+import python_call as py
+from utils.checker_runtime import load_checker
+from utils.stream_checker import stream_check
+from conftest import cmb_checker, seq_checker, cmb_tbout
+
+def test_stream_check_cmb():
+    failed, stopped = stream_check(load_checker(cmb_checker()), io.StringIO(cmb_tbout(8, {3, 6})))
+    assert (failed, stopped) == (["3", "6"], False)
+
+def test_stream_check_stop_on_fail():
+    failed, stopped = stream_check(load_checker(cmb_checker()), io.StringIO(cmb_tbout(8, {3, 6})), stop_on_fail=True)
+    assert (failed, stopped) == (["3"], True)
+
+def test_stream_check_seq():
+    tbout = "scenario: 1, d = 1, q = 0\n[check]scenario: 1, d = 0, q = 1\nscenario: 2, d = 1, q = 0\n[check]scenario: 2, d = 1, q = 0\n"
+    failed, _ = stream_check(load_checker(seq_checker()), io.StringIO(tbout))
+    assert failed == ["2"]
+
+def test_stream_check_no_writer():
+    with pytest.raises(FileNotFoundError):
+        stream_check(load_checker(cmb_checker()), io.StringIO(iv.STREAM_NO_WRITER))
+
+@pytest.mark.parametrize("tail", ["", "\n"])
+def test_stream_check_drops_late_marker(tail):
+    # the marker is sent after the simulation ended, when the reader may still be draining the trace
+    tbout = cmb_tbout(4) + tail
+    tee = io.StringIO()
+    failed, _ = stream_check(load_checker(cmb_checker()), io.StringIO(tbout + iv.STREAM_NO_WRITER), tee_file=tee)
+    assert failed == []
+    assert tee.getvalue() == tbout
+
+def test_stream_check_marker_after_unterminated_line():
+    tbout = cmb_tbout(4).rstrip("\n")
+    tee = io.StringIO()
+    failed, _ = stream_check(load_checker(cmb_checker()), io.StringIO(tbout + iv.STREAM_NO_WRITER), tee_file=tee)
+    assert failed == []
+    assert tee.getvalue() == tbout
+
+@pytest.mark.skipif(not iv.STREAM_SUPPORTED, reason="no named pipes")
+def test_stream_call_reader_slower_than_simulation(fake_iverilog):
+    # the simulation writes the whole trace and exits before the checker starts reading
+    tbout = cmb_tbout(200, {150})
+    run_dir = fake_iverilog("open('TBout.txt', 'w').write(%r)\n" % tbout)
+    slow_golden = "import time\n" + cmb_checker().replace("    def __init__(self):\n        pass", "    def __init__(self):\n        time.sleep(0.5)")
+    (run_dir / "checker.py").write_text(slow_golden)
+    argv = py.stream_checker_argv("checker.py", tee_name="TBout_tee.txt")
+    iv_run_info, reader_info = iv.iverilog_stream_call(str(run_dir), argv, py.checker_env(), silent=True, timeout=20)
+    assert iv_run_info[0]
+    assert not reader_info["haserror"], reader_info["err"]
+    assert json.loads((run_dir / py.CHECKER_RESULT_FILE).read_text())["failed_scenarios"] == ["150"]
+    assert (run_dir / "TBout_tee.txt").read_text() == tbout
+
+@pytest.mark.skipif(not iv.STREAM_SUPPORTED, reason="no named pipes")
+def test_stream_call_no_writer(fake_iverilog):
+    run_dir = fake_iverilog("print('done')\n")
+    (run_dir / "checker.py").write_text(cmb_checker())
+    iv_run_info, reader_info = iv.iverilog_stream_call(str(run_dir), py.stream_checker_argv("checker.py"), py.checker_env(), silent=True, timeout=20)
+    assert iv_run_info[0]
+    assert reader_info["haserror"]
+    assert "FileNotFoundError" in reader_info["err"]
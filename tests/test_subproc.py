@@ -0,0 +1,63 @@
+"""
+Description :   tests of utils/subproc.py: the shell-free runs, the timeouts, the resource limits and the bounded output
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+import sys
+import time
+import pytest
+from utils.subproc import proc_run, resource, OVERFLOW_ERROR
+
+LIMITS = {"cpu_time": None, "mem_size": None, "keep_size": 4, "max_output": None, "max_rate": None}
+
+def python(code:str) -> list[str]:
+    return [sys.executable, "-c", code]
+
+def test_run_ok(tmp_path):
+    run_info = proc_run(python("import os; print(os.getcwd()); print('e', file=__import__('sys').stderr)"), 20, cwd=str(tmp_path), limits=LIMITS)
+    assert run_info["haserror"] == 0
+    assert run_info["out"].strip() == str(tmp_path)
+    assert run_info["err"].strip() == "e"
+    assert run_info["wall_time"] > 0
+
+def test_run_error_code():
+    run_info = proc_run(python("import sys; sys.exit(3)"), 20, limits=LIMITS)
+    assert (run_info["haserror"], run_info["returncode"]) == (3, 3)
+
+def test_program_not_found():
+    run_info = proc_run(["/nonexistent/program"], 20, limits=LIMITS)
+    assert run_info["returncode"] == 127
+
+def test_timeout_kills_group():
+    # the child of the process also holds the pipes; the whole group is killed
+    start = time.perf_counter()
+    run_info = proc_run(python("import subprocess, sys, time; subprocess.Popen([sys.executable, '-c', 'import time; time.sleep(30)']); time.sleep(30)"), 1, limits=LIMITS)
+    assert time.perf_counter() - start < 10
+    assert run_info["timeout"] and run_info["haserror"] == 1
+    assert "timeout" in run_info["err"]
+
+def test_keep_head_and_tail():
+    run_info = proc_run(python("print('HEAD' + 'x' * 100000 + 'TAIL')"), 20, limits=LIMITS)
+    assert run_info["haserror"] == 0
+    assert run_info["out"].startswith("HEAD") and run_info["out"].strip().endswith("TAIL")
+    assert len(run_info["out"]) < 10000
+    assert "bytes dropped" in run_info["out"]
+    assert run_info["out_size"] > 100000
+
+def test_max_output():
+    run_info = proc_run(python("while True: print('x' * 1000)"), 20, limits=dict(LIMITS, max_output=1))
+    assert run_info["overflow"] and not run_info["timeout"]
+    assert run_info["haserror"] == 1
+    assert OVERFLOW_ERROR.split(" (")[0] in run_info["err"]
+
+def test_max_rate():
+    run_info = proc_run(python("import sys\nwhile True: sys.stdout.write('x' * 100000)"), 20, limits=dict(LIMITS, max_rate=1))
+    assert run_info["overflow"]
+
+@pytest.mark.skipif(resource is None or not hasattr(resource, "prlimit"), reason="no prlimit")
+def test_cpu_time_limit():
+    run_info = proc_run(python("while True: pass"), 20, limits=dict(LIMITS, cpu_time=1))
+    assert run_info["haserror"] and not run_info["timeout"]
+    assert run_info["returncode"] < 0
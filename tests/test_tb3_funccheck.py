@@ -0,0 +1,120 @@
+"""
+Description :   tests of the discrimination runs of autoline/TB3_funccheck.py (with a fake iverilog, see conftest.fake_iverilog)
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+import os
+import random
+import pytest
+from autoline.TB3_funccheck import TaskTBcheck, TB_discriminator, IncrementalDiscriminator, CheckerMemo, checker_memo
+from utils.sim_timeout import TaskTimeouts
+from utils.utils import hash_str
+from conftest import cmb_checker, cmb_tbout
+
+# the simulation hangs if there is a file "hang" in the dir of the tools
+FAKE_VVP = """
+import os, sys, time
+if os.path.exists(os.path.join(os.path.dirname(sys.argv[0]), "hang")):
+    time.sleep(30)
+open("TBout.txt", "w").write(%r)
+""" % cmb_tbout(4, {2})
+
+def test_trace_not_cached_on_timeout(fake_iverilog, tmp_path):
+    run_dir = fake_iverilog(FAKE_VVP)
+    hang_flag = tmp_path / "tools" / "hang"
+    hang_flag.touch()
+    traces = {}
+    timeouts = TaskTimeouts(base=1, en=True)
+    dut_code = "module top_module(); endmodule\n"
+    assert TaskTBcheck.run_testbench(str(run_dir / "r1"), "module tb; endmodule\n", dut_code, cmb_checker(), 1, True, None, traces, timeouts) == [-1]
+    # the timeout is not a final verdict: the next round simulates again
+    assert hash_str(dut_code) not in traces
+    hang_flag.unlink()
+    assert TaskTBcheck.run_testbench(str(run_dir / "r2"), "module tb; endmodule\n", dut_code, cmb_checker(), 1, True, None, traces, timeouts) == [2]
+    assert traces[hash_str(dut_code)] == cmb_tbout(4, {2})
+    # reused without simulating
+    hang_flag.touch()
+    assert TaskTBcheck.run_testbench(str(run_dir / "r3"), "module tb; endmodule\n", dut_code, cmb_checker(), 1, True, None, traces, timeouts) == [2]
+    assert "skipped" in open(os.path.join(run_dir, "r3", "run_info.txt")).read()
+
+MODES = ["col_full_wrong", "col_80_wrong", "col_50_wrong", "col_70_wrong_row_25_correct", "col_50_wrong_row_25_correct", "col_70_wrong_row_1_correct"]
+
+def random_row(rng:random.Random, scenario_num:int) -> list[int]:
+    if rng.random() < 0.1:
+        return [-1]
+    bias = rng.choice([0.1, 0.5, 0.9])
+    return [scen_idx for scen_idx in range(1, scenario_num + 1) if rng.random() < bias]
+
+def discrimination(mode:str, rows:list[list[int]], scenario_num:int):
+    tb_pass, wrong, _, _ = TB_discriminator(mode).discriminate(TaskTBcheck.failed_scenarios_to_onehot_array(rows, max_scen_idx=scenario_num))
+    return tb_pass, sorted(int(scen_idx) for scen_idx in wrong)
+
+@pytest.mark.parametrize("mode", MODES)
+def test_incremental_discriminator_settled(mode):
+    # once settled, the remaining RTLs cannot change the discrimination, whatever they give
+    rng = random.Random(mode)
+    settled_early = 0
+    for _ in range(300):
+        rtl_num, scenario_num = rng.randint(1, 12), rng.randint(1, 6)
+        rows = [random_row(rng, scenario_num) for _ in range(rtl_num)]
+        inc_discriminator = IncrementalDiscriminator(mode, rtl_num)
+        for row_idx, row in enumerate(rows):
+            if inc_discriminator.add(row):
+                break
+        done = row_idx + 1
+        if done == rtl_num:
+            continue
+        settled_early += 1
+        expected = discrimination(mode, rows, scenario_num)
+        for _ in range(10):
+            rows_other = rows[:done] + [random_row(rng, scenario_num) for _ in range(rtl_num - done)]
+            assert discrimination(mode, rows_other, scenario_num) == expected, (rows, rows_other)
+        for fill in ([], list(range(1, scenario_num + 1)), [-1]):
+            assert discrimination(mode, rows[:done] + [fill] * (rtl_num - done), scenario_num) == expected
+    assert settled_early > 0
+
+def test_incremental_discriminator_weighted():
+    # the deduplicated RTLs count as many rows
+    inc_discriminator = IncrementalDiscriminator("col_full_wrong", 4)
+    assert not inc_discriminator.add([1], times=2)
+    assert inc_discriminator.add([], times=1)
+
+def test_run_jobs_stop():
+    started = []
+    def job(idx):
+        started.append(idx)
+        return [idx]
+    results = TaskTBcheck.run_jobs(job, [(idx,) for idx in range(6)], workers=1, stop=lambda job_idx, result: job_idx == 2)
+    assert results == [[0], [1], [2], None, None, None]
+    assert started == [0, 1, 2]
+
+@pytest.fixture
+def memo(tmp_path):
+    memo_path = tmp_path / "memo" / "checker_memo.jsonl"
+    checker_memo.set_config(True, str(memo_path))
+    yield memo_path
+    checker_memo.set_config(False, None)
+
+def test_checker_memo(tmp_path, memo):
+    stats = {"hits": 0, "misses": 0}
+    for idx, wrong in enumerate([{2}, {2}, set()]):
+        rtl_dir = tmp_path / f"RTL_{idx}"
+        TaskTBcheck.write_trace(str(rtl_dir), cmb_tbout(4, wrong))
+        assert TaskTBcheck.run_checker(str(rtl_dir), cmb_checker(), stats) == sorted(wrong)
+    # the second RTL has the same TBout as the first one
+    assert stats == {"hits": 1, "misses": 2}
+    assert "checker memo" in (tmp_path / "RTL_1" / "run_info_py.txt").read_text()
+    # persistent
+    checker_memo.set_config(True, str(memo))
+    assert checker_memo.get(CheckerMemo.key(cmb_checker(), cmb_tbout(4, {2}))) == [2]
+    assert checker_memo.get(CheckerMemo.key(cmb_checker() + "\n", cmb_tbout(4, {2}))) is None
+
+def test_checker_memo_skips_failures(tmp_path, memo):
+    rtl_dir = tmp_path / "RTL_1"
+    TaskTBcheck.write_trace(str(rtl_dir), "scenario: 1, a = 1\n")
+    stats = {"hits": 0, "misses": 0}
+    for _ in range(2):
+        assert TaskTBcheck.run_checker(str(rtl_dir), cmb_checker(), stats) == [-1]
+    assert stats == {"hits": 0, "misses": 2}
@@ -0,0 +1,68 @@
+"""
+Description :   tests of utils/tbout_parser.py: the same vectors as the SignalTxt_to_dictlist of the generated checkers
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/18 10:12:05
+LastEdited  :   2025/3/18 10:12:05
+"""
+
+import random
+import pytest
+from prompt_scripts.script_pychecker_CMB_new import STAGEPYGEN_TAIL2
+from prompt_scripts.script_pychecker_SEQ import STAGE5_SEQ_CODE2
+from utils.tbout_parser import SignalTxt_to_dictlist_SEQ, SignalTxt_to_dictlist_CMB
+
+def reference_parser(template:str):
+    """the SignalTxt_to_dictlist defined in the template (the code before the import of the fast parser)"""
+    namespace = {}
+    exec(template[:template.index("try:")], namespace)
+    return namespace["SignalTxt_to_dictlist"]
+
+REFERENCE = {"SEQ": reference_parser(STAGE5_SEQ_CODE2), "CMB": reference_parser(STAGEPYGEN_TAIL2)}
+FAST = {"SEQ": SignalTxt_to_dictlist_SEQ, "CMB": SignalTxt_to_dictlist_CMB}
+
+def random_value(rng:random.Random) -> str:
+    return rng.choice([str(rng.randint(0, 255)), str(rng.randint(0, 2**70)), "x", "z", "X", "1x0", "zz", "-3"])
+
+def random_tbout(rng:random.Random, mode:str) -> str:
+    names = rng.sample(["a", "b", "clk", "q", "y", "data_in", "sum"], rng.randint(1, 5))
+    lines = []
+    for idx in range(rng.randint(1, 12)):
+        line_names = names if rng.random() < 0.9 else rng.sample(names, rng.randint(1, len(names)))
+        scenario = rng.choice([str(idx + 1), " %d" % (idx + 1), "%da" % (idx + 1)])
+        line = "scenario: %s" % scenario + "".join(", %s = %s" % (name, random_value(rng)) for name in line_names)
+        if mode == "SEQ":
+            line = rng.choice(["[check]", "", "", "# "]) + line
+            if rng.random() < 0.05:
+                line = "some text"
+        lines.append(line + rng.choice(["", "", " ", "\r"]))
+    return "\n".join(lines) + rng.choice(["", "\n", "\n\n"])
+
+@pytest.mark.parametrize("mode", ["SEQ", "CMB"])
+def test_same_as_reference(mode):
+    rng = random.Random(2025)
+    for _ in range(2000):
+        tbout = random_tbout(rng, mode)
+        try:
+            expected = REFERENCE[mode](tbout)
+        except (IndexError, ValueError):
+            continue # the reference fails on this trace, the checker fails either way
+        assert list(FAST[mode](tbout)) == expected, tbout
+
+@pytest.mark.parametrize("mode", ["SEQ", "CMB"])
+def test_vectors_are_kept(mode):
+    # the checkers may annotate the vectors, like in a list of dicts
+    vectors = FAST[mode]("[check]scenario: 1, a = 1\n[check]scenario: 2, a = 2\n".replace("[check]", "" if mode == "CMB" else "[check]"))
+    vectors[0]["note"] = "checked"
+    assert vectors[0]["note"] == "checked"
+    assert vectors[0:1][0] is vectors[0]
+    vectors[1] = {"scenario": "9"}
+    assert vectors[1] == {"scenario": "9"}
+    vectors.append({"scenario": "10"})
+    del vectors[0]
+    assert [vector["scenario"] for vector in vectors] == ["9", "10"]
+    assert vectors == [{"scenario": "9"}, {"scenario": "10"}]
+
+def test_ragged_vectors_are_kept():
+    vectors = SignalTxt_to_dictlist_CMB("scenario: 1, a = 1\nscenario: 2, b = 2\n")
+    vectors[1]["b"] = 5
+    assert list(vectors) == [{"scenario": "1", "a": 1}, {"scenario": "2", "b": 5}]
@@ -0,0 +1,159 @@
+"""
+Description :   the shared-golden checking of many RTL traces driven by the same stimulus (used by TBcheck); runs in the checker process, not imported by the pipeline
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/9 10:05:26
+LastEdited  :   2025/3/9 10:05:26
+"""
+
+import os
+import sys
+import copy
+import json
+import pickle
+import contextlib
+import numpy as np
+
+# the generated checker reads TBout.txt from here on (see STAGEPYGEN_TAIL2 and STAGE5_SEQ_CODE2 in prompt_scripts); only the codes before it are loaded
+TBOUT_READ_MARK = 'with open("TBout.txt", "r") as f:'
+
+class SharedGoldenError(Exception):
+    """the traces or the checker are not suitable for the shared-golden checking; the caller should check the RTLs one by one"""
+    pass
+
+def load_checker(checker_code:str) -> dict:
+    """
+    - execute the definitions of the checker (GoldenDUT, SignalTxt_to_dictlist...) without reading TBout.txt
+    """
+    mark_idx = checker_code.rfind(TBOUT_READ_MARK)
+    if mark_idx == -1:
+        raise SharedGoldenError("TBout reading not found in the checker")
+    namespace = {"__name__": "checker"}
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        exec(compile(checker_code[:mark_idx], "checker.py", "exec"), namespace)
+    for name in ["GoldenDUT", "SignalTxt_to_dictlist", "check_dut"]:
+        if name not in namespace:
+            raise SharedGoldenError(f"{name} not found in the checker")
+    return namespace
+
+def is_sequential(namespace:dict) -> bool:
+    """
+    - whether the loaded checker has the SEQ layout (check_dut checks the vectors with "check_en" and loads every vector into the golden model, see STAGE5_SEQ_CODE1) or the CMB one (every vector is checked, no loading, see STAGEPYGEN_TAIL1)
+    - judged from check_dut, not from GoldenDUT.load: the CMB prompt asks for GoldenDUT.load as well
+    """
+    return "check_en" in namespace["check_dut"].__code__.co_consts
+
+def golden_state(golden_dut) -> bytes:
+    """the snapshot of the attributes of the golden model, to find out whether GoldenDUT.check changes them"""
+    try:
+        return pickle.dumps(vars(golden_dut))
+    except Exception:
+        raise SharedGoldenError("the state of GoldenDUT cannot be compared")
+
+def scenario_to_int(scenario) -> int:
+    # the same as the failed scenario parsing in TaskTBcheck.run_checker
+    return int("".join([char for char in str(scenario) if char.isdigit()]))
+
+def encode_outputs(vectors_all:list[list[dict]], input_names:set[str]) -> np.ndarray:
+    """
+    - encode the output signals of all the RTLs into an int array (RTL, step, output signal); the same value gets the same code
+    """
+    output_names = sorted({key for vectors in vectors_all for vector in vectors for key in vector} - input_names - {"scenario", "check_en"})
+    codes = {}
+    table = np.zeros((len(vectors_all), len(vectors_all[0]), max(len(output_names), 1)), dtype=np.int64)
+    for rtl_idx, vectors in enumerate(vectors_all):
+        for step, vector in enumerate(vectors):
+            for sig_idx, name in enumerate(output_names):
+                table[rtl_idx, step, sig_idx] = codes.setdefault(repr(vector.get(name, None)), len(codes))
+    return table
+
+def check_shared_golden(checker_code:str, tbouts:list[str], input_names:list[str]) -> list[list[int]]:
+    """
+    - check the traces of many RTLs driven by the same stimulus with one golden model
+    - the GoldenDUT is loaded once over the shared input sequence (GoldenDUT.load is assumed to depend only on the inputs; only for the SEQ checkers, see is_sequential); at each checking step, GoldenDUT.check runs once for each distinct observed output (on a copy of the golden state) instead of once per RTL
+    - check_dut runs check and load on the same golden model; so if GoldenDUT.check changes the golden state, SharedGoldenError is raised and the RTLs must be checked one by one
+    - input:
+        - tbouts: the TBout contents of the RTLs
+        - input_names: the input signals of the DUT; all the traces must have the same inputs, scenarios and check_en at each step
+    - output:
+        - the failed scenarios of each RTL (if the checker fails on this RTL, [-1]), same as TaskTBcheck.run_checker
+    """
+    namespace = load_checker(checker_code)
+    input_names = set(input_names)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        vectors_all = [namespace["SignalTxt_to_dictlist"](tbout) for tbout in tbouts]
+    if len(vectors_all) == 0:
+        return []
+    # the stimulus must be shared
+    steps = len(vectors_all[0])
+    stimulus = [[(key, value) for key, value in vector.items() if key in input_names or key in ["scenario", "check_en"]] for vector in vectors_all[0]]
+    for vectors in vectors_all[1:]:
+        if len(vectors) != steps:
+            raise SharedGoldenError("the traces have different lengths")
+        for step, vector in enumerate(vectors):
+            if [(key, value) for key, value in vector.items() if key in input_names or key in ["scenario", "check_en"]] != stimulus[step]:
+                raise SharedGoldenError("the traces have different stimulus")
+    # the RTLs with the same output history share all the results
+    table = encode_outputs(vectors_all, input_names)
+    _, rep_of, group_of = np.unique(table.reshape(len(vectors_all), -1), axis=0, return_index=True, return_inverse=True)
+    group_of = group_of.reshape(-1)
+    failed = [set() for _ in rep_of]
+    error = [False for _ in rep_of]
+    sequential = is_sequential(namespace)
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+        try:
+            golden_dut = namespace["GoldenDUT"]()
+        except Exception:
+            return [[-1] for _ in tbouts]
+        for step in range(steps):
+            vector_shared = vectors_all[0][step]
+            if vector_shared.get("check_en", True):
+                # the distinct observed outputs of the live groups at this step
+                live = [group for group in range(len(rep_of)) if not error[group]]
+                step_rows = table[rep_of[live], step, :]
+                _, first_idx, inverse = np.unique(step_rows, axis=0, return_index=True, return_inverse=True)
+                inverse = inverse.reshape(-1)
+                state = golden_state(golden_dut)
+                for value_idx, live_idx in enumerate(first_idx):
+                    vector = vectors_all[rep_of[live[live_idx]]][step]
+                    checked_dut = copy.deepcopy(golden_dut)
+                    try:
+                        check_pass = checked_dut.check(vector)
+                    except Exception:
+                        check_pass = None
+                    if (check_pass is not None) and (golden_state(checked_dut) != state):
+                        raise SharedGoldenError("GoldenDUT.check changes the golden state")
+                    for group_idx in np.where(inverse == value_idx)[0]:
+                        group = live[group_idx]
+                        if check_pass is None:
+                            error[group] = True
+                        elif not check_pass:
+                            failed[group].add(scenario_to_int(vector["scenario"]))
+            if sequential:
+                try:
+                    golden_dut.load(vector_shared)
+                except Exception:
+                    return [[-1] for _ in tbouts]
+    return [[-1] if error[group] else sorted(failed[group]) for group in group_of]
+
+def main(job_path:str):
+    """
+    - job file (json): {"checker_path", "tbout_paths", "input_names", "result_path"}; the result file is a json list (see check_shared_golden), or null if the shared-golden checking is not applicable
+    """
+    with open(job_path, "r") as f:
+        job = json.load(f)
+    with open(job["checker_path"], "r") as f:
+        checker_code = f.read()
+    tbouts = []
+    for tbout_path in job["tbout_paths"]:
+        with open(tbout_path, "r") as f:
+            tbouts.append(f.read())
+    try:
+        results = check_shared_golden(checker_code, tbouts, job["input_names"])
+    except SharedGoldenError as e:
+        print(f"shared-golden checking not applicable: {e}", file=sys.stderr)
+        results = None
+    with open(job["result_path"], "w") as f:
+        json.dump(results, f)
+
+if __name__ == "__main__":
+    main(sys.argv[1])
@@ -0,0 +1,142 @@
+"""
+Description :   the persistent LLM response cache: the responses of llm_call are stored in a local SQLite file keyed by the content of the request, so that a rerun (or the debugging of a late stage) replays the recorded responses instead of paying for them again. In "replay-only" mode the autoline runs offline against a recorded session.
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/14 15:08:26
+LastEdited  :   2025/3/14 15:08:26
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from utils.utils import hash_str
+
+CACHE_MODES = ["off", "read-write", "replay-only"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    key TEXT PRIMARY KEY,
+    model TEXT,
+    output TEXT,
+    size INTEGER,
+    created REAL,
+    last_used REAL
+)
+"""
+
+class ReplayMissError(RuntimeError):
+    """the request is not recorded in the cache and the cache is in "replay-only" mode"""
+    pass
+
+class LLMResponseCache():
+    """
+    - the recorded responses of llm_call; one row per request, see SCHEMA
+        - key: the hash of (model, messages, system message, temperature, json_mode, n) + the occurrence of the same request in this run; so the k-th identical request (such as a regenerated RTL or a reboot) replays the k-th recorded response instead of the first one
+        - output: the (answer, other_infos) of llm_call in json
+    - modes: "off"; "read-write": the misses are sent to the LLM and recorded; "replay-only": the misses raise ReplayMissError, no LLM is called
+    - the least recently used responses are evicted when the total size exceeds max_size
+    - the hits and the saved cost are counted by LLM_call.LLM_Manager
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(LLMResponseCache, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not getattr(self, "_initialized", False):
+            self.mode = "off"
+            self.path = None
+            self.max_size = 0
+            self.conn = None
+            self.size = 0 # the total size of the stored outputs
+            self.occurrences = {} # request hash: the number of times it is requested in this run
+            self._lock = threading.Lock()
+            self._initialized = True
+
+    def set_config(self, mode:str, path:str, max_size:int):
+        """
+        - max_size: the max total size of the stored responses, unit: MB
+        """
+        if mode is False:
+            mode = "off" # an unquoted off in yaml
+        if mode not in CACHE_MODES:
+            raise ValueError("LLM response cache mode %s is not supported, should be one of %s" % (mode, CACHE_MODES))
+        with self._lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            self.mode = mode
+            self.path = path
+            self.max_size = max_size * 1024 * 1024
+            self.size = 0
+            self.occurrences = {}
+            if self.en:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                # one connection shared by the threads, serialized by the lock
+                self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+                self.conn.execute("PRAGMA journal_mode=WAL") # other runs may read/write the same file
+                self.conn.execute(SCHEMA)
+                self.conn.commit()
+                self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @property
+    def en(self) -> bool:
+        return self.mode != "off"
+
+    def key(self, input_messages:list, model:str, system_message:str|None, temperature:float|None, json_mode:bool, n:int=1) -> str|None:
+        """the key of this request; each call counts one occurrence of the request; None if the cache is off"""
+        if not self.en:
+            return None
+        request = json.dumps({"model": model, "messages": input_messages, "system_message": system_message, "temperature": temperature, "json_mode": json_mode, "n": n}, sort_keys=True, default=str)
+        request_hash = hash_str(request)
+        with self._lock:
+            occurrence = self.occurrences.get(request_hash, 0)
+            self.occurrences[request_hash] = occurrence + 1
+        return "%s/%d" % (request_hash, occurrence)
+
+    def get(self, key:str|None) -> list|None:
+        """
+        - return the recorded output of llm_call, None if not found (or key is None)
+        - in "replay-only" mode, raise ReplayMissError if not found
+        """
+        if key is None:
+            return None
+        with self._lock:
+            row = self.conn.execute("SELECT output FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+                self.conn.commit()
+        if row is None:
+            if self.mode == "replay-only":
+                raise ReplayMissError("the LLM request %s is not recorded in the response cache %s (replay-only mode)" % (key, self.path))
+            return None
+        return json.loads(row[0])
+
+    def put(self, key:str|None, output:list, model:str):
+        """record the output of llm_call, then evict the old responses if needed; only in "read-write" mode"""
+        if (key is None) or (self.mode != "read-write"):
+            return
+        output_str = json.dumps(output, default=str)
+        now = time.time()
+        with self._lock:
+            cursor = self.conn.execute("INSERT OR IGNORE INTO responses VALUES (?, ?, ?, ?, ?, ?)", (key, model, output_str, len(output_str), now, now))
+            if cursor.rowcount:
+                self.size += len(output_str)
+            self._evict()
+            self.conn.commit()
+
+    def _evict(self):
+        if self.size <= self.max_size:
+            return
+        evicted = []
+        for key, size in self.conn.execute("SELECT key, size FROM responses ORDER BY last_used").fetchall():
+            if self.size <= self.max_size:
+                break
+            evicted.append((key,))
+            self.size -= size
+        self.conn.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+llm_cache = LLMResponseCache()
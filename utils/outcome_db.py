@@ -0,0 +1,153 @@
+"""
+Description :   the simulation outcome database: the outcome of one (driver, DUT, checker) run is deterministic, so it is stored in a local SQLite file keyed by the content hashes and looked up before simulating (TBcheck, TBeval). Shared by all the tasks, reboots and runs; can also be queried directly for analysis.
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/11 14:36:52
+LastEdited  :   2025/3/11 14:36:52
+"""
+
+import os
+import json
+import time
+import sqlite3
+import threading
+from utils.utils import hash_str
+from iverilog_call import IVERILOG_FLAGS
+
+OUTCOME_INFO_FILE = "run_info_outcome.txt" # written to the run dir instead of the simulation files when the outcome is taken from the database
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS outcomes (
+    key TEXT PRIMARY KEY,
+    stage TEXT,
+    driver_hash TEXT,
+    dut_hash TEXT,
+    checker_hash TEXT,
+    compile_ok INTEGER,
+    sim_ok INTEGER,
+    check_ok INTEGER,
+    failed_scenarios TEXT,
+    tc_pass INTEGER,
+    wall_time REAL,
+    out_size INTEGER,
+    created REAL
+)
+"""
+
+class OutcomeDB():
+    """
+    - the persistent outcomes of the simulations; one row per (stage, driver, DUT, checker), see SCHEMA
+        - stage: "TBcheck" (value: failed scenarios) or "TBeval:<TB_type>" (value: tc_pass); no "/" in it
+        - compile_ok, sim_ok: the iverilog compilation and the vvp simulation; check_ok: the python checker (None if no checker)
+        - wall_time, out_size: of the vvp simulation (None if not simulated in this run, such as a reused trace)
+    - only the deterministic outcomes are stored: the runs with timeout or output overflow are not
+    """
+    _instance = None
+
+    def __new__(cls, *args, **kwargs):
+        if not cls._instance:
+            cls._instance = super(OutcomeDB, cls).__new__(cls)
+        return cls._instance
+
+    def __init__(self) -> None:
+        if not getattr(self, "_initialized", False):
+            self.en = False
+            self.path = None
+            self.conn = None
+            self.hits_total = 0
+            self.misses_total = 0
+            self._lock = threading.Lock()
+            self._initialized = True
+
+    def set_config(self, en:bool, path:str):
+        with self._lock:
+            if self.conn is not None:
+                self.conn.close()
+                self.conn = None
+            self.en = en
+            self.path = path
+            self.hits_total = 0
+            self.misses_total = 0
+            if self.en:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                # one connection shared by the threads, serialized by the lock
+                self.conn = sqlite3.connect(self.path, check_same_thread=False, timeout=30)
+                self.conn.execute("PRAGMA journal_mode=WAL") # other runs may read/write the same file
+                self.conn.execute(SCHEMA)
+                self.conn.commit()
+
+    @staticmethod
+    def key(stage:str, driver:str, DUT:str, checker:str|None=None) -> str:
+        """the iverilog flags are part of the key, the outcome may change with them"""
+        return "%s/%s/%s/%s/%s" % (stage, hash_str(driver), hash_str(DUT), hash_str(checker or ""), hash_str(IVERILOG_FLAGS))
+
+    def get(self, key:str) -> dict|None:
+        """
+        - return the stored outcome, None if not found
+        - output: {"compile_ok", "sim_ok", "check_ok", "failed_scenarios", "tc_pass", "wall_time", "out_size"}
+        """
+        with self._lock:
+            row = self.conn.execute("SELECT compile_ok, sim_ok, check_ok, failed_scenarios, tc_pass, wall_time, out_size FROM outcomes WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses_total += 1
+                return None
+            self.hits_total += 1
+        compile_ok, sim_ok, check_ok, failed_scenarios, tc_pass, wall_time, out_size = row
+        return {
+            "compile_ok": bool(compile_ok),
+            "sim_ok": bool(sim_ok),
+            "check_ok": None if check_ok is None else bool(check_ok),
+            "failed_scenarios": None if failed_scenarios is None else json.loads(failed_scenarios),
+            "tc_pass": None if tc_pass is None else bool(tc_pass),
+            "wall_time": wall_time,
+            "out_size": out_size
+        }
+
+    def put_run(self, key:str, iv_run_info:list|None, py_run_info:list|None=None, failed_scenarios:list|None=None, tc_pass:bool|None=None):
+        """
+        - store the outcome of one run from its run infos (see iverilog_call.iverilog_call and python_call.python_call); not stored if any process timed out or overflowed
+        - input:
+            - iv_run_info: None if the simulation was not run here but is known to have succeeded (such as a reused trace)
+            - py_run_info: None if there is no python checker (or its result is not from a python_call run info)
+        """
+        if not self.completed(iv_run_info, py_run_info):
+            return
+        if iv_run_info is not None:
+            compile_ok = not iv_run_info[2]["haserror"]
+            sim_ok = bool(iv_run_info[0])
+            wall_time = iv_run_info[4].get("wall_time", None) if iv_run_info[4] is not None else None
+            out_size = iv_run_info[4].get("out_size", None) if iv_run_info[4] is not None else None
+        else:
+            compile_ok, sim_ok, wall_time, out_size = True, True, None, None
+        check_ok = bool(py_run_info[0]) if py_run_info is not None else None
+        stage, driver_hash, dut_hash, checker_hash, _ = key.split("/")
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR IGNORE INTO outcomes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (key, stage, driver_hash, dut_hash, checker_hash, compile_ok, sim_ok, check_ok,
+                 None if failed_scenarios is None else json.dumps(failed_scenarios, default=str),
+                 tc_pass, wall_time, out_size, time.time())
+            )
+            self.conn.commit()
+
+    @staticmethod
+    def completed(iv_run_info:list|None, py_run_info:list|None=None) -> bool:
+        """whether the processes of the run all completed (no timeout, no output overflow), so that the outcome is deterministic"""
+        iv_infos = [iv_run_info[2], iv_run_info[4]] if iv_run_info is not None else []
+        py_infos = [py_run_info[1]] if py_run_info is not None else []
+        for info in iv_infos + py_infos:
+            if (info is not None) and (info.get("timeout", False) or info.get("overflow", False)):
+                return False
+        return True
+
+    @staticmethod
+    def save_hit_info(dir, outcome:dict):
+        """note in the run dir that the simulation is skipped"""
+        with open(os.path.join(dir, OUTCOME_INFO_FILE), "w") as f:
+            f.write("simulation skipped, the outcome is taken from the outcome database (the same driver, DUT and checker)\n\n###outcome:\n%s\n" % (json.dumps(outcome, indent=4)))
+
+    @property
+    def hit_rate_total(self):
+        total = self.hits_total + self.misses_total
+        return round(self.hits_total / total, 4) if total else 0.0
+
+outcome_db = OutcomeDB()
@@ -0,0 +1,154 @@
+"""
+Description :   the long-lived python checker worker of the checker pool (see python_call.PyCheckerPool); not imported by the pipeline, started as a subprocess
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/6 10:15:42
+LastEdited  :   2025/3/6 10:15:42
+"""
+
+import os
+import sys
+import json
+import traceback
+import linecache
+import resource
+sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # the repo root
+from utils.subproc import BoundedCapture
+
+# imported once per worker; this is the startup cost saved for each checker
+PRELOAD_MODULES = ["math", "re", "numpy", "utils.tbout_parser", "utils.checker_runtime"] # utils.checker_runtime: the shared-golden checking (see TB3_funccheck.SHARED_CHECK_SCRIPT)
+WATCHED_MODULES = ["builtins", "math", "re", "numpy"] # the checkers must not change their attributes for the later jobs
+
+class OutputOverflow(BaseException):
+    # BaseException: not caught by "except Exception" in the checker codes; a bare "except:" can catch it, so the writer also remembers the overflow (see BoundedWriter.overflowed)
+    pass
+
+class BoundedWriter():
+    """
+    - the stdout/stderr of the checker; only the head and the tail are kept, OutputOverflow is raised when the total output of the job exceeds max_output
+    - after the overflow the writer is closed: the later writes are dropped and raise again; the job fails even if the checker catches OutputOverflow
+    """
+    def __init__(self, keep_size:int, counter:list[int], max_output:int|None) -> None:
+        self.capture = BoundedCapture(keep_size)
+        self.counter = counter # shared by stdout and stderr
+        self.max_output = max_output
+        self.overflowed = False
+
+    def write(self, text:str):
+        if self.overflowed:
+            raise OutputOverflow()
+        data = text.encode("utf-8", errors="replace")
+        self.capture.add(data)
+        self.counter[0] += len(data)
+        if (self.max_output is not None) and (self.counter[0] > self.max_output):
+            self.overflowed = True
+            raise OutputOverflow()
+        return len(text)
+
+    def flush(self):
+        pass
+
+    def getvalue(self) -> str:
+        return self.capture.getvalue().decode("utf-8", errors="replace")
+
+def global_state() -> dict:
+    """the interpreter state shared by the jobs of the worker that a checker may change: the imported modules, the attributes of WATCHED_MODULES, the numpy options and the recursion limit"""
+    state = {"modules": set(sys.modules), "recursion_limit": sys.getrecursionlimit()}
+    for name in WATCHED_MODULES:
+        if name in sys.modules:
+            state[name] = dict(vars(sys.modules[name]))
+    if "numpy" in sys.modules:
+        state["numpy_options"] = (sys.modules["numpy"].get_printoptions(), sys.modules["numpy"].geterr())
+    return state
+
+def state_changed(before:dict, after:dict) -> bool:
+    for key in before.keys() | after.keys():
+        if key in WATCHED_MODULES:
+            attrs_before, attrs_after = before.get(key, {}), after.get(key, {})
+            # the same objects, not only equal ones
+            if (attrs_before.keys() != attrs_after.keys()) or any(attrs_before[name] is not attrs_after[name] for name in attrs_before):
+                return True
+        elif before.get(key, None) != after.get(key, None):
+            return True
+    return False
+
+def run_job(job:dict) -> dict:
+    """
+    - execute the checker code in a fresh namespace in the dir of the checker, like "python3 checker.py" does
+    - job: {"code", "dir", "filename", "keep_size" (bytes), "max_output" (bytes or None)}
+    - "state_changed" in the result: the checker changed the interpreter state (see global_state), the worker must not run the later jobs
+    """
+    counter = [0]
+    out = BoundedWriter(job["keep_size"], counter, job["max_output"])
+    err = BoundedWriter(job["keep_size"], counter, None)
+    filename = job["filename"]
+    namespace = {"__name__": "__main__", "__file__": filename, "__builtins__": __builtins__}
+    state_before = global_state()
+    usage_start = resource.getrusage(resource.RUSAGE_SELF)
+    returncode = 0
+    overflow = False
+    os.chdir(job["dir"])
+    sys.path[0] = job["dir"]
+    sys.argv = [filename]
+    # the source lines in the traceback
+    linecache.cache[filename] = (len(job["code"]), None, job["code"].splitlines(True), filename)
+    sys.stdout, sys.stderr = out, err
+    try:
+        exec(compile(job["code"], filename, "exec"), namespace)
+    except SystemExit as e:
+        if e.code is None:
+            returncode = 0
+        elif isinstance(e.code, int):
+            returncode = e.code
+        else:
+            err.write(str(e.code) + "\n")
+            returncode = 1
+    except OutputOverflow:
+        overflow = True
+        returncode = 1
+    except BaseException:
+        # the frame of run_job is skipped, the traceback looks like the one of "python3 checker.py"
+        etype, value, tb = sys.exc_info()
+        err.write("".join(traceback.format_exception(etype, value, tb.tb_next)))
+        returncode = 1
+    finally:
+        sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
+    if out.overflowed and not overflow:
+        # the checker caught OutputOverflow
+        overflow = True
+        returncode = 1
+    usage_end = resource.getrusage(resource.RUSAGE_SELF)
+    tb_pass = namespace.get("tb_pass", None)
+    return {
+        "out": out.getvalue(),
+        "err": err.getvalue(),
+        "returncode": returncode,
+        "overflow": overflow,
+        "state_changed": state_changed(state_before, global_state()),
+        "out_size": counter[0],
+        "tb_pass": tb_pass if isinstance(tb_pass, list) else None,
+        "user_time": round(usage_end.ru_utime - usage_start.ru_utime, 4),
+        "sys_time": round(usage_end.ru_stime - usage_start.ru_stime, 4),
+        "max_rss": usage_end.ru_maxrss
+    }
+
+def main():
+    # the protocol uses the original stdin/stdout (one json per line); fd 1 is redirected to devnull so that the low-level writes of the checkers can not break it
+    proto_out = os.fdopen(os.dup(1), "w")
+    devnull = os.open(os.devnull, os.O_WRONLY)
+    os.dup2(devnull, 1)
+    for module in PRELOAD_MODULES:
+        try:
+            __import__(module)
+        except ImportError:
+            pass
+    proto_out.write(json.dumps({"ready": True}) + "\n")
+    proto_out.flush()
+    for line in sys.stdin:
+        if not line.strip():
+            continue
+        result = run_job(json.loads(line))
+        proto_out.write(json.dumps(result, default=str) + "\n")
+        proto_out.flush()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+"""
+Description :   the adaptive timeouts of the simulations and python checkers of one task: derived from the observed runtimes instead of a flat autoline.timeout, so that a hung testbench is killed early
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/12 10:47:05
+LastEdited  :   2025/3/12 10:47:05
+"""
+
+import statistics
+import threading
+from utils.utils import hash_str
+
+STAGE_DEFAULT_TIMEOUT = 120 # the timeout of the TBcheck and TBeval runs if the adaptive timeout is disabled (the default of iverilog_call and python_call)
+
+class AdaptiveTimeout():
+    """
+    - the timeout of one kind of runs (vvp simulation or python checker) of one task: k × the median wall time of the first successful runs, clamped to [floor, ceiling]
+    - the iverilog compilation is not sampled and keeps the fixed timeout of the caller (the compile_timeout of iverilog_call)
+    - the base timeout is used until enough runs are observed; if disabled, the default timeout of the caller is used
+    - the samples belong to one driver (or checker): they are dropped when a new code is tracked (see track), such as after the debugging, the correction or a reboot of TBgen
+    - the runs killed by the timeout are counted even if disabled
+    - thread-safe, shared by the stages (and the parallel runs) of the task
+    """
+    def __init__(self, base:float=STAGE_DEFAULT_TIMEOUT, en:bool=False, k:float=10, floor:float=5, ceiling:float|None=None, samples:int=3) -> None:
+        self.base = base
+        self.en = en
+        self.k = k
+        self.floor = floor
+        self.ceiling = ceiling if ceiling is not None else base
+        self.samples = samples
+        self.wall_times = [] # the wall times of the first successful runs of the tracked code
+        self.code_hash = None # the hash of the tracked code
+        self.kills = 0
+        self._lock = threading.Lock()
+
+    def track(self, code:str|None):
+        """the next runs are of this code (driver or checker); if it is not the tracked one, the old samples are dropped"""
+        if code is None:
+            return
+        code_hash = hash_str(code)
+        with self._lock:
+            if code_hash != self.code_hash:
+                self.code_hash = code_hash
+                self.wall_times = []
+
+    def value(self, default:float=STAGE_DEFAULT_TIMEOUT, runs:int=1) -> float:
+        """
+        - the timeout of the next run
+        - input:
+            - default: the timeout if disabled
+            - runs: the number of the usual runs done in this one (such as a multi-DUT harness simulating many RTLs)
+        """
+        if not self.en:
+            return default
+        with self._lock:
+            if len(self.wall_times) < self.samples:
+                return self.base
+            return round(min(max(self.k * statistics.median(self.wall_times) * runs, self.floor), self.ceiling), 2)
+
+    def observe(self, run_info:dict|None, sample:bool=True):
+        """
+        - record one run
+        - input:
+            - run_info: the result of the process (see utils.subproc.proc_run); None if not run
+            - sample: whether the wall time can be a sample of the usual runs; if False, only the timeout is counted
+        """
+        if run_info is None:
+            return
+        with self._lock:
+            if run_info.get("timeout", False):
+                self.kills += 1
+            elif sample and (not run_info["haserror"]) and (len(self.wall_times) < self.samples) and (run_info.get("wall_time", None) is not None):
+                self.wall_times.append(run_info["wall_time"])
+
+    def observe_iv(self, iv_run_info:list, sample:bool=True):
+        """record one iverilog run (see iverilog_call.iverilog_call): only the simulation (None if not run), the compilation has its fixed timeout"""
+        self.observe(iv_run_info[4], sample)
+
+class TaskTimeouts():
+    """
+    - the adaptive timeouts of one task: sim (vvp simulation) and py (python checker)
+    - see AdaptiveTimeout for the arguments
+    """
+    def __init__(self, base:float=STAGE_DEFAULT_TIMEOUT, en:bool=False, k:float=10, floor:float=5, ceiling:float|None=None, samples:int=3) -> None:
+        self.sim = AdaptiveTimeout(base, en, k, floor, ceiling, samples)
+        self.py = AdaptiveTimeout(base, en, k, floor, ceiling, samples)
+
+    def info(self) -> dict:
+        """the chosen timeouts and the number of runs killed by them, for the run info"""
+        info = {}
+        for kind, timeout in [("sim", self.sim), ("py", self.py)]:
+            info.update({
+                f"{kind}_timeout": timeout.value(timeout.base) if timeout.en else None,
+                f"{kind}_timeout_kills": timeout.kills
+            })
+        return info
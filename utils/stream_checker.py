@@ -0,0 +1,83 @@
+"""
+Description :   the streaming version of the generated python checker: the vectors are checked while the simulation is writing TBout (through a FIFO, see iverilog_call.iverilog_stream_call); not imported by the pipeline, started as a subprocess
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/10 10:21:37
+LastEdited  :   2025/3/10 10:21:37
+"""
+
+import os
+import sys
+import json
+import argparse
+sys.path[0] = os.path.dirname(os.path.dirname(os.path.abspath(__file__))) # the repo root
+from utils.checker_runtime import load_checker, is_sequential, SharedGoldenError
+from iverilog_call import STREAM_NO_WRITER
+from python_call import CHECKER_RESULT_FILE
+
+FIRST_FAIL_MARK = "[stream checker] first failure found, stopped"
+NOT_STREAMABLE_EXIT = 3 # the checker does not follow the generated layout
+
+def stream_check(namespace:dict, tbout_file, stop_on_fail:bool=False, tee_file=None) -> tuple[list, bool]:
+    """
+    - the same checking as check_dut in the generated checkers, one TBout line at a time
+    - output: (failed scenarios, stopped early)
+    """
+    golden_dut = namespace["GoldenDUT"]()
+    parse = namespace["SignalTxt_to_dictlist"]
+    sequential = is_sequential(namespace)
+    failed_scenarios = []
+    for line_idx, line in enumerate(tbout_file):
+        if line.endswith(STREAM_NO_WRITER):
+            if line_idx == 0 and line == STREAM_NO_WRITER:
+                # same as the normal checker when TBout.txt does not exist
+                raise FileNotFoundError("TBout.txt is not written by the simulation")
+            # sent after the end of the trace, not a part of it
+            line = line[:-len(STREAM_NO_WRITER)]
+            if not line:
+                continue
+        if tee_file is not None:
+            tee_file.write(line)
+        if not line.strip():
+            continue
+        for vector in parse(line):
+            if (not sequential) or vector.get("check_en", True):
+                if not golden_dut.check(vector):
+                    print(f"Failed; vector: {vector}")
+                    failed_scenarios.append(vector["scenario"])
+                    if stop_on_fail:
+                        return failed_scenarios, True
+            if sequential:
+                golden_dut.load(vector)
+    return failed_scenarios, False
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("checker", help="the generated checker file")
+    parser.add_argument("tbout", help="the TBout FIFO (or file)")
+    parser.add_argument("--stop-on-fail", action="store_true", help="stop at the first failed vector (only pass/fail is needed)")
+    parser.add_argument("--tee", default=None, help="also save the streamed TBout to this file")
+    args = parser.parse_args()
+    sys.path.insert(0, os.getcwd())
+    with open(args.checker, "r") as f:
+        checker_code = f.read()
+    try:
+        namespace = load_checker(checker_code)
+    except SharedGoldenError as e:
+        print(f"not streamable: {e}", file=sys.stderr)
+        sys.exit(NOT_STREAMABLE_EXIT)
+    tee_file = open(args.tee, "w") if args.tee else None
+    try:
+        with open(args.tbout, "r") as tbout_file:
+            failed_scenarios, stopped = stream_check(namespace, tbout_file, args.stop_on_fail, tee_file)
+    finally:
+        if tee_file is not None:
+            tee_file.close()
+    if stopped:
+        print(FIRST_FAIL_MARK)
+    print(failed_scenarios)
+    # the same result file as the generated checkers
+    with open(CHECKER_RESULT_FILE, "w") as f:
+        json.dump({"failed_scenarios": failed_scenarios, "stopped_early": stopped}, f, default=str)
+
+if __name__ == "__main__":
+    main()
@@ -2,44 +2,229 @@
 Description :   This file is related to auto subprocess running
 Author      :   Ruidi Qiu (r.qiu@tum.de)
 Time        :   2023/12/11 14:06:27
-LastEdited  :   2024/4/28 13:26:18
+LastEdited  :   2025/3/5 16:47:30
 """
 
+import os
+import time
+import shlex
+import signal
+import threading
 import subprocess as sp
+try:
+    import resource
+except ImportError: # not available on windows
+    resource = None
 
-def subproc_call(cmd, timeout=120):
-    """ 
-    run a cmd in shell and return the output and error
+READ_CHUNK = 65536 # bytes
+RATE_WINDOW = 1 # seconds; the output rate is only checked after this time
+OVERFLOW_ERROR = "output overflow (%d bytes). the program is killed since it writes too much output. Hints: there might be a $display/print in an infinite or very long loop."
+
+# default resource limits of the subprocesses, see set_default_limits; None means no limit
+DEFAULT_LIMITS = {"cpu_time": None, "mem_size": None, "keep_size": 4096, "max_output": None, "max_rate": None}
+
+def set_default_limits(cpu_time:int|None=None, mem_size:int|None=None, keep_size:int=4096, max_output:int|None=None, max_rate:int|None=None):
+    """
+    set the default resource limits of all the subprocesses started by proc_run
+    - cpu_time: int, seconds (RLIMIT_CPU); None means no limit
+    - mem_size: int, MB (RLIMIT_AS); None means no limit
+    - keep_size: int, KB; the max captured bytes of stdout (and stderr), the head and the tail are kept
+    - max_output: int, MB; the process is killed (output overflow) when stdout + stderr exceed it; None means no limit
+    - max_rate: int, MB/s; the process is killed (output overflow) when its average output rate exceeds it; None means no limit
+    """
+    DEFAULT_LIMITS["cpu_time"] = cpu_time
+    DEFAULT_LIMITS["mem_size"] = mem_size
+    DEFAULT_LIMITS["keep_size"] = keep_size
+    DEFAULT_LIMITS["max_output"] = max_output
+    DEFAULT_LIMITS["max_rate"] = max_rate
+
+def apply_limits(pid:int, limits:dict):
+    # prlimit is applied from the parent after spawning (preexec_fn is not safe in multi-threaded programs)
+    if resource is None or not hasattr(resource, "prlimit"):
+        return
+    try:
+        if limits.get("cpu_time") is not None:
+            resource.prlimit(pid, resource.RLIMIT_CPU, (limits["cpu_time"], limits["cpu_time"]))
+        if limits.get("mem_size") is not None:
+            mem_bytes = limits["mem_size"] * 1024 * 1024
+            resource.prlimit(pid, resource.RLIMIT_AS, (mem_bytes, mem_bytes))
+    except (OSError, ValueError):
+        # the process may have already exited
+        pass
+
+def kill_group(p:sp.Popen):
+    try:
+        os.killpg(p.pid, signal.SIGKILL)
+    except (OSError, AttributeError):
+        p.kill()
+
+class BoundedCapture():
+    """
+    - the captured output of one pipe; only the head and the tail (keep_size bytes in total) are kept in memory, the middle is dropped
+    """
+    def __init__(self, keep_size:int) -> None:
+        self.head_size = keep_size // 2
+        self.tail_size = keep_size - self.head_size
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.total = 0
+
+    def add(self, chunk:bytes):
+        self.total += len(chunk)
+        if len(self.head) < self.head_size:
+            n_head = self.head_size - len(self.head)
+            self.head += chunk[:n_head]
+            chunk = chunk[n_head:]
+        if chunk:
+            self.tail += chunk
+            if len(self.tail) > self.tail_size:
+                del self.tail[:len(self.tail) - self.tail_size]
+
+    @property
+    def dropped(self):
+        return self.total - len(self.head) - len(self.tail)
+
+    def getvalue(self) -> bytes:
+        if self.dropped == 0:
+            return bytes(self.head + self.tail)
+        return bytes(self.head) + b"\n...[%d bytes dropped]...\n" % (self.dropped) + bytes(self.tail)
+
+def proc_run(argv:list[str], timeout=120, cwd=None, limits:dict|None=None, env:dict|None=None) -> dict:
+    """
+    run a command without shell; thread-safe (the working dir is passed to the subprocess instead of os.chdir)
     #### input:
-    - cmd: str
-    - timeout: int, seconds
+    - argv: list of str, the program and its arguments
+    - timeout: int, seconds; the whole process group is killed when timeout
+    - cwd: str, the working dir of the cmd; None means the current dir
+    - limits: {"cpu_time": seconds, "mem_size": MB, "keep_size": KB, "max_output": MB, "max_rate": MB/s}; None means DEFAULT_LIMITS (see set_default_limits)
+    - env: dict, the environment variables of the subprocess; None means the same as the current process
     #### output:
-    - {"out": out_reg, "err": err_reg, "haserror": error_exist}
-        - out_reg: str, output of cmd
-        - err_reg: str, error of cmd
-        - error_exist: int, 0 if no error, 1 if error
-    
-    cmd can at most run 2 minutes and if it exceeds, will return {"out": "timeout", "err": "program is timeout", "haserror": 1}
-    """
-    # p = sp.Popen(cmd, shell=True, stdout=sp.PIPE, stderr=sp.PIPE)
-    # out, err = p.communicate()
-    # error_exist = p.returncode
-    # out_reg = out.decode("utf-8")
-    # err_reg = err.decode("utf-8")
+    - {"out", "err", "haserror", "returncode", "timeout", "overflow", "out_size", "wall_time", "user_time", "sys_time", "max_rss"}
+        - out/err: str, stdout/stderr of cmd (only the head and the tail if longer than keep_size)
+        - haserror: int, 0 if no error, otherwise the return code (1 if timeout or overflow)
+        - returncode: int, the return code; negative if killed by a signal
+        - timeout: bool, whether the process is killed because of timeout
+        - overflow: bool, whether the process is killed because its output exceeds max_output or max_rate
+        - out_size: int, the total bytes written to stdout and stderr
+        - wall_time/user_time/sys_time: float, seconds
+        - max_rss: int, the max resident set size of the process, unit: KB; None if not available
+    """
+    limits = DEFAULT_LIMITS if limits is None else limits
+    keep_size = (limits.get("keep_size") or DEFAULT_LIMITS["keep_size"]) * 1024
+    max_output = limits["max_output"] * 1024 * 1024 if limits.get("max_output") is not None else None
+    max_rate = limits["max_rate"] * 1024 * 1024 if limits.get("max_rate") is not None else None
     timeouterror = "program is timeout (time > %ds). please check your code. Hints: there might be some infinite loop, please check all the loops in your programm. If it is a verilog code, please check if there is a $finish in the code."%(timeout)
-    p = sp.Popen(cmd, shell=True, stdout=sp.PIPE, stderr=sp.PIPE)
-    out_reg = ""
-    err_reg = ""
-    error_exist = 0
+    start = time.perf_counter()
     try:
-        out, err = p.communicate(timeout=timeout)
-        out_reg = out.decode("utf-8")
-        err_reg = err.decode("utf-8")
-        error_exist = p.returncode
-    except sp.TimeoutExpired:
-        p.kill()
+        p = sp.Popen(argv, stdout=sp.PIPE, stderr=sp.PIPE, cwd=cwd, env=env, start_new_session=(os.name != 'nt'))
+    except OSError as e:
+        # program or cwd not found; same return code as the shell
+        return _result(b"", str(e).encode("utf-8"), 127, False, False, 0, timeouterror, time.perf_counter() - start, None)
+    apply_limits(p.pid, limits)
+    # read the pipes in threads (bounded) and reap the process with wait4 to get its rusage
+    captures = {"out": BoundedCapture(keep_size), "err": BoundedCapture(keep_size)}
+    outputs = {"overflow": False}
+    lock = threading.Lock()
+    def read(name, pipe):
+        while True:
+            chunk = pipe.read1(READ_CHUNK)
+            if not chunk:
+                break
+            with lock:
+                captures[name].add(chunk)
+                if outputs["overflow"]:
+                    continue
+                out_size = captures["out"].total + captures["err"].total
+                elapsed = time.perf_counter() - start
+                if (max_output is not None and out_size > max_output) or (max_rate is not None and elapsed >= RATE_WINDOW and out_size / elapsed > max_rate):
+                    outputs["overflow"] = True
+                    kill_group(p)
+        pipe.close()
+    def reap():
+        if hasattr(os, "wait4"):
+            _, status, rusage = os.wait4(p.pid, 0)
+            outputs["returncode"] = os.waitstatus_to_exitcode(status)
+            outputs["rusage"] = rusage
+        else:
+            # no rusage on this platform
+            outputs["returncode"] = p.wait()
+            outputs["rusage"] = None
+    readers = [threading.Thread(target=read, args=(name, pipe), daemon=True) for name, pipe in [("out", p.stdout), ("err", p.stderr)]]
+    reaper = threading.Thread(target=reap, daemon=True)
+    for thread in readers + [reaper]:
+        thread.start()
+    reaper.join(timeout)
+    timeout_flag = reaper.is_alive()
+    if timeout_flag:
+        kill_group(p)
+        reaper.join()
+    else:
+        grace_end = time.perf_counter() + 1
+        for thread in readers:
+            thread.join(max(0, grace_end - time.perf_counter()))
+        if any(thread.is_alive() for thread in readers):
+            # the children left in the group keep the pipes open
+            kill_group(p)
+    for thread in readers:
+        thread.join()
+    p.returncode = outputs["returncode"]
+    wall_time = time.perf_counter() - start
+    out_size = captures["out"].total + captures["err"].total
+    return _result(captures["out"].getvalue(), captures["err"].getvalue(), p.returncode, timeout_flag and not outputs["overflow"], outputs["overflow"], out_size, timeouterror, wall_time, outputs["rusage"])
+
+def _result(out:bytes, err:bytes, returncode:int, timeout_flag:bool, overflow_flag:bool, out_size:int, timeouterror:str, wall_time:float, rusage) -> dict:
+    if timeout_flag:
         out_reg = ""
         err_reg = timeouterror
         error_exist = 1
-    return {"out": out_reg, "err": err_reg, "haserror": error_exist}
+    elif overflow_flag:
+        # the captured head and tail are kept for debugging
+        out_reg = out.decode("utf-8", errors="replace")
+        err_reg = err.decode("utf-8", errors="replace") + "\n" + OVERFLOW_ERROR % (out_size)
+        error_exist = 1
+    else:
+        out_reg = out.decode("utf-8", errors="replace")
+        err_reg = err.decode("utf-8", errors="replace")
+        error_exist = returncode
+    return {
+        "out": out_reg,
+        "err": err_reg,
+        "haserror": error_exist,
+        "returncode": returncode,
+        "timeout": timeout_flag,
+        "overflow": overflow_flag,
+        "out_size": out_size,
+        "wall_time": round(wall_time, 4),
+        "user_time": round(rusage.ru_utime, 4) if rusage is not None else None,
+        "sys_time": round(rusage.ru_stime, 4) if rusage is not None else None,
+        "max_rss": rusage.ru_maxrss if rusage is not None else None
+    }
+
+def run_stat_line(run_info:dict) -> str:
+    """
+    the timing and rusage of a run (result of proc_run) in one line; "" if not available (such as the cached results)
+    """
+    if run_info.get("user_time") is None:
+        return ""
+    outcome = " (timeout)" if run_info.get("timeout") else (" (output overflow)" if run_info.get("overflow") else "")
+    return "time: wall %ss, user %ss, sys %ss, max rss %s KB, output %s bytes%s\n" % (run_info["wall_time"], run_info["user_time"], run_info["sys_time"], run_info["max_rss"], run_info.get("out_size"), outcome)
 
+def subproc_call(cmd, timeout=120, cwd=None, limits:dict|None=None):
+    """
+    run a cmd and return the output and error; the cmd is run without shell (see proc_run)
+    #### input:
+    - cmd: str or list of str; a str is split into argv like a shell does (no pipes, redirections or variables)
+    - timeout: int, seconds
+    - cwd: str, the working dir of the cmd; None means the current dir. Use this instead of os.chdir, which is not thread-safe
+    - limits: the resource limits, see proc_run
+    #### output:
+    - {"out": out_reg, "err": err_reg, "haserror": error_exist, ...}
+        - out_reg: str, output of cmd
+        - err_reg: str, error of cmd
+        - error_exist: int, 0 if no error, 1 if error
+        - other keys: the timing and rusage, see proc_run
+
+    cmd can at most run 2 minutes and if it exceeds, will return {"out": "", "err": "program is timeout", "haserror": 1, ...}
+    """
+    argv = shlex.split(cmd) if isinstance(cmd, str) else list(cmd)
+    return proc_run(argv, timeout, cwd, limits)
@@ -0,0 +1,202 @@
+"""
+Description :   the fast parser of TBout.txt (the signal trace written by the testbench) for the python checkers. The generated checkers import it if available, otherwise they use their own SignalTxt_to_dictlist (see STAGE5_SEQ_CODE2 and STAGEPYGEN_TAIL2 in prompt_scripts)
+Author      :   Ruidi Qiu (r.qiu@tum.de)
+Time        :   2025/3/9 15:02:11
+LastEdited  :   2025/3/9 15:02:11
+"""
+
+import re
+from collections.abc import MutableSequence
+import numpy as np
+
+ITEM_RE = re.compile(r"(\w+) = ")
+LINE_START_RE = re.compile(r"^(?:\[check\]|scenario)", re.MULTILINE) # the lines parsed in the SEQ mode
+
+class TBoutTable():
+    """
+    - the columnar form of a TBout
+    - attributes:
+        - names: the signal names, in the order of the TBout lines
+        - scenarios: list of str, the scenario of each line
+        - check_en: np.ndarray of bool, whether each line is a [check] line
+        - columns: {signal name: list of values}; int, or 0/the raw str if it has x or z (see parse_tbout)
+    """
+    def __init__(self, names:list[str], scenarios:list[str], check_en:np.ndarray, columns:dict[str, list]) -> None:
+        self.names = names
+        self.scenarios = scenarios
+        self.check_en = check_en
+        self.columns = columns
+
+    def __len__(self):
+        return len(self.scenarios)
+
+    def array(self, name:str) -> np.ndarray:
+        """the values of one signal as an array; int64 if all the values fit, otherwise object"""
+        try:
+            return np.array(self.columns[name], dtype=np.int64)
+        except (OverflowError, ValueError, TypeError):
+            return np.array(self.columns[name], dtype=object)
+
+class VectorView(MutableSequence):
+    """
+    - the list-of-dicts view of a TBoutTable, the same as the result of the SignalTxt_to_dictlist in the generated checkers
+    - each dict is built at its first access and kept, so the changes to the vectors (and to the list) stay like in a list of dicts
+    - mode "SEQ": {"check_en", "scenario", signals...}; mode "CMB": {"scenario", signals...}
+    """
+    def __init__(self, table:TBoutTable, mode:str="SEQ") -> None:
+        self.table = table
+        self.with_check_en = (mode == "SEQ")
+        self._vectors = [None] * len(table) # the built dicts; None if not accessed yet
+
+    def __len__(self):
+        return len(self._vectors)
+
+    def _build(self, idx:int) -> dict:
+        vector = {"check_en": bool(self.table.check_en[idx])} if self.with_check_en else {}
+        vector["scenario"] = self.table.scenarios[idx]
+        for name in self.table.names:
+            vector[name] = self.table.columns[name][idx]
+        return vector
+
+    def _build_all(self):
+        # before the changes of the list itself: the positions no longer match the table afterwards
+        for idx, vector in enumerate(self._vectors):
+            if vector is None:
+                self._vectors[idx] = self._build(idx)
+
+    def __getitem__(self, idx):
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError("vector index out of range")
+        if self._vectors[idx] is None:
+            self._vectors[idx] = self._build(idx)
+        return self._vectors[idx]
+
+    def __setitem__(self, idx, value):
+        if isinstance(idx, slice):
+            self._build_all()
+        self._vectors[idx] = value
+
+    def __delitem__(self, idx):
+        self._build_all()
+        del self._vectors[idx]
+
+    def insert(self, idx, value):
+        self._build_all()
+        self._vectors.insert(idx, value)
+
+    def __eq__(self, other):
+        if isinstance(other, (list, VectorView)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self):
+        return repr(list(self))
+
+def _value_seq(value:str):
+    if ("x" not in value) and ("X" not in value) and ("z" not in value):
+        return int(value)
+    return 0
+
+def _value_cmb(value:str):
+    if "x" not in value and "z" not in value:
+        return int(value)
+    return value
+
+def _layout_re(names:list[str]) -> re.Pattern:
+    # one line of the readable format with these signals; all the lines are matched at once
+    items = "".join([r", %s = ([^,\n]*?)" % re.escape(name) for name in names])
+    return re.compile(r"^(\[check\])?scenario: ([^,:\n]*?)%s[ \t\r]*$" % items, re.MULTILINE)
+
+def parse_tbout(txt:str, mode:str="SEQ") -> TBoutTable:
+    """
+    - parse the TBout into columns; the results are the same as the SignalTxt_to_dictlist of the generated checkers
+    - input:
+        - mode: "SEQ" (the lines without "[check]" or "scenario" at the beginning are skipped; x/z -> 0; spaces removed from the scenario) or "CMB" (every line is a vector; x/z values are kept as str)
+    """
+    value_func = _value_seq if mode == "SEQ" else _value_cmb
+    txt = txt.strip()
+    # fast path: all the lines have the same signals in the same order, the trace is matched by one regex and converted column by column
+    first_line = txt.split("\n", 1)[0].strip()
+    layout_names = ITEM_RE.findall(first_line)
+    if (first_line.startswith("[check]") or first_line.startswith("scenario")) and ("scenario" not in "".join(layout_names)):
+        matches = _layout_re(layout_names).findall(txt)
+        if mode == "SEQ":
+            line_num = len(LINE_START_RE.findall(txt))
+        else:
+            line_num = txt.count("\n") + 1
+        if len(matches) == line_num:
+            return _from_matches(matches, layout_names, mode, value_func)
+    return _parse_lines(txt.split("\n"), mode, value_func)
+
+def _from_matches(matches:list[tuple], names:list[str], mode:str, value_func) -> TBoutTable:
+    groups = list(zip(*matches)) if matches else [()] * (len(names) + 2)
+    check_en = np.array([flag == "[check]" for flag in groups[0]], dtype=bool)
+    scenarios = [scenario.replace(" ", "") for scenario in groups[1]] if mode == "SEQ" else list(groups[1])
+    columns = {}
+    for name_idx, name in enumerate(names):
+        values = groups[name_idx + 2]
+        try:
+            # the common case: no x/z in this signal
+            columns[name] = list(map(int, values))
+        except ValueError:
+            columns[name] = [value_func(value) for value in values]
+    return TBoutTable(names, scenarios, check_en, columns)
+
+def _parse_lines(lines:list[str], mode:str, value_func) -> TBoutTable:
+    # the general path, line by line like the SignalTxt_to_dictlist of the generated checkers; the lines may have different signals
+    vectors = []
+    for line in lines:
+        vector = {}
+        if mode == "SEQ":
+            if line.startswith("[check]"):
+                vector["check_en"] = True
+                line = line[7:]
+            elif line.startswith("scenario"):
+                vector["check_en"] = False
+            else:
+                continue
+        for item in line.strip().split(", "):
+            if "scenario" in item:
+                item = item.split(": ")
+                vector["scenario"] = item[1].replace(" ", "") if mode == "SEQ" else item[1]
+            else:
+                item = item.split(" = ")
+                vector[item[0]] = value_func(item[1])
+        vectors.append(vector)
+    keys = list(vectors[0].keys()) if vectors else []
+    head = ["check_en", "scenario"] if mode == "SEQ" else ["scenario"]
+    check_en = np.array([vector.get("check_en", False) for vector in vectors], dtype=bool)
+    if keys[:len(head)] != head or any(list(vector.keys()) != keys for vector in vectors):
+        # the dicts of the lines are different, the columns cannot represent them
+        return _RaggedTable(vectors, check_en)
+    names = keys[len(head):]
+    columns = {name: [vector[name] for vector in vectors] for name in names}
+    return TBoutTable(names, [vector["scenario"] for vector in vectors], check_en, columns)
+
+class _RaggedTable(TBoutTable):
+    # the lines have different signals; each line keeps its own dict
+    def __init__(self, vectors:list[dict], check_en:np.ndarray) -> None:
+        names = []
+        for vector in vectors:
+            names += [name for name in vector if name not in names and name not in ["check_en", "scenario"]]
+        super().__init__(names, [vector.get("scenario", None) for vector in vectors], check_en, {name: [vector.get(name, None) for vector in vectors] for name in names})
+        self.vectors = vectors
+
+class _RaggedView(VectorView):
+    def _build(self, idx:int) -> dict:
+        return dict(self.table.vectors[idx])
+
+def dictlist_view(table:TBoutTable, mode:str="SEQ") -> VectorView:
+    return _RaggedView(table, mode) if isinstance(table, _RaggedTable) else VectorView(table, mode)
+
+def SignalTxt_to_dictlist_SEQ(txt:str) -> VectorView:
+    """the drop-in replacement of SignalTxt_to_dictlist in the SEQ checkers (STAGE5_SEQ_CODE2)"""
+    return dictlist_view(parse_tbout(txt, "SEQ"), "SEQ")
+
+def SignalTxt_to_dictlist_CMB(txt:str) -> VectorView:
+    """the drop-in replacement of SignalTxt_to_dictlist in the CMB checkers (STAGEPYGEN_TAIL2)"""
+    return dictlist_view(parse_tbout(txt, "CMB"), "CMB")
@@ -8,6 +8,10 @@ import time
 import datetime
 import collections
 import os
+import shutil
+import fnmatch
+import tempfile
+import hashlib
 import tiktoken
 import threading
 from functools import wraps
@@ -155,6 +159,8 @@ def get_time_compact():
 class run_in_dir:
     """
     change the current directory to a new directory, and then change it back after the code block
+
+    Not thread-safe (os.chdir is process-global); to run a subprocess in a dir, use the cwd of utils.subproc.proc_run instead.
     
     Args:
         dir (str): the new directory (relative path to the current directory)
@@ -168,6 +174,63 @@ class run_in_dir:
     def __exit__(self, *args):
         os.chdir(self.old_dir)
 
+class scratch_dir:
+    """
+    a temporary workspace on a RAM-backed root (tmpfs such as /dev/shm) for the files that will not be saved (such as the compiling files when autoline.save_compile is False). 
+    
+    After the code block, the small result records (files matching keep_patterns, subdirs included) are copied to the final dir and the workspace is removed without any shell command.
+
+    Args:
+        final_dir (str): the dir to keep the result records
+        keep_patterns (list[str]): the fnmatch patterns of the file names to keep; default: ["run_info*"]
+
+    Example:
+    ::
+
+        with scratch_dir("saves/task/RTL_1") as work_dir:
+            run_something(work_dir) # the run_info*.txt will be copied to saves/task/RTL_1
+    """
+    en = False
+    root = None
+
+    @classmethod
+    def set_config(cls, en:bool, root:str=None):
+        """
+        - root: the root dir of the workspaces; if None, use /dev/shm if writable, otherwise the system temp dir
+        """
+        cls.en = en
+        if root is None:
+            root = "/dev/shm" if (os.path.isdir("/dev/shm") and os.access("/dev/shm", os.W_OK)) else tempfile.gettempdir()
+        cls.root = root
+
+    def __init__(self, final_dir, keep_patterns=["run_info*"]):
+        self.final_dir = final_dir
+        self.keep_patterns = keep_patterns
+
+    def __enter__(self):
+        root = self.root if self.root is not None else tempfile.gettempdir()
+        os.makedirs(root, exist_ok=True)
+        self.work_dir = tempfile.mkdtemp(prefix="correctbench_", dir=root)
+        return self.work_dir
+
+    def __exit__(self, *args):
+        for dirpath, _, filenames in os.walk(self.work_dir):
+            for filename in filenames:
+                if any(fnmatch.fnmatch(filename, pattern) for pattern in self.keep_patterns):
+                    final_subdir = os.path.join(self.final_dir, os.path.relpath(dirpath, self.work_dir))
+                    os.makedirs(final_subdir, exist_ok=True)
+                    shutil.copyfile(os.path.join(dirpath, filename), os.path.join(final_subdir, filename))
+        shutil.rmtree(self.work_dir, ignore_errors=True)
+
+def remove_files_except(dir, keep_patterns=["run_info*"]):
+    """
+    remove all the files in the dir (subdirs included) except the ones matching keep_patterns
+    """
+    for dirpath, _, filenames in os.walk(dir):
+        for filename in filenames:
+            if not any(fnmatch.fnmatch(filename, pattern) for pattern in keep_patterns):
+                os.remove(os.path.join(dirpath, filename))
+
 ################# utils from pytorch ###############
 def _ntuple(n, name="parse"):
     def parse(x):
@@ -185,6 +248,12 @@ _quadruple = _ntuple(4, "_quadruple")
 
 
 ################# some tools #################
+def hash_str(content:str) -> str:
+    """
+    the sha256 hex digest of a string; used as the content-addressed key of codes
+    """
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
 def clean_wave_vcd(clean_dir, cnt_en=False):
     """
     remove all the "wave.vcd" files in the directory